@@ -1,15 +1,18 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
-import io
 import os
 import html
 import logging
 from logging.handlers import RotatingFileHandler
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 from datetime import datetime, timedelta, timezone
-from tool_tinh_toan import ToolAnDinhTanSo
+from tool_tinh_toan import (ToolAnDinhTanSo, ToolRegistry, MasterDataset, ScanProgress, ScanCancelled,
+                            rank_available, hash_uploaded_files, query_cache_stats)
+from xuat_ket_qua import (INPUT_SNAPSHOT_LABELS, to_excel, available_export_frame,
+                          unavailable_export_frame, conflict_export_frame)
 import importlib
 import gc  # --- BỔ SUNG: THƯ VIỆN GIẢI PHÓNG BỘ NHỚ CHỦ ĐỘNG ---
 
@@ -132,17 +135,123 @@ except Exception:
 # =============================================================================
 # TỐI ƯU HÓA BỘ NHỚ (RAM) - MỤC 2
 # =============================================================================
-@st.cache_resource(show_spinner="Đang nạp file vào bộ nhớ, vui lòng chờ...")
+# Ngân sách RAM cho các bộ dữ liệu đã nạp (dùng chung mọi phiên), MB
+TOOL_CACHE_BUDGET_MB = int(os.environ.get("PMR_TOOL_CACHE_MB", "1024"))
+# Phiên không thao tác quá thời gian này thì nhả tham chiếu tới bộ dữ liệu (giây)
+SESSION_IDLE_RELEASE_SECONDS = 1800
+# File dữ liệu gốc trên máy chủ (bản xuất CSDL giấy phép hằng đêm); để trống = chỉ dùng file người dùng tải lên
+MASTER_DATASET_PATH = os.environ.get("PMR_MASTER_DATASET", "")
+MASTER_DATASET_CHECK_SECONDS = float(os.environ.get("PMR_MASTER_CHECK_SECONDS", "30"))
+
+@st.cache_resource
+def get_master_dataset():
+    """Nạp dữ liệu gốc một lần khi khởi động, dùng chung mọi phiên; tự nạp lại khi file thay đổi"""
+    # Đã cấu hình đường dẫn thì luôn dựng MasterDataset (kể cả khi file chưa có): get() nạp khi file xuất hiện
+    if not MASTER_DATASET_PATH:
+        return None
+    master = MasterDataset(MASTER_DATASET_PATH, check_interval=MASTER_DATASET_CHECK_SECONDS)
+    master.load()
+    gc.collect()
+    return master
+
+def get_master_tool():
+    """Tool của dữ liệu gốc hiện hành; None khi chưa cấu hình hoặc file chưa nạp được"""
+    master = get_master_dataset()
+    return master.get() if master else None
+
+@st.cache_resource
+def get_tool_registry():
+    """Kho Tool dùng chung toàn tiến trình, khóa theo nội dung file; thay cho việc xóa toàn bộ cache"""
+    return ToolRegistry(TOOL_CACHE_BUDGET_MB * 1024 * 1024)
+
 def get_tool_instance(uploaded_files):
     """Giữ đối tượng Tool trong bộ nhớ (Cache) để tránh đọc lại file nhiều lần tốn RAM"""
-    if uploaded_files:
-        try:
+    if not uploaded_files:
+        # Không tải file lên: dùng dữ liệu gốc của máy chủ (nếu có cấu hình)
+        return get_master_tool()
+    # Băm nội dung file một lần cho mỗi lần upload; hai phiên cùng file dùng chung một Tool
+    if st.session_state.dataset_key is None:
+        st.session_state.dataset_key = hash_uploaded_files(uploaded_files)
+
+    def build():
+        with st.spinner("Đang nạp file vào bộ nhớ, vui lòng chờ..."):
             instance = ToolAnDinhTanSo(uploaded_files)
-            gc.collect() # Dọn RAM tức thì sau khi đọc
-            return instance
-        except Exception as e:
-            raise e
-    return None
+        gc.collect() # Dọn RAM tức thì sau khi đọc
+        return instance
+    return get_tool_registry().acquire(st.session_state.session_id, st.session_state.dataset_key, build)
+
+# =============================================================================
+# CHẠY TÍNH TOÁN NỀN (KHÔNG CHẶN LUỒNG SCRIPT CỦA PHIÊN)
+# =============================================================================
+# Số luồng tính toán nền dùng chung mọi phiên; chu kỳ làm mới giao diện khi đang chờ kết quả (giây)
+CALC_WORKER_THREADS = int(os.environ.get("PMR_CALC_THREADS", "2"))
+CALC_POLL_SECONDS = 0.5
+
+# Loại tác vụ -> (khóa kết quả trong session_state, nhãn hiển thị khi đang chạy, tên ACTION trong log)
+CALC_JOB_KINDS = {
+    "AVAILABLE": ("results", "Đang tính toán tần số khả dụng", "CALC"),
+    "UNAVAILABLE": ("bad_freq_results", "Đang quét dải tần đã chọn", "SCAN_BAD"),
+    "CHECK_SPECIFIC": ("check_result", "Đang kiểm tra tần số", "CHECK"),
+}
+
+@st.cache_resource
+def get_calc_executor():
+    """Nhóm luồng chạy tinh_toan / tim_cac_tan_so_khong_kha_dung / kiem_tra_tan_so_cu_the ngoài luồng script"""
+    return ThreadPoolExecutor(max_workers=CALC_WORKER_THREADS, thread_name_prefix="pmr-calc")
+
+def cancel_calc_job():
+    """Hủy tác vụ nền của phiên (nếu có): engine dừng ở khối ứng viên kế tiếp"""
+    job = st.session_state.calc_job
+    if job is not None:
+        job["progress"].cancel()
+        job["future"].cancel()
+        st.session_state.calc_job = None
+
+def submit_calc_job(kind, compute, input_snapshot=None, partial=None):
+    """
+    Đưa compute(progress) vào luồng nền, lưu handle vào session_state để các lần chạy lại script theo dõi.
+    partial: list kết quả tạm mà compute ghi dần vào (hiển thị trong lúc chờ), None nếu tác vụ không trả dần
+    """
+    cancel_calc_job()
+    progress = ScanProgress()
+    st.session_state.calc_job = {
+        "kind": kind,
+        "progress": progress,
+        "future": get_calc_executor().submit(compute, progress),
+        "input_snapshot": input_snapshot,
+        "partial": partial,
+        "started": time.time(),
+    }
+
+def finish_calc_job(job):
+    """Tác vụ nền đã xong: ghi kết quả vào session_state (hoặc báo lỗi / đã hủy)"""
+    result_key, _, action = CALC_JOB_KINDS[job["kind"]]
+    st.session_state.calc_job = None
+    try:
+        result = job["future"].result()
+    except (ScanCancelled, CancelledError):
+        log_info(f"SESS: {st.session_state.session_id} | ACTION: {action}_CANCELLED | After: {time.time() - job['started']:.1f}s")
+        st.info("Đã hủy tính toán.")
+        st.session_state.active_view = None
+        return
+    except Exception as e:
+        log_exception(f"SESS: {st.session_state.session_id} | ACTION: {action}_EXCEPTION | Error: {e}")
+        st.error(f"Có lỗi xảy ra: {e}")
+        st.session_state.active_view = None
+        return
+
+    st.session_state[result_key] = result
+    if job["input_snapshot"] is not None:
+        st.session_state.input_snapshot = job["input_snapshot"]
+    if job["kind"] == "AVAILABLE":
+        log_info(f"SESS: {st.session_state.session_id} | ACTION: CALC_SUCCESS | Found: {len(result)} freqs")
+    elif job["kind"] == "UNAVAILABLE":
+        log_info(f"SESS: {st.session_state.session_id} | ACTION: SCAN_BAD_SUCCESS | Found: {len(result)} bad freqs")
+    else:
+        log_info(f"SESS: {st.session_state.session_id} | ACTION: CHECK_SUCCESS | Status: {result.get('status', 'UNKNOWN')}")
+
+    # --- ÉP GIẢI PHÓNG RAM NGAY SAU KHI TÍNH TOÁN XONG ---
+    gc.collect()
 # =============================================================================
 # =============================================================================
 # THEO DÕI SỐ LƯỢNG NGƯỜI DÙNG ONLINE
@@ -400,49 +509,6 @@ def decimal_to_dms(decimal):
     
     return d * sign, m, s
 
-def neutralize_excel_value(val):
-    if pd.isna(val): return val
-    s = str(val)
-    if s and s[0] in ('=', '+', '-', '@'): return "'" + s
-    return s
-def neutralize_df_for_excel(df):
-    """Xử lý rác Excel, tương thích cả Pandas cũ (applymap) và mới (map)"""
-    try:
-        # Kiểm tra nếu Pandas là bản mới (có hàm map)
-        if hasattr(df, 'map'):
-            try: 
-                return df.map(neutralize_excel_value)
-            except Exception: 
-                return df.astype(str).map(neutralize_excel_value)
-        # Nếu là Pandas bản cũ
-        else:
-            try: 
-                return df.applymap(neutralize_excel_value)
-            except Exception: 
-                return df.astype(str).applymap(neutralize_excel_value)
-    except Exception:
-        return df # Fallback an toàn nếu có lỗi bất ngờ
-def to_excel(df_input, df_result):
-    output = io.BytesIO()
-    if df_input is not None: df_input_safe = neutralize_df_for_excel(df_input.copy())
-    else: df_input_safe = None
-    if 'is_priority' in df_result.columns: df_result_clean = df_result.drop(columns=['is_priority'])
-    else: df_result_clean = df_result
-    df_result_safe = neutralize_df_for_excel(df_result_clean.copy())
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        sheet_name = 'KET_QUA_TINH_TOAN'
-        start_row_result = 1
-        if df_input_safe is not None:
-            df_input_safe.to_excel(writer, index=False, sheet_name=sheet_name, startrow=1)
-            start_row_result = len(df_input_safe) + 5
-        df_result_safe.to_excel(writer, sheet_name=sheet_name, startrow=start_row_result, index=False)
-        worksheet = writer.sheets[sheet_name]
-        if df_input_safe is not None:
-            worksheet.cell(row=1, column=1, value="I. THÔNG SỐ ĐẦU VÀO").font = openpyxl.styles.Font(bold=True, size=11) if 'openpyxl' in locals() else None
-            worksheet.cell(row=start_row_result, column=1, value="II. KẾT QUẢ TÍNH TOÁN").font = openpyxl.styles.Font(bold=True, size=11) if 'openpyxl' in locals() else None
-        else:
-            worksheet.cell(row=start_row_result, column=1, value="DANH SÁCH KẾT QUẢ")
-    return output.getvalue()
 
 @st.dialog("Vị trí trên Google Maps")
 def show_map_popup(lat, lon):
@@ -482,11 +548,6 @@ def show_convert_popup():
     if st.button("🧮 CHUYỂN ĐỔI & ÁP DỤNG", type="primary", use_container_width=True, on_click=handle_conversion):
         st.rerun() # Tự động đóng popup và tải lại giao diện
 
-try:
-    import openpyxl
-except:
-    pass
-
 # --- XỬ LÝ KHỞI TẠO SESSION & ĐẾM TRUY CẬP ---
 if 'session_id' not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())[:8] 
@@ -502,9 +563,12 @@ if 'session_id' not in st.session_state:
 if 'results' not in st.session_state: st.session_state.results = None
 if 'input_snapshot' not in st.session_state: st.session_state.input_snapshot = None
 if 'last_uploaded_file_id' not in st.session_state: st.session_state.last_uploaded_file_id = None
+if 'dataset_key' not in st.session_state: st.session_state.dataset_key = None
 if 'check_result' not in st.session_state: st.session_state.check_result = None
 if 'bad_freq_results' not in st.session_state: st.session_state.bad_freq_results = None
 if 'active_view' not in st.session_state: st.session_state.active_view = None
+if 'calc_job' not in st.session_state: st.session_state.calc_job = None
+if 'results_export' not in st.session_state: st.session_state.results_export = None
 if 'admin_logged_in' not in st.session_state: st.session_state.admin_logged_in = False
 if 'auto_refresh' not in st.session_state: st.session_state.auto_refresh = False
 
@@ -527,6 +591,10 @@ active_users = get_active_users_dict()
 # Ghi nhận thời điểm hiện tại (bằng giây) mà người dùng này vừa thao tác
 active_users[st.session_state.session_id] = time.time()
 
+# Nhả bộ dữ liệu của các phiên đã bỏ đi lâu (không còn trong active_users hoặc quá hạn)
+idle_cutoff = time.time() - SESSION_IDLE_RELEASE_SECONDS
+get_tool_registry().release_sessions([sid for sid, last_active in list(active_users.items()) if last_active < idle_cutoff])
+
 # =========================================================================
 # PHÂN LUỒNG: KIỂM TRA QUERY PARAMS ĐỂ XÁC ĐỊNH GIAO DIỆN ADMIN
 # =========================================================================
@@ -582,7 +650,10 @@ if is_admin_route:
         users_to_remove = [sid for sid, last_active in active_users.items() if current_time - last_active > timeout_seconds]
         for sid in users_to_remove:
             del active_users[sid]
+        get_tool_registry().release_sessions(users_to_remove)
         current_online = len(active_users)
+        registry_stats = get_tool_registry().stats()
+        query_stats = query_cache_stats()
         
         # --- THANH CÔNG CỤ ADMIN ---
         col_act1, col_act2, col_act3 = st.columns([1.5, 1.5, 1.5])
@@ -594,6 +665,10 @@ if is_admin_route:
                 
         with col_act2:
             st.metric(label="📊 Tổng lượt truy cập", value=f"{total_visits} lượt")
+            st.caption(f"Bộ dữ liệu trong RAM: {registry_stats['datasets']} "
+                       f"({registry_stats['total_bytes'] / 1e6:.0f}/{registry_stats['budget_bytes'] / 1e6:.0f} MB)")
+            st.caption(f"Cache kết quả: {query_stats['hits']} trúng / {query_stats['misses']} trượt "
+                       f"({query_stats['size']}/{query_stats['maxsize']} mục)")
             
         with col_act3:
             st.markdown("<div style='margin-top: 35px;'></div>", unsafe_allow_html=True) # Căn lề cho đẹp
@@ -789,7 +864,9 @@ else:
                     current_file_id = "_".join([f"{f.name}_{getattr(f, 'size', '')}" for f in uploaded_files])
                     
                     if st.session_state.last_uploaded_file_id != current_file_id:
-                        st.cache_resource.clear() 
+                        get_tool_registry().release(st.session_state.session_id)
+                        cancel_calc_job()
+                        st.session_state.dataset_key = None
                         st.session_state.results = None
                         st.session_state.input_snapshot = None
                         st.session_state.check_result = None
@@ -812,8 +889,16 @@ else:
                         btn_disabled = True
                         
         else:
+            master = get_master_dataset()
+            if master is not None and master.get() is not None:
+                btn_disabled = False
+                loaded_str = datetime.fromtimestamp(master.loaded_at, timezone(timedelta(hours=7))).strftime("%H:%M %d/%m/%Y")
+                st.caption(f"ℹ️ Chưa nạp file: đang dùng dữ liệu chung của hệ thống "
+                           f"({os.path.basename(master.path)}, cập nhật {loaded_str}).")
             if st.session_state.last_uploaded_file_id is not None:
-                st.cache_resource.clear() 
+                get_tool_registry().release(st.session_state.session_id)
+                cancel_calc_job()
+                st.session_state.dataset_key = None
                 st.session_state.results = None
                 st.session_state.input_snapshot = None
                 st.session_state.check_result = None
@@ -864,40 +949,42 @@ else:
             if h_anten == 0.0: st.warning("⚠️ Lưu ý: Độ cao Anten đang là 0m.")
             
             log_info(f"SESS: {st.session_state.session_id} |CALC_START|Pos:{lat:.6f},{lon:.6f}|Mode:{mode}|Band:{band}|H:{h_anten}|Subband:{selected_subband_label}|Prov:{prov_to_send}")
-            with st.spinner('Đang tính toán...'):
-                try:
-                    # --- SỬ DỤNG HÀM CACHE LẤY INSTANCE THAY VÌ TẠO MỚI ---
-                    tool = get_tool_instance(uploaded_files)
-                    
-                    user_input = {
-                        "lat": lat, "lon": lon,
-                        "province_code": prov_to_send,
-                        "antenna_height": h_anten,
-                        "band": band, "bw": bw, "usage_mode": mode,
-                        "scan_start": scan_start, "scan_end": scan_end 
-                    }
-                    results = tool.tinh_toan(user_input)
-                    st.session_state.results = results
-                    st.session_state.input_snapshot = {
-                        "THAM SỐ": ["Phiên bản App", "Kinh độ", "Vĩ độ", "Tỉnh / TP", "Độ cao Anten (m)", "Dải tần", "Phạm vi quét", "Băng thông", "Loại mạng", "Số lượng xin"],
-                        "GIÁ TRỊ": [APP_VERSION, f"{lon:.5f}", f"{lat:.5f}", prov_to_send if "LAN" in mode else "Toàn quốc (WAN)", h_anten, band, selected_subband_label, bw, mode, qty]
-                    }
-                    log_info(f"SESS: {st.session_state.session_id} | ACTION: CALC_SUCCESS | Found: {len(results)} freqs")
-                    
-                    # --- ÉP GIẢI PHÓNG RAM NGAY SAU KHI TÍNH TOÁN XONG ---
-                    gc.collect()
+            try:
+                # --- SỬ DỤNG HÀM CACHE LẤY INSTANCE THAY VÌ TẠO MỚI ---
+                tool = get_tool_instance(uploaded_files)
+                
+                user_input = {
+                    "lat": lat, "lon": lon,
+                    "province_code": prov_to_send,
+                    "antenna_height": h_anten,
+                    "band": band, "bw": bw, "usage_mode": mode,
+                    "scan_start": scan_start, "scan_end": scan_end 
+                }
+                input_snapshot = {
+                    "THAM SỐ": INPUT_SNAPSHOT_LABELS,
+                    "GIÁ TRỊ": [APP_VERSION, f"{lon:.5f}", f"{lat:.5f}", prov_to_send if "LAN" in mode else "Toàn quốc (WAN)", h_anten, band, selected_subband_label, bw, mode, qty]
+                }
+                # Tính ở luồng nền: chạm vào widget trong lúc chờ không làm lượt tính bắt đầu lại.
+                # Các tần số khả dụng được trả dần theo lưới để hiển thị danh sách tạm ngay từ đoạn đầu
+                partial_parts = []
+                def run_stream(progress):
+                    for part in tool.tinh_toan_stream(user_input, progress=progress):
+                        partial_parts.append(part)
+                    return rank_available(partial_parts)
+                st.session_state.results = None
+                submit_calc_job("AVAILABLE", run_stream, input_snapshot, partial=partial_parts)
 
-                except Exception as e:
-                    log_exception(f"SESS: {st.session_state.session_id} | ACTION: CALC_EXCEPTION | Error: {e}")
-                    st.error(f"Có lỗi xảy ra: {e}")
-                    st.session_state.active_view = None
+            except Exception as e:
+                log_exception(f"SESS: {st.session_state.session_id} | ACTION: CALC_EXCEPTION | Error: {e}")
+                st.error(f"Có lỗi xảy ra: {e}")
+                st.session_state.active_view = None
 
     if btn_scan_bad_freq:
         st.session_state.results = None
         st.session_state.check_result = None
         st.session_state.active_view = "UNAVAILABLE"
         
-        if not uploaded_files:
+        if not uploaded_files and get_master_tool() is None:
             st.error("Vui lòng nạp file Excel trước.")
             st.session_state.active_view = None
         elif btn_disabled: 
@@ -908,42 +995,35 @@ else:
             if "WAN" in mode: prov_to_send = "KHAC"
             
             log_info(f"SESS: {st.session_state.session_id} | ACTION: SCAN_BAD_START | Pos: {lat:.6f},{lon:.6f} | Mode: {mode} | Band: {band} | Subband: {selected_subband_label}")
-            with st.spinner("Đang quét dải tần đã chọn..."):
-                try:
-                    # --- SỬ DỤNG HÀM CACHE ---
-                    tool = get_tool_instance(uploaded_files)
-                    
-                    user_input = {
-                        "lat": lat, "lon": lon,
-                        "province_code": prov_to_send,
-                        "antenna_height": h_anten,
-                        "band": band, "bw": bw, "usage_mode": mode,
-                        "scan_start": scan_start, "scan_end": scan_end 
-                    }
-                    bad_results = tool.tim_cac_tan_so_khong_kha_dung(user_input)
-                    st.session_state.bad_freq_results = bad_results
-                    
-                    st.session_state.input_snapshot = {
-                        "THAM SỐ": ["Phiên bản App", "Kinh độ", "Vĩ độ", "Tỉnh / TP", "Độ cao Anten (m)", "Dải tần", "Phạm vi quét", "Băng thông", "Loại mạng", "Số lượng xin"],
-                        "GIÁ TRỊ": [APP_VERSION, f"{lon:.5f}", f"{lat:.5f}", prov_to_send if "LAN" in mode else "Toàn quốc (WAN)", h_anten, band, selected_subband_label, bw, mode, qty]
-                    }
-                    
-                    log_info(f"SESS: {st.session_state.session_id} | ACTION: SCAN_BAD_SUCCESS | Found: {len(bad_results)} bad freqs")
-                    
-                    # --- GIẢI PHÓNG RAM ---
-                    gc.collect()
+            try:
+                # --- SỬ DỤNG HÀM CACHE ---
+                tool = get_tool_instance(uploaded_files)
+                
+                user_input = {
+                    "lat": lat, "lon": lon,
+                    "province_code": prov_to_send,
+                    "antenna_height": h_anten,
+                    "band": band, "bw": bw, "usage_mode": mode,
+                    "scan_start": scan_start, "scan_end": scan_end 
+                }
+                input_snapshot = {
+                    "THAM SỐ": INPUT_SNAPSHOT_LABELS,
+                    "GIÁ TRỊ": [APP_VERSION, f"{lon:.5f}", f"{lat:.5f}", prov_to_send if "LAN" in mode else "Toàn quốc (WAN)", h_anten, band, selected_subband_label, bw, mode, qty]
+                }
+                st.session_state.bad_freq_results = None
+                submit_calc_job("UNAVAILABLE", lambda progress: tool.tim_cac_tan_so_khong_kha_dung(user_input, progress), input_snapshot)
 
-                except Exception as e:
-                    log_exception(f"SESS: {st.session_state.session_id} | ACTION: SCAN_BAD_EXCEPTION | Error: {e}")
-                    st.error(f"Có lỗi xảy ra: {e}")
-                    st.session_state.active_view = None
+            except Exception as e:
+                log_exception(f"SESS: {st.session_state.session_id} | ACTION: SCAN_BAD_EXCEPTION | Error: {e}")
+                st.error(f"Có lỗi xảy ra: {e}")
+                st.session_state.active_view = None
 
     if btn_check_specific:
         st.session_state.results = None
         st.session_state.bad_freq_results = None
         st.session_state.active_view = "CHECK_SPECIFIC"
 
-        if not uploaded_files:
+        if not uploaded_files and get_master_tool() is None:
             st.error("Vui lòng nạp file Excel trước.")
             st.session_state.active_view = None
         elif btn_disabled:
@@ -958,30 +1038,47 @@ else:
             if "WAN" in mode: prov_to_send = "KHAC"
             
             log_info(f"SESS: {st.session_state.session_id} | CHECK_START | Freq: {f_check_val} | Pos: {lat:.6f},{lon:.6f}")
-            with st.spinner(f"Đang kiểm tra tần số {f_check_val} MHz..."):
-                try:
-                    # --- SỬ DỤNG HÀM CACHE ---
-                    tool = get_tool_instance(uploaded_files)
-                    
-                    user_input = {
-                        "lat": lat, "lon": lon,
-                        "province_code": prov_to_send,
-                        "antenna_height": h_anten,
-                        "band": band, "bw": bw, "usage_mode": mode
-                    }
-                    check_res = tool.kiem_tra_tan_so_cu_the(user_input, f_check_val)
-                    st.session_state.check_result = check_res
-                    
-                    status = check_res.get("status", "UNKNOWN")
-                    log_info(f"SESS: {st.session_state.session_id} | ACTION: CHECK_SUCCESS | Status: {status}")
-                    
-                    # --- GIẢI PHÓNG RAM ---
-                    gc.collect()
+            try:
+                # --- SỬ DỤNG HÀM CACHE ---
+                tool = get_tool_instance(uploaded_files)
+                
+                user_input = {
+                    "lat": lat, "lon": lon,
+                    "province_code": prov_to_send,
+                    "antenna_height": h_anten,
+                    "band": band, "bw": bw, "usage_mode": mode
+                }
+                st.session_state.check_result = None
+                submit_calc_job("CHECK_SPECIFIC", lambda progress: tool.kiem_tra_tan_so_cu_the(user_input, f_check_val))
+
+            except Exception as e:
+                log_exception(f"SESS: {st.session_state.session_id} | ACTION: CHECK_EXCEPTION | Error: {e}")
+                st.error(f"Có lỗi xảy ra: {e}")
+                st.session_state.active_view = None
 
-                except Exception as e:
-                    log_exception(f"SESS: {st.session_state.session_id} | ACTION: CHECK_EXCEPTION | Error: {e}")
-                    st.error(f"Có lỗi xảy ra: {e}")
-                    st.session_state.active_view = None
+    # TÁC VỤ NỀN ĐANG CHẠY: HIỂN THỊ TIẾN ĐỘ, NÚT HỦY; TỰ LÀM MỚI ĐẾN KHI CÓ KẾT QUẢ
+    calc_job = st.session_state.calc_job
+    if calc_job is not None:
+        if calc_job["future"].done():
+            finish_calc_job(calc_job)
+        else:
+            _, job_label, _ = CALC_JOB_KINDS[calc_job["kind"]]
+            fraction = calc_job["progress"].fraction()
+            elapsed = time.time() - calc_job["started"]
+            st.markdown("---")
+            st.progress(min(fraction, 1.0), text=f"{job_label}... {fraction * 100:.0f}% ({elapsed:.0f}s)")
+            if st.button("⏹ HỦY TÍNH TOÁN", type="secondary"):
+                calc_job["progress"].cancel()
+                calc_job["future"].cancel()
+            if calc_job["partial"]:
+                # Danh sách tạm: xếp hạng các tần số đã xác nhận đến lúc này (có thể đổi khi quét tiếp)
+                provisional = rank_available(list(calc_job["partial"]))
+                df_provisional = provisional.to_frame(qty)[["STT", "frequency", "reuse_factor", "license_list"]]
+                df_provisional.columns = ["STT", "Tần số Khả dụng (MHz)", "Hệ số Tái sử dụng (Điểm)", "Các GP sử dụng tần số này"]
+                st.markdown(f"**Kết quả tạm thời ({len(provisional)} tần số khả dụng đã xác nhận):**")
+                st.table(df_provisional.set_index("STT"))
+            time.sleep(CALC_POLL_SECONDS)
+            st.rerun()
 
     # VIEW 1: KẾT QUẢ TẦN SỐ KHẢ DỤNG
     if st.session_state.active_view == "AVAILABLE" and st.session_state.results is not None:
@@ -992,57 +1089,57 @@ else:
         if not results:
             st.error("❌ Không tìm thấy tần số khả dụng trong dải quét!")
         else:
-            df_res = pd.DataFrame(results)
             cols_display = ["STT", "frequency", "reuse_factor", "license_list"]
-            df_view = df_res[cols_display].copy()
-            df_view.columns = ["STT", "Tần số Khả dụng (MHz)", "Hệ số Tái sử dụng (Điểm)", "Các GP sử dụng tần số này"]
-            df_view.set_index("STT", inplace=True)
+
+            def view_frame(limit=None):
+                # Chuỗi hiển thị chỉ dựng cho các dòng thực sự hiển thị (results dạng cột, xem AvailableFrequencies)
+                df_res = results.to_frame(limit)
+                df_view = df_res[cols_display].copy()
+                df_view.columns = ["STT", "Tần số Khả dụng (MHz)", "Hệ số Tái sử dụng (Điểm)", "Các GP sử dụng tần số này"]
+                df_view.set_index("STT", inplace=True)
+                return df_view, dict(zip(df_res["STT"], df_res["is_priority"]))
 
             m1, m2 = st.columns(2)
             m1.metric("Số lượng tìm thấy", f"{len(results)}")
             best_freq = results[0]['frequency']
             m2.metric("Tần số tốt nhất", f"{best_freq} MHz")
 
-            df_top = df_view.head(qty)
-
-            def style_logic(df):
+            def style_logic(df, priority_of):
                 styles = pd.DataFrame('', index=df.index, columns=df.columns)
                 for idx in df.index:
-                    row_data = df_res[df_res['STT'] == idx].iloc[0]
-                    is_prio = row_data.get('is_priority', False)
-                    if is_prio:
+                    if priority_of[idx]:
                         styles.loc[idx, :] = f'color: {PRIORITY_HIGHLIGHT_COLOR}; font-weight: bold'
-                    elif idx <= results[min(qty-1, len(results)-1)]['STT']: 
-                        top_ids = [item['STT'] for item in results[:qty]]
-                        if idx in top_ids:
-                            styles.loc[idx, :] = 'color: #28a745; font-weight: bold'
+                    elif idx <= qty:
+                        styles.loc[idx, :] = 'color: #28a745; font-weight: bold'
                 return styles
 
-            styler_top = df_top.style.apply(lambda x: style_logic(df_top), axis=None)
-            styler_full = df_view.style.apply(lambda x: style_logic(df_view), axis=None)
+            df_top, top_priority = view_frame(qty)
+            styler_top = df_top.style.apply(lambda x: style_logic(df_top, top_priority), axis=None)
 
             st.markdown(f"**Danh sách {qty} tần số đề xuất tốt nhất:**")
             st.table(styler_top)
             
             with st.expander("Xem danh sách đầy đủ (Tất cả kết quả)"):
-                st.dataframe(styler_full, use_container_width=True)
+                if st.checkbox(f"Hiển thị toàn bộ {len(results)} tần số", key="show_full_results"):
+                    df_view, view_priority = view_frame()
+                    styler_full = df_view.style.apply(lambda x: style_logic(df_view, view_priority), axis=None)
+                    st.dataframe(styler_full, use_container_width=True)
 
             if st.session_state.input_snapshot:
-                df_export = df_res.copy()
-                df_export.rename(columns={
-                    "STT": "STT",
-                    "frequency": "Tần số Khả dụng (MHz)",
-                    "reuse_factor": "Hệ số Tái sử dụng",
-                    "license_list": "Các GP sử dụng tần số này (kèm khoảng cách)"
-                }, inplace=True)
-                
-                df_input_report = pd.DataFrame(st.session_state.input_snapshot)
-                excel_data = to_excel(df_input_report, df_export)
+                # File Excel dựng một lần cho mỗi kết quả (không dựng lại ở mỗi lần chạy lại script)
+                cached_export = st.session_state.results_export
+                if cached_export is None or cached_export[0] is not results:
+                    df_export = available_export_frame(results)
+                    df_input_report = pd.DataFrame(st.session_state.input_snapshot)
+                    cached_export = st.session_state.results_export = (results, to_excel(df_input_report, df_export))
+                excel_data = cached_export[1]
                 
                 now = datetime.now()
                 time_str = now.strftime("%H%M%S_%d%m%Y")
                 
                 input_file_name = "data"
+                if not uploaded_files and get_master_dataset() is not None:
+                    input_file_name = os.path.splitext(os.path.basename(MASTER_DATASET_PATH))[0]
                 if uploaded_files:
                     # Lấy tên của 1-2 file đầu tiên ghép lại để tải về
                     input_file_name = "_".join([os.path.splitext(f.name)[0] for f in uploaded_files][:2])
@@ -1068,14 +1165,7 @@ else:
             st.info("Tuyệt vời! Không tìm thấy tần số nào bị nhiễu trong dải quét.")
         else:
             st.warning(f"⚠️ Tìm thấy {len(bad_list)} trường hợp tần số gây nhiễu (không khả dụng).")
-            df_bad = pd.DataFrame(bad_list)
-            
-            if "Khoảng cách thực tế (km)" in df_bad.columns and "Khoảng cách yêu cầu (km)" in df_bad.columns:
-                 df_bad["Khoảng cách thực tế/Chỉ tiêu"] = df_bad.apply(lambda x: f"{x['Khoảng cách thực tế (km)']:.2f}/{x['Khoảng cách yêu cầu (km)']:.2f}", axis=1)
-                 df_bad.drop(columns=["Khoảng cách thực tế (km)", "Khoảng cách yêu cầu (km)"], inplace=True)
-            elif "dist_km" in df_bad.columns and "req_dist_km" in df_bad.columns:
-                 df_bad["Khoảng cách thực tế/Chỉ tiêu"] = df_bad.apply(lambda x: f"{x['dist_km']:.2f}/{x['req_dist_km']:.2f}", axis=1)
-                 df_bad.drop(columns=["dist_km", "req_dist_km"], inplace=True)
+            df_bad = unavailable_export_frame(bad_list)
                  
             st.dataframe(
                 df_bad, 
@@ -1099,6 +1189,8 @@ else:
             time_str = now.strftime("%H%M%S_%d%m%Y")
             
             input_file_name = "data"
+            if not uploaded_files and get_master_dataset() is not None:
+                input_file_name = os.path.splitext(os.path.basename(MASTER_DATASET_PATH))[0]
             if uploaded_files:
                 input_file_name = "_".join([os.path.splitext(f.name)[0] for f in uploaded_files][:2])
                 
@@ -1124,19 +1216,8 @@ else:
             st.error(f"❌ {res.get('msg')}")
             if "conflicts" in res and res["conflicts"]:
                 st.markdown("**Danh sách các giấy phép gây nhiễu (không đảm bảo khoảng cách):**")
-                df_conflict = pd.DataFrame(res["conflicts"])
+                df_conflict = conflict_export_frame(res["conflicts"])
                 if not df_conflict.empty:
-                    df_conflict["Khoảng cách thực tế/Chỉ tiêu"] = df_conflict.apply(lambda x: f"{x['dist_km']:.2f}/{x['req_dist_km']:.2f}", axis=1)
-                    df_conflict.drop(columns=["dist_km", "req_dist_km"], inplace=True)
-                    
-                    df_conflict.rename(columns={
-                        "license": "Số Giấy Phép",
-                        "customer": "Tên Khách Hàng",
-                        "freq_conflict": "Tần số GP (MHz)",
-                        "address": "Địa chỉ trạm",
-                        "type": "Loại nhiễu"
-                    }, inplace=True)
-
                     st.table(df_conflict)
 
 # =============================================================================
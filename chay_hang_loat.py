@@ -0,0 +1,211 @@
+"""
+Chạy hàng loạt không cần giao diện (Streamlit): nạp file giấy phép, đọc bảng yêu cầu (mỗi dòng một hồ sơ)
+và chạy tinh_toan / kiem_tra_tan_so_cu_the / tim_cac_tan_so_khong_kha_dung trên nhiều tiến trình.
+Mỗi dòng ra một file kết quả cùng bố cục với nút "LƯU KẾT QUẢ" trên giao diện, kèm file tổng hợp.
+
+Ví dụ:
+    python chay_hang_loat.py --data CSDL_1.xlsx CSDL_2.xlsx --requests ho_so.xlsx --task tinh_toan --workers 8 --output-dir ket_qua
+"""
+import os
+import sys
+import math
+import argparse
+import logging
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from tool_tinh_toan import ToolAnDinhTanSo
+from xuat_ket_qua import (INPUT_SNAPSHOT_LABELS, to_excel, to_csv, available_export_frame,
+                          unavailable_export_frame, conflict_export_frame)
+
+logger = logging.getLogger("chay_hang_loat")
+
+APP_VERSION = "CLI"
+
+TASKS = ["tinh_toan", "kiem_tra", "khong_kha_dung"]
+
+# Tên file kết quả theo loại tác vụ (giống tên file tải về trên giao diện)
+TASK_FILE_PREFIX = {
+    "tinh_toan": "DS_TanSo_KhaDung",
+    "kiem_tra": "KiemTra_TanSo",
+    "khong_kha_dung": "DS_TanSo_KhongKhaDung",
+}
+
+# Tên cột trong bảng yêu cầu -> khóa user_input (chấp nhận cả nhãn tiếng Việt như file kết quả)
+REQUEST_COLUMN_ALIASES = {
+    "Vĩ độ": "lat", "Kinh độ": "lon", "Tỉnh / TP": "province_code", "Độ cao Anten (m)": "antenna_height",
+    "Dải tần": "band", "Băng thông": "bw", "Loại mạng": "usage_mode", "Số lượng xin": "qty",
+    "Từ tần số": "scan_start", "Đến tần số": "scan_end", "Song công": "is_duplex",
+    "Khoảng cách song công": "duplex_spacing", "Tần số kiểm tra": "f_check",
+}
+TRUE_VALUES = {"1", "TRUE", "X", "YES", "CO", "CÓ"}
+
+# Cột của bảng tổng hợp TONG_HOP (cố định, kể cả khi bảng yêu cầu không có dòng nào)
+SUMMARY_COLUMNS = ["Dòng", "Trạng thái", "Số kết quả", "Kết luận", "File kết quả", "Lỗi"]
+
+# Tool của mỗi tiến trình con (nạp một lần trong initializer; tiến trình fork thừa hưởng bản của tiến trình cha)
+_WORKER_TOOL = None
+
+def _load_tool(data_files):
+    return ToolAnDinhTanSo(data_files if len(data_files) > 1 else data_files[0])
+
+def _init_worker(data_files):
+    global _WORKER_TOOL
+    if _WORKER_TOOL is None:
+        _WORKER_TOOL = _load_tool(data_files)
+
+def read_requests(path):
+    """Bảng yêu cầu (.xlsx / .csv) -> list user_input (bỏ ô trống)."""
+    if path.lower().endswith('.csv'):
+        df = pd.read_csv(path, encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(path)
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df.rename(columns=REQUEST_COLUMN_ALIASES)
+    missing = [c for c in ["lat", "lon", "band", "bw", "usage_mode"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"Bảng yêu cầu thiếu cột: {', '.join(missing)}")
+
+    requests = []
+    for rec in df.to_dict('records'):
+        user_input = {k: v for k, v in rec.items() if not (isinstance(v, float) and math.isnan(v)) and v != ""}
+        for key in ["band", "usage_mode"]:
+            if key in user_input: user_input[key] = str(user_input[key]).strip().upper()
+        if "province_code" in user_input: user_input["province_code"] = str(user_input["province_code"]).strip()
+        if "is_duplex" in user_input: user_input["is_duplex"] = str(user_input["is_duplex"]).strip().upper() in TRUE_VALUES
+        requests.append(user_input)
+    return requests
+
+def input_snapshot(user_input, task):
+    """Bảng "I. THÔNG SỐ ĐẦU VÀO" như trên giao diện."""
+    mode = str(user_input.get("usage_mode", ""))
+    scan_start = user_input.get("scan_start", 0) or 0
+    scan_end = user_input.get("scan_end", 0) or 0
+    scan_label = f"{scan_start} - {scan_end} MHz" if scan_end else "Toàn bộ dải"
+    values = [
+        APP_VERSION, f"{float(user_input.get('lon', 0)):.5f}", f"{float(user_input.get('lat', 0)):.5f}",
+        user_input.get("province_code", "") if "LAN" in mode else "Toàn quốc (WAN)",
+        user_input.get("antenna_height", 0), user_input.get("band", ""), scan_label,
+        user_input.get("bw", ""), mode, user_input.get("qty", ""),
+    ]
+    snapshot = {"THAM SỐ": list(INPUT_SNAPSHOT_LABELS), "GIÁ TRỊ": values}
+    if task == "kiem_tra":
+        snapshot["THAM SỐ"].append("Tần số kiểm tra")
+        snapshot["GIÁ TRỊ"].append(user_input.get("f_check", ""))
+    return pd.DataFrame(snapshot)
+
+def _write_result(out_dir, fmt, task, row_no, user_input, df_result):
+    path = os.path.join(out_dir, f"{TASK_FILE_PREFIX[task]}_dong{row_no:04d}.{fmt}")
+    writer = to_csv if fmt == "csv" else to_excel
+    with open(path, 'wb') as fh:
+        fh.write(writer(input_snapshot(user_input, task), df_result))
+    return path
+
+def _run_chunk(task, rows, out_dir, fmt):
+    """Chạy một nhóm dòng (row_index, user_input) trên Tool của tiến trình hiện tại, ghi file, trả về tổng hợp."""
+    tool = _WORKER_TOOL
+    summary = []
+    if task == "tinh_toan":
+        outcomes = tool.tinh_toan_hang_loat([user_input for _, user_input in rows])
+    else:
+        outcomes = []
+        for _, user_input in rows:
+            try:
+                if task == "kiem_tra":
+                    if "f_check" not in user_input:
+                        raise ValueError("thiếu cột Tần số kiểm tra (f_check)")
+                    outcomes.append({"results": tool.kiem_tra_tan_so_cu_the(dict(user_input), float(user_input["f_check"])), "error": None})
+                else:
+                    outcomes.append({"results": tool.tim_cac_tan_so_khong_kha_dung(dict(user_input)), "error": None})
+            except Exception as e:
+                outcomes.append({"results": None, "error": str(e)})
+
+    for (row_idx, user_input), outcome in zip(rows, outcomes):
+        row_no = row_idx + 1
+        record = {"Dòng": row_no, "Trạng thái": "OK", "Số kết quả": 0, "Kết luận": "", "File kết quả": "", "Lỗi": ""}
+        if outcome["error"]:
+            record.update({"Trạng thái": "LỖI", "Lỗi": outcome["error"]})
+            summary.append(record)
+            continue
+        try:
+            res = outcome["results"]
+            if task == "tinh_toan":
+                df_result = available_export_frame(res) if res else pd.DataFrame({"DANH SÁCH": ["Không tìm thấy tần số khả dụng trong dải quét"]})
+                record["Số kết quả"] = len(res)
+            elif task == "khong_kha_dung":
+                df_result = unavailable_export_frame(res) if res else pd.DataFrame({"DANH SÁCH": ["Không tìm thấy tần số nào bị nhiễu trong dải quét"]})
+                record["Số kết quả"] = len(res)
+            else:
+                conflicts = res.get("conflicts") or []
+                df_result = conflict_export_frame(conflicts) if conflicts else pd.DataFrame({"Kết luận": [res.get("msg", "")]})
+                record["Số kết quả"] = len(conflicts)
+                record["Kết luận"] = f"{res.get('status')}: {res.get('msg', '')}"
+            record["File kết quả"] = os.path.basename(_write_result(out_dir, fmt, task, row_no, user_input, df_result))
+        except Exception as e:
+            record.update({"Trạng thái": "LỖI", "Lỗi": str(e)})
+        summary.append(record)
+    return summary
+
+def run(data_files, requests_path, task, out_dir, fmt="xlsx", workers=None, chunk_size=None):
+    """Chạy toàn bộ bảng yêu cầu; trả về DataFrame tổng hợp (đồng thời ghi TONG_HOP.<fmt> vào out_dir)."""
+    global _WORKER_TOOL
+    workers = max(1, workers or os.cpu_count() or 1)
+    os.makedirs(out_dir, exist_ok=True)
+    requests = read_requests(requests_path)
+
+    # Tiến trình cha dựng Tool trước (ghi cache kho trạm trên đĩa) để các tiến trình con nạp nhanh / thừa hưởng khi fork
+    _WORKER_TOOL = _load_tool(data_files)
+    rows = list(enumerate(requests))
+    if task == "tinh_toan":
+        # Gom các dòng cùng kịch bản vào cùng nhóm để tinh_toan_hang_loat dùng chung lưới ứng viên / ma trận
+        def _scenario(item):
+            try: return (0, repr(_WORKER_TOOL.scenario_key(item[1])))
+            except Exception: return (1, "")
+        rows.sort(key=_scenario)
+    chunk_size = chunk_size or max(1, math.ceil(len(rows) / (workers * 4)))
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    logger.info(f"{len(rows)} dòng yêu cầu, {len(chunks)} nhóm, {workers} tiến trình")
+
+    summary = []
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            summary.extend(_run_chunk(task, chunk, out_dir, fmt))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_files,)) as pool:
+            futures = [pool.submit(_run_chunk, task, chunk, out_dir, fmt) for chunk in chunks]
+            for future in futures:
+                summary.extend(future.result())
+
+    df_summary = pd.DataFrame(summary, columns=SUMMARY_COLUMNS).sort_values("Dòng").reset_index(drop=True)
+    summary_path = os.path.join(out_dir, f"TONG_HOP.{fmt}")
+    if fmt == "csv":
+        df_summary.to_csv(summary_path, index=False, encoding='utf-8-sig')
+    else:
+        df_summary.to_excel(summary_path, index=False)
+    return df_summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PMR tool - chạy hàng loạt không cần giao diện")
+    parser.add_argument("--data", nargs="+", required=True, help="File dữ liệu giấy phép (.xlsx / .csv), có thể nhiều file")
+    parser.add_argument("--requests", required=True, help="Bảng yêu cầu (.xlsx / .csv), mỗi dòng một hồ sơ")
+    parser.add_argument("--task", choices=TASKS, default="tinh_toan", help="Loại tính toán (mặc định: tinh_toan)")
+    parser.add_argument("--output-dir", default=None, help="Thư mục ghi kết quả (mặc định: ket_qua_<thời gian>)")
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="xlsx", help="Định dạng file kết quả")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình (mặc định: số nhân CPU)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Số dòng mỗi lượt giao cho một tiến trình")
+    args = parser.parse_args(argv)
+
+    out_dir = args.output_dir or f"ket_qua_{datetime.now().strftime('%H%M%S_%d%m%Y')}"
+    try:
+        df_summary = run(args.data, args.requests, args.task, out_dir, args.format, args.workers, args.chunk_size)
+    except ValueError as ve:
+        print(f"Lỗi dữ liệu đầu vào: {ve}", file=sys.stderr)
+        return 2
+    n_err = int((df_summary["Trạng thái"] != "OK").sum()) if not df_summary.empty else 0
+    print(f"Đã xử lý {len(df_summary)} dòng ({n_err} lỗi). Kết quả: {out_dir}")
+    return 1 if n_err else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
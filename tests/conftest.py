@@ -0,0 +1,43 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tool_tinh_toan  # noqa: E402
+
+STATION_COLUMNS = ["Số giấy phép", "Tên khách hàng", "Tần số phát", "Phương thức phát", "Vĩ độ", "Kinh độ", "Tỉnh thành"]
+
+
+def write_stations(path, rows):
+    """Ghi các dòng trạm (theo STATION_COLUMNS) ra file .csv, trả về đường dẫn dạng chuỗi."""
+    with open(path, "w", newline="", encoding="utf-8-sig") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(STATION_COLUMNS)
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    """Mỗi test dùng thư mục cache kho trạm riêng và cache kết quả / khoảng cách rỗng."""
+    monkeypatch.setattr(tool_tinh_toan, "DATASET_CACHE_DIR", str(tmp_path / "dataset_cache"))
+    tool_tinh_toan.QUERY_RESULT_CACHE.clear()
+    tool_tinh_toan.SITE_DISTANCE_CACHE.clear()
+    yield
+    tool_tinh_toan.QUERY_RESULT_CACHE.clear()
+    tool_tinh_toan.SITE_DISTANCE_CACHE.clear()
+
+
+@pytest.fixture
+def make_tool(tmp_path):
+    """Ghi các dòng trạm ra file .csv (write_stations) rồi dựng ToolAnDinhTanSo từ file đó."""
+    counter = iter(range(1 << 16))
+
+    def _make(rows):
+        path = write_stations(tmp_path / f"stations_{next(counter)}.csv", rows)
+        return tool_tinh_toan.ToolAnDinhTanSo(path)
+
+    return _make
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import STATION_COLUMNS
+from test_tinh_toan import USER_INPUT, USER_LAT, USER_LON, station_row
+
+SCAN = {**USER_INPUT, "scan_start": 406.9, "scan_end": 407.2}
+
+BASE = [
+    station_row("GP-1", "407.0"),
+    station_row("GP-2", "407.0125", lat=USER_LAT + 0.5 / 110.6),
+    station_row("GP-3", "408.0", lat=USER_LAT + 1.0, emission="16K0F3E")[:-1] + ["LUU DONG TOAN QUOC"],
+    station_row("GP-4", "407.05", lat=USER_LAT + 20.0 / 110.6),
+]
+
+DELTA = [
+    ("SỬA", station_row("GP-2", "407.00625", lat=USER_LAT - 2.0 / 110.6)),
+    ("XÓA", ["GP-3", "", "", "", "", "", ""]),
+    ("THÊM", station_row("GP-5", "407.025", lat=USER_LAT + 3.0 / 110.6, emission="11K0F3E")),
+    ("THÊM", station_row("GP-6", "406.95", lat=USER_LAT, customer="KH 6")[:-1] + ["LUU DONG MIEN NAM"]),
+    ("THÊM", station_row("GP-1", "407.0", emission="16K0F3E")),
+]
+
+# Sheet gộp tương đương: dòng cũ không bị chạm giữ thứ tự, dòng THÊM / SỬA nối vào cuối theo thứ tự file cập nhật
+MERGED = [BASE[3]] + [row for action, row in DELTA if action != "XÓA"]
+
+
+def delta_frame(entries):
+    df = pd.DataFrame([row for _, row in entries], columns=STATION_COLUMNS)
+    df["Thao tác"] = [action for action, _ in entries]
+    return df
+
+
+def plain(df):
+    df = df.reset_index(drop=True).copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def test_apply_delta_matches_fresh_build_of_merged_sheet(make_tool):
+    tool = make_tool(BASE)
+    stats = tool.apply_delta(delta_frame(DELTA))
+    fresh = make_tool(MERGED)
+
+    assert stats == {"added": 2, "modified": 2, "removed": 1, "rows": len(fresh.df)}
+    pd.testing.assert_frame_equal(plain(tool.df), plain(fresh.df))
+    np.testing.assert_array_equal(tool._key_sorted, fresh._key_sorted)
+    np.testing.assert_array_equal(tool._freq_order, fresh._freq_order)
+    assert sorted(tool.reserved_frequencies) == sorted(fresh.reserved_frequencies) == [406.95]
+    np.testing.assert_array_equal(tool.station_grid.valid, fresh.station_grid.valid)
+    for radius_km in (1.0, 5.0, 50.0, 500.0):
+        np.testing.assert_array_equal(np.sort(tool.station_grid.query(USER_LAT, USER_LON, radius_km)),
+                                      np.sort(fresh.station_grid.query(USER_LAT, USER_LON, radius_km)))
+
+    assert list(tool.tinh_toan(SCAN)) == list(fresh.tinh_toan(SCAN))
+    assert tool.tim_cac_tan_so_khong_kha_dung(SCAN) == fresh.tim_cac_tan_so_khong_kha_dung(SCAN)
+
+
+def test_apply_delta_invalidates_cached_results(make_tool):
+    tool = make_tool(BASE)
+    before = list(tool.tinh_toan(SCAN))
+    tool.apply_delta(delta_frame(DELTA))
+    assert list(tool.tinh_toan(SCAN)) == list(make_tool(MERGED).tinh_toan(SCAN)) != before
+
+
+def test_apply_delta_remove_all_rows(make_tool):
+    tool = make_tool(BASE)
+    stats = tool.apply_delta(delta_frame([("XÓA", [lic, "", "", "", "", "", ""]) for lic in ("GP-1", "GP-2", "GP-3", "GP-4")]))
+    assert stats == {"added": 0, "modified": 0, "removed": 4, "rows": 0}
+    assert tool.df.empty
+    assert tool.reserved_frequencies == []
+    assert len(tool.tinh_toan(SCAN)) == 0
+
+
+def test_apply_delta_rejects_unknown_action_without_changing_store(make_tool):
+    tool = make_tool(BASE)
+    df_before, fingerprint = plain(tool.df), tool.dataset_fingerprint
+    with pytest.raises(ValueError, match="Thao tác"):
+        tool.apply_delta(delta_frame([("ĐỔI TÊN", station_row("GP-1", "407.0"))]))
+    pd.testing.assert_frame_equal(plain(tool.df), df_before)
+    assert tool.dataset_fingerprint == fingerprint
+
+
+def test_apply_delta_requires_license_column(make_tool):
+    tool = make_tool(BASE)
+    with pytest.raises(ValueError, match="Số giấy phép"):
+        tool.apply_delta(delta_frame([("THÊM", station_row("GP-9", "407.0"))]).drop(columns=["Số giấy phép"]))
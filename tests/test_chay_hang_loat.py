@@ -0,0 +1,19 @@
+import pandas as pd
+
+import chay_hang_loat
+from conftest import write_stations
+
+
+def test_header_only_request_sheet_writes_empty_summary(tmp_path):
+    data = write_stations(tmp_path / "stations.csv", [["GP-A", "KH", "407.0", "4K00F3E", 10.8, 106.7, "HCM"]])
+    requests = tmp_path / "ho_so.csv"
+    requests.write_text("Vĩ độ,Kinh độ,Tỉnh / TP,Dải tần,Băng thông,Loại mạng\n", encoding="utf-8-sig")
+    out_dir = tmp_path / "ket_qua"
+
+    code = chay_hang_loat.main(["--data", data, "--requests", str(requests), "--task", "tinh_toan",
+                                "--format", "csv", "--workers", "1", "--output-dir", str(out_dir)])
+
+    assert code == 0
+    summary = pd.read_csv(out_dir / "TONG_HOP.csv", encoding="utf-8-sig")
+    assert list(summary.columns) == chay_hang_loat.SUMMARY_COLUMNS
+    assert summary.empty
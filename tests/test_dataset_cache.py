@@ -0,0 +1,100 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tool_tinh_toan
+from tool_tinh_toan import STORE_CATEGORY_COLUMNS, ToolAnDinhTanSo, prune_dataset_cache
+from conftest import write_stations
+from test_tinh_toan import USER_INPUT, USER_LAT, station_row
+
+SCAN = {**USER_INPUT, "scan_start": 406.9, "scan_end": 407.2}
+
+ROWS = [
+    station_row("GP-1", "407.0"),
+    station_row("GP-2", "407.0125 407.025", lat=USER_LAT + 0.5 / 110.6, emission="11K0F3E"),
+    station_row("GP-3", "406.95", emission="16K0F3E")[:-1] + ["LUU DONG TOAN QUOC"],
+    station_row("GP-4/GP", "407.05", lat=USER_LAT + 20.0 / 110.6, customer=""),
+]
+
+
+def cache_files():
+    return sorted(os.listdir(tool_tinh_toan.DATASET_CACHE_DIR))
+
+
+def test_cache_load_equals_fresh_parse(tmp_path, monkeypatch):
+    path = write_stations(tmp_path / "stations.csv", ROWS)
+    fresh = ToolAnDinhTanSo(path)
+    assert [name for name in cache_files() if name.endswith(".npz")] == [os.path.basename(fresh.dataset_cache_path())]
+
+    def no_parse(self):
+        raise AssertionError("không nạp từ cache")
+
+    monkeypatch.setattr(ToolAnDinhTanSo, "clean_data", no_parse)
+    cached = ToolAnDinhTanSo(path)
+
+    pd.testing.assert_frame_equal(cached.df, fresh.df)
+    for col in STORE_CATEGORY_COLUMNS:
+        assert isinstance(cached.df[col].dtype, pd.CategoricalDtype)
+    np.testing.assert_array_equal(cached.df["flags"].to_numpy(), fresh.df["flags"].to_numpy())
+    assert cached.df["flags"].dtype == np.uint8
+    np.testing.assert_array_equal(cached._key_sorted, fresh._key_sorted)
+    np.testing.assert_array_equal(cached._freq_order, fresh._freq_order)
+    assert cached.reserved_frequencies == fresh.reserved_frequencies == [406.95]
+    assert cached.dataset_fingerprint == fresh.dataset_fingerprint
+
+    # Cùng fingerprint thì dùng chung cache kết quả: tính lại riêng cho từng Tool
+    outputs = []
+    for tool in (fresh, cached):
+        tool_tinh_toan.QUERY_RESULT_CACHE.clear()
+        tool_tinh_toan.SITE_DISTANCE_CACHE.clear()
+        outputs.append((list(tool.tinh_toan(SCAN)), tool.tim_cac_tan_so_khong_kha_dung(SCAN)))
+    assert outputs[0] == outputs[1]
+
+
+def test_failed_save_leaves_no_temp_file(tmp_path, monkeypatch):
+    def broken_savez(*args, **kwargs):
+        raise OSError("hết dung lượng đĩa")
+
+    monkeypatch.setattr(tool_tinh_toan.np, "savez", broken_savez)
+    tool = ToolAnDinhTanSo(write_stations(tmp_path / "stations.csv", ROWS))
+    assert not tool.df.empty
+    assert cache_files() == []
+
+
+def write_cache_file(name, nbytes, age_days):
+    os.makedirs(tool_tinh_toan.DATASET_CACHE_DIR, exist_ok=True)
+    path = os.path.join(tool_tinh_toan.DATASET_CACHE_DIR, name)
+    with open(path, "wb") as fh:
+        fh.write(b"\0" * nbytes)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_prune_removes_oldest_until_under_budget(monkeypatch):
+    monkeypatch.setattr(tool_tinh_toan, "DATASET_CACHE_MAX_MB", 2.5)
+    mb = 1024 * 1024
+    oldest = write_cache_file("a.npz", mb, age_days=3)
+    older = write_cache_file("b.npz", mb, age_days=2)
+    newer = write_cache_file("c.npz", mb, age_days=1)
+    newest = write_cache_file("d.npz", mb, age_days=0)
+    assert prune_dataset_cache(keep=newest) == [oldest, older]
+    assert cache_files() == ["c.npz", "d.npz"]
+    assert os.path.exists(newer)
+
+
+def test_prune_removes_expired_files_but_never_keep(monkeypatch):
+    monkeypatch.setattr(tool_tinh_toan, "DATASET_CACHE_MAX_AGE_DAYS", 30)
+    expired = write_cache_file("old.npz", 10, age_days=45)
+    kept = write_cache_file("kept.npz", 10, age_days=60)
+    write_cache_file("recent.npz", 10, age_days=1)
+    write_cache_file("other.tmp", 10, age_days=90)
+    assert prune_dataset_cache(keep=kept) == [expired]
+    assert cache_files() == ["kept.npz", "other.tmp", "recent.npz"]
+
+
+def test_prune_missing_directory():
+    assert prune_dataset_cache() == []
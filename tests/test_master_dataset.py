@@ -0,0 +1,63 @@
+import os
+import time
+
+from tool_tinh_toan import MasterDataset
+
+
+class FakeTool:
+    def __init__(self, path):
+        with open(path, encoding="utf-8") as fh:
+            text = fh.read()
+        if text.startswith("BAD"):
+            raise ValueError("File Excel rỗng hoặc không đọc được dữ liệu.")
+        self.df = text.split()
+
+
+def write(path, text, mtime_ns):
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def wait_for(master, predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        tool = master.get()
+        if predicate(tool) and not master._reloading:
+            return tool
+        time.sleep(0.01)
+    raise AssertionError("MasterDataset không nạp lại trong thời gian chờ")
+
+
+def test_reloads_on_change_and_keeps_old_instance_on_failure(tmp_path):
+    path = tmp_path / "master.csv"
+    base_ns = time.time_ns() - 10**10
+    write(path, "GP-1", base_ns)
+    master = MasterDataset(str(path), check_interval=0, loader=FakeTool)
+    first = master.load()
+    assert first.df == ["GP-1"]
+
+    # Cùng kích thước, chỉ đổi mtime
+    write(path, "GP-2", base_ns + 10**9)
+    second = wait_for(master, lambda tool: tool is not first)
+    assert second.df == ["GP-2"]
+
+    # Đổi kích thước; bản mới lỗi thì giữ instance cũ và ghi lỗi, không thử lại cùng phiên bản file
+    write(path, "BAD FILE", base_ns + 2 * 10**9)
+    wait_for(master, lambda tool: master.last_error is not None)
+    assert master.get() is second
+    assert master._failed_stamp == master._file_stamp()
+
+    write(path, "GP-3 GP-4", base_ns + 3 * 10**9)
+    third = wait_for(master, lambda tool: tool is not second)
+    assert third.df == ["GP-3", "GP-4"]
+    assert master.last_error is None
+
+
+def test_file_created_after_start_is_loaded(tmp_path):
+    path = tmp_path / "master.csv"
+    master = MasterDataset(str(path), check_interval=0, loader=FakeTool)
+    assert master.load() is None
+    assert master.get() is None
+    write(path, "GP-1", time.time_ns())
+    assert wait_for(master, lambda tool: tool is not None).df == ["GP-1"]
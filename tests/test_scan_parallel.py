@@ -0,0 +1,66 @@
+import gc
+import os
+
+import numpy as np
+import pytest
+
+import tool_tinh_toan
+from test_tinh_toan import USER_INPUT, USER_LAT, USER_LON
+
+SHM_DIR = "/dev/shm"
+SCAN = {**USER_INPUT, "scan_start": 406.8, "scan_end": 407.4}
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(SHM_DIR), reason="cần /dev/shm để kiểm tra khối shared memory")
+
+
+def shm_segments():
+    return set(os.listdir(SHM_DIR))
+
+
+def station_rows(n=60, seed=7):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        # Tần số quanh dải quét: trùng lưới 6.25 kHz hoặc lệch vài kHz; vị trí trong bán kính ~10 km
+        f = 406.8 + rng.integers(0, 96) * 0.00625 + rng.choice([0, 0, 0.002, 0.003, 0.005, 0.009])
+        lat = USER_LAT + rng.uniform(-10, 10) / 110.6
+        lon = USER_LON + rng.uniform(-10, 10) / 109.0
+        emission = rng.choice(["4K00F3E", "11K0F3E", "16K0F3E"])
+        province = "LUU DONG MIEN NAM" if i % 20 == 0 else "HCM"
+        rows.append([f"GP-{i}", f"KH {i}", f"{f:.5f}", emission, f"{lat:.6f}", f"{lon:.6f}", province])
+    return rows
+
+
+def run_queries(tool):
+    tool_tinh_toan.QUERY_RESULT_CACHE.clear()
+    return list(tool.tinh_toan(SCAN)), tool.tim_cac_tan_so_khong_kha_dung(SCAN)
+
+
+def test_parallel_scan_matches_serial_and_releases_shared_memory(make_tool, monkeypatch):
+    tool = make_tool(station_rows())
+    serial = run_queries(tool)
+    assert serial[0] and serial[1]
+
+    before = shm_segments()
+    monkeypatch.setattr(tool_tinh_toan, "SCAN_WORKERS", 2)
+    monkeypatch.setattr(tool_tinh_toan, "SCAN_MIN_CANDIDATES", 1)
+    monkeypatch.setattr(tool_tinh_toan, "ENGINE_CHUNK_SIZE", 8)
+
+    # Tiến trình cha không được tính tuần tự (_scan âm thầm quay về scan_candidates khi nhóm tiến trình lỗi)
+    def serial_fallback(*args, **kwargs):
+        raise AssertionError("_scan đã quay về tính tuần tự")
+
+    monkeypatch.setattr(tool_tinh_toan, "scan_candidates", serial_fallback)
+    try:
+        parallel = run_queries(tool)
+        # Chỉ còn khối StationArrays của kho trạm (giữ đến khi Tool bị thu hồi); vector khoảng cách đã được giải phóng
+        assert len(shm_segments() - before) == 1
+    finally:
+        tool_tinh_toan.shutdown_scan_pool()
+
+    assert parallel[0] == serial[0]
+    assert parallel[1] == serial[1]
+
+    del tool
+    gc.collect()
+    assert shm_segments() - before == set()
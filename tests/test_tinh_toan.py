@@ -0,0 +1,108 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tool_tinh_toan import geodesic_km_batch, rank_available
+
+USER_LAT, USER_LON = 10.8, 106.7
+CANDIDATE = 407.0
+
+# Kịch bản LAN thành phố lớn, anten thấp (LAN_BIG_CITY_LOW), dải 406.2 - 409 chỉ có LAN
+USER_INPUT = {
+    "lat": USER_LAT, "lon": USER_LON, "province_code": "HCM", "antenna_height": 10,
+    "band": "UHF", "bw": 6.25, "usage_mode": "LAN", "scan_start": 406.99, "scan_end": 407.01,
+}
+MODE = ("LAN", "LAN_BIG_CITY_LOW")
+
+# Trạm cách người dùng ~4 km về phía bắc: xa hơn khoảng cách yêu cầu kênh kề, gần hơn đồng kênh
+STATION_LAT = USER_LAT + 4.0 / 110.6
+
+
+def station_row(license_no, freq, lat=STATION_LAT, emission="4K00F3E", customer="KH"):
+    return [license_no, customer, freq, emission, lat, USER_LON, "HCM"]
+
+
+def unavailable_for(tool, freq):
+    return [b for b in tool.tim_cac_tan_so_khong_kha_dung(USER_INPUT) if b["Tần số (MHz)"] == f"{freq:.5f}"]
+
+
+def available_freqs(tool):
+    return [row["frequency"] for row in tool.tinh_toan(USER_INPUT)]
+
+
+def test_edge_scenario_preconditions(make_tool):
+    tool = make_tool([station_row("GP-A", "407.003")])
+    assert CANDIDATE in tool.generate_candidates("UHF", 6.25, "LAN", "HCM", 406.99, 407.01)
+    assert tool.xac_dinh_kich_ban_user(USER_INPUT) == MODE
+    dist = geodesic_km_batch(USER_LAT, USER_LON, np.array([STATION_LAT]), np.array([USER_LON]))[0]
+    co_channel = tool.get_required_distance("UHF", MODE, "LAN", 6.25, 2.99, 6.25)
+    adjacent = tool.get_required_distance("UHF", MODE, "LAN", 6.25, 3.0, 6.25)
+    assert adjacent < dist < co_channel
+
+
+@pytest.mark.parametrize("freq", ["407.003", "406.997"])
+def test_delta_f_exactly_3khz_is_adjacent_channel(make_tool, freq):
+    # Δf = 3 kHz đúng biên: thuộc hàng kênh kề 6.25 kHz (biên dưới đóng, so sánh trên khóa kênh nguyên)
+    tool = make_tool([station_row("GP-A", freq)])
+    assert f"{CANDIDATE:.5f}" in available_freqs(tool)
+    assert unavailable_for(tool, CANDIDATE) == []
+
+
+@pytest.mark.parametrize("freq", ["407.00299", "406.99701"])
+def test_delta_f_just_below_3khz_is_co_channel(make_tool, freq):
+    tool = make_tool([station_row("GP-A", freq)])
+    assert f"{CANDIDATE:.5f}" not in available_freqs(tool)
+    bads = unavailable_for(tool, CANDIDATE)
+    assert [b["Loại nhiễu"] for b in bads] == ["Đồng kênh"]
+    assert bads[0]["Số GP bị nhiễu"] == "GP-A"
+
+
+def test_delta_f_exactly_3khz_labelled_adjacent_when_too_close(make_tool):
+    # Trạm sát người dùng: Δf = 3 kHz vẫn bị chặn, nhưng theo khoảng cách kênh kề
+    tool = make_tool([station_row("GP-A", "407.003", lat=USER_LAT + 0.2 / 110.6)])
+    assert f"{CANDIDATE:.5f}" not in available_freqs(tool)
+    bads = unavailable_for(tool, CANDIDATE)
+    assert [b["Loại nhiễu"] for b in bads] == ["Kênh kề 6.25kHz"]
+    assert bads[0]["Khoảng cách yêu cầu (km)"] == tool.get_required_distance("UHF", MODE, "LAN", 6.25, 3.0, 6.25)
+
+
+def test_query_cache_separates_datasets_differing_only_in_emission(make_tool):
+    # Cùng tần số / tọa độ, khác phương thức phát: băng thông thu 6.25 kHz (kênh kề 1.4 km) và 25 kHz (5 km)
+    narrow = make_tool([station_row("GP-A", "407.003", emission="4K00F3E")])
+    wide = make_tool([station_row("GP-A", "407.003", emission="16K0F3E")])
+    assert f"{CANDIDATE:.5f}" in available_freqs(narrow)
+    assert f"{CANDIDATE:.5f}" not in available_freqs(wide)
+    assert unavailable_for(narrow, CANDIDATE) == []
+    assert [b["Loại nhiễu"] for b in unavailable_for(wide, CANDIDATE)] == ["Kênh kề 6.25kHz"]
+
+
+def test_query_cache_separates_datasets_differing_only_in_license(make_tool):
+    far_lat = USER_LAT + 20.0 / 110.6
+    first = make_tool([station_row("GP-A", "407.0", lat=far_lat, customer="KH A")])
+    second = make_tool([station_row("GP-B", "407.0", lat=far_lat, customer="KH B")])
+    rows = {tool: {row["frequency"]: row for row in tool.tinh_toan(USER_INPUT)} for tool in (first, second)}
+    assert "GP-A" in rows[first][f"{CANDIDATE:.5f}"]["license_list"]
+    assert "GP-B" in rows[second][f"{CANDIDATE:.5f}"]["license_list"]
+    assert "GP-A" not in rows[second][f"{CANDIDATE:.5f}"]["license_list"]
+
+
+def test_stream_scans_a_snapshot_without_blocking_apply_delta(make_tool):
+    far_lat = USER_LAT + 20.0 / 110.6
+    tool = make_tool([station_row("GP-A", "407.0", lat=far_lat)])
+    stream = tool.tinh_toan_stream(USER_INPUT, chunk_size=1)
+    parts = [next(stream)]
+
+    # Người đọc dừng giữa chừng: apply_delta vẫn công bố được kho mới
+    delta = pd.DataFrame({"Số giấy phép": ["GP-A"], "Thao tác": ["XÓA"]})
+    worker = threading.Thread(target=tool.apply_delta, args=(delta,))
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive()
+    assert tool.df.empty
+
+    # Phần còn lại của lượt quét vẫn theo kho cũ
+    parts.extend(stream)
+    rows = {row["frequency"]: row for row in rank_available(parts)}
+    assert "GP-A" in rows[f"{CANDIDATE:.5f}"]["license_list"]
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from tool_tinh_toan import ToolRegistry
+
+
+class FakeTool:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def memory_footprint(self):
+        return {"total": self.nbytes}
+
+
+def test_referenced_datasets_are_never_evicted():
+    registry = ToolRegistry(memory_budget_bytes=100)
+    a = registry.acquire("s1", "A", lambda: FakeTool(80))
+    b = registry.acquire("s2", "B", lambda: FakeTool(80))
+    # Cả hai bộ đều đang được giữ: vượt ngân sách nhưng không bộ nào bị loại
+    assert registry.get("A") is a and registry.get("B") is b
+    assert registry.stats()["sessions"] == 2
+    assert registry.acquire("s1", "A", lambda: pytest.fail("A bị dựng lại")) is a
+
+
+def test_unreferenced_datasets_are_evicted_oldest_first():
+    registry = ToolRegistry(memory_budget_bytes=100)
+    registry.acquire("s1", "A", lambda: FakeTool(40))
+    registry.acquire("s1", "B", lambda: FakeTool(40))   # s1 nhả A
+    registry.acquire("s2", "C", lambda: FakeTool(40))
+    assert registry.get("A") is None
+    assert registry.get("B") is not None and registry.get("C") is not None
+
+
+def test_concurrent_acquire_builds_once():
+    registry = ToolRegistry(memory_budget_bytes=1000)
+    started, release = threading.Event(), threading.Event()
+    builds = []
+
+    def factory():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return FakeTool(10)
+
+    results = {}
+    first = threading.Thread(target=lambda: results.setdefault("s1", registry.acquire("s1", "A", factory)))
+    first.start()
+    assert started.wait(5)
+    second = threading.Thread(target=lambda: results.setdefault("s2", registry.acquire("s2", "A", factory)))
+    second.start()
+    time.sleep(0.05)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(builds) == 1
+    assert results["s1"] is results["s2"]
+    assert registry.stats() == {"datasets": 1, "sessions": 2, "total_bytes": 10, "budget_bytes": 1000}
+
+
+def test_failed_build_is_raised_to_waiters_and_retried():
+    registry = ToolRegistry(memory_budget_bytes=1000)
+
+    def broken():
+        raise ValueError("File Excel rỗng")
+
+    with pytest.raises(ValueError):
+        registry.acquire("s1", "A", broken)
+    assert registry.acquire("s1", "A", lambda: FakeTool(10)).nbytes == 10
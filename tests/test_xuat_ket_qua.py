@@ -0,0 +1,17 @@
+import io
+
+import openpyxl
+import pandas as pd
+
+from xuat_ket_qua import to_excel
+
+
+def test_to_excel_bolds_section_headers():
+    df_input = pd.DataFrame({"THAM SỐ": ["Dải tần", "Băng thông"], "GIÁ TRỊ": ["UHF", 6.25]})
+    df_result = pd.DataFrame({"frequency": ["407.00000"], "is_priority": [False]})
+    sheet = openpyxl.load_workbook(io.BytesIO(to_excel(df_input, df_result)))["KET_QUA_TINH_TOAN"]
+
+    header_rows = {cell.value: cell for cell in sheet["A"] if cell.value in ("I. THÔNG SỐ ĐẦU VÀO", "II. KẾT QUẢ TÍNH TOÁN")}
+    assert set(header_rows) == {"I. THÔNG SỐ ĐẦU VÀO", "II. KẾT QUẢ TÍNH TOÁN"}
+    assert all(cell.font.bold for cell in header_rows.values())
+    assert "is_priority" not in [cell.value for row in sheet.iter_rows() for cell in row]
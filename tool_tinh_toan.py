@@ -1,11 +1,24 @@
 import pandas as pd
+from pandas.io.parsers import TextParser
 import re
 from geopy.distance import geodesic
 import config
 import numpy as np
 import logging
 import os
+import tempfile
 import importlib 
+import hashlib
+import math
+import copy
+import time
+import threading
+import weakref
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory, get_context
+from pandas.api.types import union_categoricals
 
 # --- RELOAD CONFIG ---
 importlib.reload(config)
@@ -25,11 +38,100 @@ DEFAULT_COL_MAPPING = {
     "ADDRESS": ["Địa điểm đặt thiết bị", "Địa chỉ", "Address", "Location"], 
     "PROVINCE_OLD": ["Tỉnh thành", "Province", "Tỉnh"],      
     "ANTENNA_HEIGHT": ["Độ cao anten", "Height", "Độ cao"],
-    "CONDITIONS": ["Các điều kiện khác", "Ghi chú", "Condition"]
+    "CONDITIONS": ["Các điều kiện khác", "Ghi chú", "Condition"],
+    "DELTA_ACTION": ["Thao tác", "Loại cập nhật", "Delta action"]
+}
+
+# Tên cột nội bộ tương ứng với từng nhóm trong DEFAULT_COL_MAPPING
+INTERNAL_COLUMN_NAMES = {
+    "LICENSE_NO": "license", "CUSTOMER": "raw_customer",
+    "FREQUENCY": "raw_freq", "FREQ_RX": "raw_freq_rx",
+    "BANDWIDTH": "raw_bw", "LAT": "raw_lat",
+    "LON": "raw_lon", "ADDRESS": "raw_address",
+    "PROVINCE_OLD": "raw_province_col", "ANTENNA_HEIGHT": "h_anten",
+    "CONDITIONS": "raw_conditions", "DELTA_ACTION": "delta_action"
+}
+
+# Cột bắt buộc (tên nội bộ -> tên hiển thị trong thông báo lỗi)
+REQUIRED_COLUMNS = {
+    "raw_freq": "Tần số phát (Frequency)",
+    "raw_lat": "Vĩ độ (Latitude)",
+    "raw_lon": "Kinh độ (Longitude)",
+    "raw_province_col": "Tỉnh thành (Province)" 
 }
 
 MAX_CANDIDATES = 20000
 
+# Khóa kênh nguyên: 1 đơn vị = 10Hz (tần số MHz làm tròn 5 chữ số thập phân)
+FREQ_KEYS_PER_MHZ = 100000
+FREQ_KEYS_PER_KHZ = 100
+
+# Số ứng viên đánh giá cùng lúc trong một khối ma trận (ứng viên x trạm lân cận)
+ENGINE_CHUNK_SIZE = 128
+# Số ứng viên (theo thứ tự lưới) mỗi lần tinh_toan_stream trả kết quả tạm
+STREAM_CHUNK_CANDIDATES = 512
+
+# Chia dải ứng viên cho nhóm tiến trình (tinh_toan / tim_cac_tan_so_khong_kha_dung): số tiến trình (0/1 = tắt,
+# tính trong tiến trình hiện tại), số ứng viên tối thiểu để đáng chia và số đoạn giao cho mỗi tiến trình
+SCAN_WORKERS = int(os.environ.get("PMR_SCAN_WORKERS", "0"))
+SCAN_MIN_CANDIDATES = int(os.environ.get("PMR_SCAN_MIN_CANDIDATES", "2000"))
+SCAN_SHARDS_PER_WORKER = 2
+# Chu kỳ (giây) kiểm tra cờ hủy khi chờ các đoạn của nhóm tiến trình
+SCAN_POLL_SECONDS = 0.2
+
+# Kho trạm dạng cột gọn: cột chuỗi lặp lại lưu dạng category, cờ trạng thái gộp thành bit trong cột 'flags'
+STORE_CATEGORY_COLUMNS = ['raw_emission', 'province', 'net_type', 'license', 'customer']
+FLAG_HOLDING = 1      # Giấy phép lưu động / giữ chỗ
+FLAG_HAS_COORDS = 2   # Có tọa độ hợp lệ
+
+# Cửa sổ tần số xét nhiễu: |Δf| < 35kHz (trùng kênh tuyệt đối = cùng khóa kênh)
+FREQ_WINDOW_MHZ = 0.035
+FREQ_WINDOW_KEYS = round(FREQ_WINDOW_MHZ * FREQ_KEYS_PER_MHZ)
+
+# Ngưỡng phân nhóm Δf (kHz) dùng trong get_required_distance: <3, <9, <15, <21, <30
+DELTA_F_EDGES_KHZ = np.array([3.0, 9.0, 15.0, 21.0, 30.0])
+
+# Cache vector khoảng cách theo vị trí: số vị trí giữ lại và số chữ số làm tròn tọa độ (~1 cm)
+SITE_DISTANCE_CACHE_SIZE = 32
+SITE_CACHE_DECIMALS = 7
+
+# Cache kết quả truy vấn: số kết quả giữ lại, thời gian sống (giây), số chữ số làm tròn lat/lon trong khóa
+# (mặc định = SITE_CACHE_DECIMALS: kết quả trả về giống hệt khi tính lại; giảm xuống để gộp các vị trí sát nhau)
+QUERY_CACHE_SIZE = int(os.environ.get("PMR_QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get("PMR_QUERY_CACHE_TTL", "1800"))
+QUERY_CACHE_DECIMALS = int(os.environ.get("PMR_QUERY_CACHE_DECIMALS", str(SITE_CACHE_DECIMALS)))
+
+# Nhóm tỉnh được cấp các đoạn LAN riêng (418.5-419.5 / 428.5-429.5 và 440.5-441 / 445.5-446 MHz)
+LAN_GROUP_1_PROVINCES = ['HOCHIMINH', 'DANANG', 'TPHOCHIMINH', 'HCM', 'DN']
+LAN_GROUP_2_PROVINCES = ['HOCHIMINH', 'TPHOCHIMINH', 'HCM']
+
+# Chỉ mục không gian: kích thước ô lưới lat/lon (độ) và hệ số nới biên khi quy bán kính (km) ra độ
+SPATIAL_CELL_DEG = 0.5
+SPATIAL_MARGIN = 1.05
+
+# Phiên bản bộ quy tắc làm sạch / tính toán: tăng khi đổi logic clean_data hoặc định dạng kho trạm
+RULESET_VERSION = "2026.10-1"
+# Các bảng trong config ảnh hưởng tới kết quả (đưa vào dấu vân tay bộ quy tắc)
+RULESET_CONFIG_NAMES = [
+    'FREQUENCY_ALLOCATION_VHF', 'FREQUENCY_ALLOCATION_UHF', 'FORBIDDEN_BANDS', 'SHARED_FREQUENCIES',
+    'MARITIME_PRIORITY_BANDS', 'MATRIX_VHF', 'MATRIX_UHF', 'MATRIX_CROSS',
+    'FORBIDDEN_LIST_VHF', 'FORBIDDEN_LIST_UHF', 'COMMON_LIST_VHF', 'COMMON_LIST_UHF',
+    'RESERVED_LIST_VHF', 'RESERVED_LIST_UHF',
+]
+
+# File cập nhật (delta) theo số giấy phép: giá trị cột Thao tác (đã chuẩn hóa) -> loại thao tác
+DELTA_ACTIONS = {
+    "ADD": "ADD", "A": "ADD", "THEM": "ADD", "THEMMOI": "ADD",
+    "MODIFY": "MODIFY", "UPDATE": "MODIFY", "M": "MODIFY", "U": "MODIFY", "SUA": "MODIFY", "CAPNHAT": "MODIFY",
+    "REMOVE": "REMOVE", "DELETE": "REMOVE", "D": "REMOVE", "R": "REMOVE", "XOA": "REMOVE", "THUHOI": "REMOVE",
+}
+
+# Cache kho trạm đã làm sạch trên đĩa (.npz), khóa theo SHA-256 nội dung file tải lên + bộ quy tắc.
+# Giới hạn dung lượng (MB) và tuổi (ngày, tính từ lần dùng gần nhất); vượt thì xóa file cũ nhất trước
+DATASET_CACHE_DIR = os.environ.get("PMR_DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pmr_dataset_cache"))
+DATASET_CACHE_MAX_MB = float(os.environ.get("PMR_DATASET_CACHE_MAX_MB", "1024"))
+DATASET_CACHE_MAX_AGE_DAYS = float(os.environ.get("PMR_DATASET_CACHE_MAX_AGE_DAYS", "30"))
+
 def chuan_hoa_text(text):
     if pd.isna(text) or str(text).strip() == "":
         return ""
@@ -47,6 +149,28 @@ def chuan_hoa_text(text):
     text = re.sub(r'[^a-z0-9]', '', text) 
     return text.upper()
 
+def chuan_hoa_series(values):
+    """Phiên bản cột của chuan_hoa_text cho Series chuỗi, dùng các phép .str của pandas."""
+    text = values.str.strip().str.lower()
+    patterns = {
+        '[àáảãạăắằẳẵặâấầẩẫậ]': 'a', '[đ]': 'd',
+        '[èéẻẽẹêếềểễệ]': 'e', '[ìíỉĩị]': 'i',
+        '[òóỏõọôốồổỗộơớờởỡợ]': 'o', '[ùúủũụưứừửữự]': 'u',
+        '[ỳýỷỹỵ]': 'y'
+    }
+    for regex, replace in patterns.items():
+        text = text.str.replace(regex, replace, regex=True)
+
+    text = text.str.replace(r'thanh pho|tinh|tp\.|tp ', '', regex=True)
+    text = text.str.replace(r'[^a-z0-9]', '', regex=True)
+    return text.str.upper()
+
+def _to_float_or_nan(token):
+    try:
+        return float(token)
+    except:
+        return np.nan
+
 def parse_multiple_frequencies(freq_string):
     """
     Hàm bóc tách tất cả các tần số có trong một chuỗi.
@@ -60,78 +184,1300 @@ def parse_multiple_frequencies(freq_string):
     
     return [float(m) for m in matches]
 
+# ====================================================================
+# DẤU VÂN TAY BỘ QUY TẮC / NỘI DUNG FILE TẢI LÊN
+# ====================================================================
+def ruleset_fingerprint():
+    """Phiên bản bộ quy tắc: RULESET_VERSION + nội dung các bảng cấu hình trong RULESET_CONFIG_NAMES."""
+    h = hashlib.sha1(RULESET_VERSION.encode())
+    for name in RULESET_CONFIG_NAMES:
+        h.update(f"{name}={getattr(config, name, None)!r};".encode())
+    return h.hexdigest()[:16]
+
+def hash_uploaded_files(uploaded_files):
+    """
+    SHA-256 nội dung các file tải lên (một file, danh sách file hoặc đường dẫn), kèm đuôi file
+    vì cùng nội dung nhưng khác định dạng sẽ được đọc khác nhau.
+    """
+    files = uploaded_files if isinstance(uploaded_files, list) else [uploaded_files]
+    h = hashlib.sha256()
+    for f in files:
+        name = f if isinstance(f, str) else getattr(f, 'name', '')
+        h.update(os.path.splitext(str(name))[1].lower().encode() + b"\0")
+        if isinstance(f, str):
+            with open(f, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    h.update(chunk)
+        elif hasattr(f, 'getvalue'):
+            h.update(f.getvalue())
+        else:
+            if hasattr(f, 'seek'): f.seek(0)
+            h.update(f.read())
+            if hasattr(f, 'seek'): f.seek(0)
+        h.update(b"\0")
+    return h.hexdigest()
+
+def prune_dataset_cache(keep=None):
+    """
+    Dọn thư mục DATASET_CACHE_DIR: xóa file .npz quá DATASET_CACHE_MAX_AGE_DAYS ngày không dùng, sau đó xóa file
+    cũ nhất (theo mtime, được làm mới mỗi lần nạp) đến khi tổng dung lượng không quá DATASET_CACHE_MAX_MB.
+    keep: đường dẫn không bao giờ xóa (file vừa ghi). Trả về danh sách file đã xóa.
+    """
+    try:
+        names = [name for name in os.listdir(DATASET_CACHE_DIR) if name.endswith(".npz")]
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        path = os.path.join(DATASET_CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+    files.sort()
+
+    budget = DATASET_CACHE_MAX_MB * 1024 * 1024
+    oldest_allowed = time.time() - DATASET_CACHE_MAX_AGE_DAYS * 86400
+    total = sum(size for _, size, _ in files)
+    removed = []
+    for mtime, size, path in files:
+        if total <= budget and mtime >= oldest_allowed:
+            continue
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Không xóa được cache kho trạm {path}: {e}")
+            continue
+        total -= size
+        removed.append(path)
+    if removed:
+        logger.info(f"Dọn cache kho trạm: xóa {len(removed)} file, còn {total / 1e6:.1f} MB")
+    return removed
+
+# ====================================================================
+# ÁNH XẠ CỘT & ĐỌC EXCEL DẠNG LUỒNG
+# ====================================================================
+def resolve_column_mapping(cols):
+    """
+    Chọn cột nguồn cho từng nhóm DEFAULT_COL_MAPPING: ưu tiên trùng tên tuyệt đối (không phân biệt hoa thường),
+    sau đó mới đến tên chứa từ khóa. Trả về dict {tên cột gốc: tên cột nội bộ}.
+    """
+    rename_map = {}
+    for key, keywords in DEFAULT_COL_MAPPING.items():
+        found = False
+        for col in cols:
+            for kw in keywords:
+                if kw.lower() == str(col).lower().strip():
+                    rename_map[col] = INTERNAL_COLUMN_NAMES[key]
+                    found = True
+                    break
+            if found: break
+        
+        if not found:
+            for col in cols:
+                col_str = str(col).lower()
+                for kw in keywords:
+                    if kw.lower() in col_str:
+                        rename_map[col] = INTERNAL_COLUMN_NAMES[key]
+                        found = True
+                        break
+                if found: break
+    return rename_map
+
+def missing_required_columns(internal_cols):
+    return [human_name for internal_col, human_name in REQUIRED_COLUMNS.items() if internal_col not in internal_cols]
+
+def _convert_xlsx_cell(cell):
+    """Chuyển giá trị ô openpyxl giống pandas.read_excel (ô trống -> "", lỗi -> NaN, số nguyên -> int)."""
+    if cell.value is None:
+        return ""
+    if cell.data_type == 'e':
+        return np.nan
+    if cell.data_type == 'n':
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+def read_xlsx_columns(file_source, validate_header=None):
+    """
+    Đọc sheet đầu tiên của file .xlsx nhưng chỉ giữ các cột cần thiết:
+    1. Đọc dòng tiêu đề, chuẩn hóa tên cột như pandas.read_excel (Unnamed: i, trùng tên -> .1, .2...).
+    2. Kiểm tra cột bắt buộc ngay trên tiêu đề (validate_header + ánh xạ DEFAULT_COL_MAPPING), lỗi thì dừng sớm.
+    3. Duyệt từng dòng ở chế độ read_only, chỉ giữ giá trị của các cột đã ánh xạ.
+    Kiểu dữ liệu được suy ra bằng TextParser như read_excel nên DataFrame thu được giống hệt
+    read_excel(...)[các cột đã chọn].
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(file_source, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = ws.iter_rows()
+
+        header = [_convert_xlsx_cell(c) for c in next(rows, ())]
+        while header and header[-1] == "":
+            header.pop()
+        if not header:
+            return pd.DataFrame()
+        names = TextParser([header], header=0, skip_blank_lines=False).read().columns
+        if names.inferred_type == 'string':
+            names = names.str.strip()
+        if validate_header is not None:
+            validate_header(pd.DataFrame(columns=names))
+
+        rename_map = resolve_column_mapping(names)
+        missing_cols = missing_required_columns(set(rename_map.values()))
+        if missing_cols:
+            raise ValueError(f"File Excel thiếu các cột bắt buộc: {', '.join(missing_cols)}. Vui lòng kiểm tra lại file đầu vào.")
+        selected = [i for i, name in enumerate(names) if name in rename_map]
+
+        data = []
+        last_row_with_data = -1
+        for row in rows:
+            n_cells = len(row)
+            data.append([_convert_xlsx_cell(row[i]) if i < n_cells else "" for i in selected])
+            if any(c.value is not None for c in row):
+                last_row_with_data = len(data) - 1
+        data = data[:last_row_with_data + 1]
+    finally:
+        wb.close()
+
+    if not data:
+        return pd.DataFrame(columns=[names[i] for i in selected])
+    df = TextParser(data, names=list(range(len(selected))), header=None, skip_blank_lines=False).read()
+    df.columns = [names[i] for i in selected]
+    return df
+
+def validate_raw_df(df_raw):
+    required_groups = [
+        ["Tần số phát", "Frequency", "Freq", "Tx Freq", "Tần số"],
+        ["Vị trí anten: Vĩ độ", "Vĩ độ", "Lat", "Latitude"],
+        ["Vị trí anten: Kinh độ", "Kinh độ", "Lon", "Long", "Longitude"],
+        ["Tỉnh thành", "Province", "Tỉnh"]
+    ]
+    
+    for keywords in required_groups:
+        col_found = False
+        for col in df_raw.columns:
+            col_str = str(col).lower().strip()
+            if any(kw.lower() in col_str for kw in keywords):
+                col_found = True
+                break
+                
+        if not col_found:
+            raise ValueError("File Excel thiếu các cột bắt buộc: Tần số phát (Frequency), Vĩ độ (Latitude), Kinh độ (Longitude), Tỉnh thành (Province). Vui lòng kiểm tra lại file đầu vào")
+
+def read_station_file(file_source):
+    """Đọc một file dữ liệu trạm (.csv / .xlsx) thành DataFrame thô (tên cột gốc)."""
+    file_name = ""
+    if hasattr(file_source, 'name'):
+        file_name = file_source.name
+    elif isinstance(file_source, str):
+        file_name = file_source
+        
+    df_temp = pd.DataFrame()
+    
+    if file_name.lower().endswith('.csv'):
+        try:
+            df_temp = pd.read_csv(file_source, encoding='utf-8-sig')
+        except:
+            if hasattr(file_source, 'seek'): file_source.seek(0)
+            df_temp = pd.read_csv(file_source, encoding='latin-1')
+    elif file_name.lower().endswith('.xlsx'):
+        # Chỉ đọc các cột cần dùng, kiểm tra cột bắt buộc ngay từ dòng tiêu đề
+        df_temp = read_xlsx_columns(file_source, validate_header=validate_raw_df)
+    
+    if not df_temp.empty:
+        df_temp.columns = df_temp.columns.str.strip()
+        validate_raw_df(df_temp)
+        
+    return df_temp
+
+# ====================================================================
+# KHÓA KÊNH NGUYÊN
+# ====================================================================
+def freq_to_key(freqs):
+    """Tần số (MHz) -> khóa kênh nguyên (đơn vị 10Hz). So sánh, ghép, nhóm kênh đều làm trên khóa này."""
+    scaled = np.clip(np.asarray(freqs, dtype=float) * FREQ_KEYS_PER_MHZ, -4e18, 4e18)
+    return np.rint(scaled).astype(np.int64)
+
+# ====================================================================
+# CACHE LRU DÙNG CHUNG GIỮA CÁC PHIÊN
+# ====================================================================
+class LRUCache:
+    """
+    Cache LRU giới hạn số phần tử, an toàn luồng (Streamlit chạy mỗi phiên trên một thread).
+    ttl (giây, tùy chọn): phần tử quá hạn coi như không có. Đếm số lần trúng / trượt cho thống kê.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()   # key -> (value, thời điểm hết hạn hoặc None)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] is not None and item[1] < time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data),
+                    "maxsize": self.maxsize, "ttl": self.ttl}
+
+    def __len__(self):
+        return len(self._data)
+
+class ReadWriteLock:
+    """
+    Khóa đọc / ghi: nhiều luồng đọc cùng lúc, luồng ghi độc quyền. Không ưu tiên luồng ghi (luồng đọc chỉ chờ khi
+    đang có luồng ghi), nên luồng đang giữ quyền đọc lấy lại quyền đọc lồng nhau không tự khóa mình.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+# Vector khoảng cách từ một vị trí tới toàn bộ trạm, khóa (fingerprint dữ liệu, lat, lon làm tròn)
+SITE_DISTANCE_CACHE = LRUCache(SITE_DISTANCE_CACHE_SIZE)
+
+# Kết quả tinh_toan / kiem_tra_tan_so_cu_the / tim_cac_tan_so_khong_kha_dung, khóa theo đầu vào đã chuẩn hóa
+QUERY_RESULT_CACHE = LRUCache(QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_SECONDS)
+
+def query_cache_stats():
+    """Thống kê cache kết quả truy vấn: hits, misses, size, maxsize, ttl."""
+    return QUERY_RESULT_CACHE.stats()
+
+class AvailableFrequencies:
+    """
+    Kết quả tinh_toan dạng cột, mỗi dòng một tần số khả dụng: khóa kênh Tx (và Rx khi song công), cờ ưu tiên
+    hàng hải và danh sách GP dùng lại tần số dạng CSR (lic_offsets / lic_names / lic_dists, trong mỗi dòng xếp
+    theo khoảng cách tăng dần; hệ số tái sử dụng = độ dài dòng). Chuỗi hiển thị ("frequency", "license_list")
+    chỉ dựng cho các dòng thực sự được đọc (row, results[i], results[:n], to_frame).
+    Mảng chỉ đọc, đối tượng không đổi sau khi tạo nên cache kết quả trả thẳng không cần sao chép.
+    """
+    COLUMNS = ["STT", "frequency", "reuse_factor", "license_list", "is_priority"]
+
+    def __init__(self, tx_keys, rx_keys, priority, lic_offsets, lic_names, lic_dists):
+        self.tx_keys = np.asarray(tx_keys, dtype=np.int64)
+        self.rx_keys = None if rx_keys is None else np.asarray(rx_keys, dtype=np.int64)
+        self.priority = np.asarray(priority, dtype=bool)
+        self.lic_offsets = np.asarray(lic_offsets, dtype=np.int64)
+        self.lic_names = np.asarray(lic_names, dtype=object)
+        self.lic_dists = np.asarray(lic_dists, dtype=float)
+        self.reuse = np.diff(self.lic_offsets)
+        for arr in (self.tx_keys, self.rx_keys, self.priority, self.lic_offsets, self.lic_names, self.lic_dists, self.reuse):
+            if arr is not None: arr.flags.writeable = False
+
+    @classmethod
+    def empty(cls, duplex=False):
+        return cls([], [] if duplex else None, [], [0], [], [])
+
+    @classmethod
+    def concat(cls, parts):
+        """Nối các phần (VD các đoạn của tinh_toan_stream) theo thứ tự."""
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            return cls.empty()
+        offsets, shift = [np.zeros(1, dtype=np.int64)], 0
+        for p in parts:
+            offsets.append(p.lic_offsets[1:] + shift)
+            shift += int(p.lic_offsets[-1])
+        duplex = parts[0].rx_keys is not None
+        return cls(np.concatenate([p.tx_keys for p in parts]),
+                   np.concatenate([p.rx_keys for p in parts]) if duplex else None,
+                   np.concatenate([p.priority for p in parts]), np.concatenate(offsets),
+                   np.concatenate([p.lic_names for p in parts]), np.concatenate([p.lic_dists for p in parts]))
+
+    def take(self, idx):
+        """Các dòng idx (theo thứ tự idx) thành một đối tượng mới."""
+        idx = np.asarray(idx, dtype=np.intp)
+        lens = self.reuse[idx]
+        offsets = np.concatenate([[0], np.cumsum(lens)]).astype(np.int64)
+        pos = np.repeat(self.lic_offsets[idx] - offsets[:-1], lens) + np.arange(offsets[-1])
+        return AvailableFrequencies(self.tx_keys[idx], None if self.rx_keys is None else self.rx_keys[idx],
+                                    self.priority[idx], offsets, self.lic_names[pos], self.lic_dists[pos])
+
+    def ranked(self):
+        """Tần số thường trước tần số ưu tiên, hệ số tái sử dụng giảm dần, giữ thứ tự lưới khi bằng nhau."""
+        return self.take(np.lexsort((-self.reuse, self.priority)))
+
+    def __len__(self):
+        return len(self.tx_keys)
+
+    def frequency(self, i):
+        f_tx = f"{self.tx_keys[i] / FREQ_KEYS_PER_MHZ:.5f}"
+        if self.rx_keys is None:
+            return f_tx
+        return f"{f_tx} / {self.rx_keys[i] / FREQ_KEYS_PER_MHZ:.5f}"
+
+    def license_list(self, i):
+        lo, hi = self.lic_offsets[i], self.lic_offsets[i + 1]
+        return ", ".join(f"{lic}({int(dist)})" for lic, dist in zip(self.lic_names[lo:hi], self.lic_dists[lo:hi]))
+
+    def row(self, i):
+        """Dòng thứ i dạng dict như kết quả tinh_toan trước đây (STT = i + 1)."""
+        return {
+            "STT": i + 1,
+            "frequency": self.frequency(i),
+            "reuse_factor": int(self.reuse[i]),
+            "license_list": self.license_list(i),
+            "is_priority": bool(self.priority[i])
+        }
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(len(self)))]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        return self.row(i)
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def to_frame(self, limit=None):
+        """DataFrame các cột COLUMNS cho limit dòng đầu (None = tất cả)."""
+        return pd.DataFrame(self[:limit], columns=self.COLUMNS)
+
+def rank_available(parts):
+    """
+    Ghép các phần AvailableFrequencies (VD các đoạn đã nhận từ tinh_toan_stream) và xếp hạng như kết quả
+    tinh_toan; dùng được cho danh sách tạm trong lúc quét.
+    """
+    if isinstance(parts, AvailableFrequencies):
+        parts = [parts]
+    return AvailableFrequencies.concat(parts).ranked()
+
+def copy_query_result(value):
+    """Bản sao kết quả (list/dict lồng nhau) để người gọi sửa kết quả không làm hỏng bản trong cache; AvailableFrequencies chỉ đọc nên trả thẳng."""
+    if isinstance(value, list):
+        return [copy_query_result(item) for item in value]
+    if isinstance(value, dict):
+        return {k: copy_query_result(v) for k, v in value.items()}
+    return value
+
+class ToolRegistry:
+    """
+    Kho đối tượng Tool dùng chung toàn tiến trình, khóa theo SHA-256 nội dung file (hash_uploaded_files).
+    - Mỗi phiên giữ tham chiếu tới đúng một bộ dữ liệu; tải file mới chỉ nhả tham chiếu cũ của phiên đó.
+    - Vượt ngân sách bộ nhớ (byte, theo memory_footprint) thì loại các bộ không phiên nào giữ, ít dùng nhất trước.
+      Bộ đang được phiên giữ không bao giờ bị loại: riêng chúng đã vượt ngân sách thì ghi cảnh báo và chấp nhận vượt.
+    - Mỗi key chỉ dựng một lần: phiên đến sau trong lúc bộ đó đang dựng chờ kết quả của lần dựng đầu tiên.
+    """
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._entries = OrderedDict()   # key -> {"tool", "nbytes", "sessions"}
+        self._session_keys = {}          # session_id -> key
+        self._pending = {}               # key -> Future của lần dựng đang chạy
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry["tool"]
+
+    def acquire(self, session_id, key, factory):
+        """
+        Tool của bộ dữ liệu key cho phiên session_id; dựng bằng factory() nếu chưa có (ngoài khóa).
+        Đang có luồng khác dựng cùng key thì chờ lần dựng đó (lỗi của factory được ném lại cho mọi phiên chờ).
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._attach_locked(session_id, key)
+            pending = self._pending.get(key)
+            building = pending is None
+            if building:
+                pending = self._pending[key] = Future()
+
+        if not building:
+            tool = pending.result()
+        else:
+            try:
+                tool = factory()
+            except BaseException as e:
+                with self._lock:
+                    del self._pending[key]
+                pending.set_exception(e)
+                raise
+        nbytes = tool.memory_footprint()["total"] if hasattr(tool, 'memory_footprint') else 0
+        with self._lock:
+            if building:
+                del self._pending[key]
+            if key not in self._entries:
+                self._entries[key] = {"tool": tool, "nbytes": nbytes, "sessions": set()}
+            result = self._attach_locked(session_id, key)
+        if building:
+            pending.set_result(tool)
+        return result
+
+    def _attach_locked(self, session_id, key):
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        self._release_locked(session_id)
+        entry["sessions"].add(session_id)
+        self._session_keys[session_id] = key
+        self._evict_locked()
+        return entry["tool"]
+
+    def release(self, session_id):
+        """Phiên session_id không dùng bộ dữ liệu hiện tại nữa (tải file khác / xóa file / hết phiên)."""
+        with self._lock:
+            self._release_locked(session_id)
+            self._evict_locked()
+
+    def release_sessions(self, session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                self._release_locked(session_id)
+            self._evict_locked()
+
+    def _release_locked(self, session_id):
+        key = self._session_keys.pop(session_id, None)
+        if key is not None and key in self._entries:
+            self._entries[key]["sessions"].discard(session_id)
+
+    def _evict_locked(self):
+        total = sum(entry["nbytes"] for entry in self._entries.values())
+        for key in list(self._entries.keys()):
+            if total <= self.memory_budget_bytes:
+                return
+            entry = self._entries[key]
+            if entry["sessions"]:
+                continue
+            del self._entries[key]
+            total -= entry["nbytes"]
+            logger.info(f"Giải phóng bộ dữ liệu {key[:12]} ({entry['nbytes'] / 1e6:.1f} MB)")
+        if total > self.memory_budget_bytes:
+            logger.warning(f"Các bộ dữ liệu đang được phiên giữ chiếm {total / 1e6:.1f} MB, "
+                           f"vượt ngân sách {self.memory_budget_bytes / 1e6:.1f} MB")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "sessions": len(self._session_keys),
+                "total_bytes": sum(entry["nbytes"] for entry in self._entries.values()),
+                "budget_bytes": self.memory_budget_bytes,
+            }
+
+# ====================================================================
+# BIÊN DỊCH MA TRẬN KHOẢNG CÁCH REV9 THÀNH MẢNG TRA CỨU
+# ====================================================================
+REV9_BANDS = ['VHF', 'UHF']
+REV9_TX_BW = [6.25, 12.5, 25.0]
+REV9_DELTA_KEYS = [0, 6.25, 12.5, 18.75, 25.0]
+REV9_RX_BW = [6.25, 12.5, 25.0]
+# Các loại mạng mà infer_net_type_from_freq có thể gán cho trạm
+NET_TYPES = ["LAN", "WAN_SIMPLEX", "WAN_DUPLEX"]
+
+def rx_bw_index(rx_bw):
+    """Chỉ số cột băng thông thu: <=9 -> 6.25, <=18 -> 12.5, còn lại -> 25 (nhận số hoặc mảng)."""
+    rx_bw = np.asarray(rx_bw, dtype=float)
+    return np.where(rx_bw <= 9, 0, np.where(rx_bw <= 18, 1, 2))
+
+def delta_f_bucket(delta_f_khz):
+    """Nhóm Δf: 0..4 ứng với các hàng 0/6.25/12.5/18.75/25 kHz, 5 = ngoài bảng (khoảng cách yêu cầu 0)."""
+    return np.searchsorted(DELTA_F_EDGES_KHZ, np.abs(delta_f_khz), side='right')
+
+class Rev9Tables:
+    """
+    Các ma trận MATRIX_VHF, MATRIX_UHF, MATRIX_CROSS biên dịch một lần thành mảng dày
+    values[band, bảng, tx_bw, nhóm Δf, rx_bw]. Giữ nguyên quy tắc dự phòng của bản dict:
+    thiếu tx_bw thì dùng hàng 12.5, thiếu ô thì bằng 0. Bảng cuối cùng (no_table) toàn 0.
+    """
+
+    def __init__(self):
+        band_keys = []
+        for matrix in (config.MATRIX_VHF, config.MATRIX_UHF):
+            for key in matrix:
+                if key not in band_keys: band_keys.append(key)
+        cross_keys = list(config.MATRIX_CROSS.keys())
+
+        self.band_tables = {key: i for i, key in enumerate(band_keys)}
+        self.cross_tables = {key: len(band_keys) + i for i, key in enumerate(cross_keys)}
+        self.no_table = len(band_keys) + len(cross_keys)
+
+        self.values = np.zeros((len(REV9_BANDS), self.no_table + 1, len(REV9_TX_BW), len(REV9_DELTA_KEYS) + 1, len(REV9_RX_BW)))
+        for b, band in enumerate(REV9_BANDS):
+            matrix = config.MATRIX_VHF if band == 'VHF' else config.MATRIX_UHF
+            sources = [(matrix, self.band_tables), (config.MATRIX_CROSS, self.cross_tables)]
+            for source, table_index in sources:
+                for key, t in table_index.items():
+                    table = source.get(key, {})
+                    for i_tx, tx_bw in enumerate(REV9_TX_BW):
+                        table_tx = table.get(tx_bw)
+                        if not table_tx: table_tx = table.get(12.5, {})
+                        for i_d, key_d in enumerate(REV9_DELTA_KEYS):
+                            row_delta = table_tx.get(key_d)
+                            if row_delta is None: continue
+                            for i_rx, key_rx in enumerate(REV9_RX_BW):
+                                self.values[b, t, i_tx, i_d, i_rx] = row_delta.get(key_rx, 0.0)
+
+    def band_index(self, band):
+        return 0 if band == 'VHF' else 1
+
+    def tx_index(self, tx_bw):
+        # tx_bw không có trong bảng -> dùng hàng 12.5 như bản dict
+        return REV9_TX_BW.index(tx_bw) if tx_bw in REV9_TX_BW else REV9_TX_BW.index(12.5)
+
+    def table_index(self, user_mode_tuple, db_net_type):
+        """Chọn bảng theo cặp (kịch bản người dùng, loại mạng của trạm) như get_required_distance."""
+        user_main_mode, user_scenario_key = user_mode_tuple
+        is_intra_lan = ("LAN" in user_main_mode and "LAN" in db_net_type)
+        is_intra_wan = ("WAN" in user_main_mode and "WAN" in db_net_type)
+
+        if is_intra_lan or is_intra_wan:
+            table_key = user_main_mode if is_intra_wan else user_scenario_key
+            return self.band_tables.get(table_key, self.no_table)
+
+        if "LAN" in user_main_mode and "WAN_SIMPLEX" in db_net_type: table_key = "LAN_VS_WAN_SIMPLEX"
+        elif "LAN" in user_main_mode and "WAN_DUPLEX" in db_net_type: table_key = "LAN_VS_WAN_DUPLEX"
+        elif "WAN_SIMPLEX" in user_main_mode and "LAN" in db_net_type: table_key = "WAN_SIMPLEX_VS_LAN"
+        elif "WAN_DUPLEX" in user_main_mode and "LAN" in db_net_type: table_key = "WAN_DUPLEX_VS_LAN"
+        else: return self.no_table
+        return self.cross_tables.get(table_key, self.no_table)
+
+    def lookup(self, band, table_idx, tx_bw, bucket, rx_idx):
+        """Tra khoảng cách yêu cầu hàng loạt; table_idx, bucket, rx_idx là các mảng broadcast được với nhau."""
+        return self.values[self.band_index(band)][table_idx, self.tx_index(tx_bw), bucket, rx_idx]
+
+    def max_distance(self, band, table_indices, tx_bw):
+        """Khoảng cách yêu cầu lớn nhất (km) trên các bảng cho trước: bán kính xét nhiễu của kịch bản."""
+        table_indices = np.unique(np.asarray(table_indices, dtype=np.intp))
+        return float(self.values[self.band_index(band)][table_indices, self.tx_index(tx_bw)].max())
+
+# ====================================================================
+# BẢNG QUY HOẠCH / DẢI CẤM / KÊNH DÙNG CHUNG BIÊN DỊCH SẴN
+# ====================================================================
+FORBIDDEN_GUARD_MHZ = 0.025     # Biên bảo vệ ±25kHz quanh dải cấm
+SHARED_FREQ_TOL_MHZ = 0.001     # Sai số so khớp kênh dùng chung (điểm)
+
+class IntervalIndex:
+    """
+    Tra "khoảng đầu tiên (theo thứ tự khai báo) chứa f" trên các khoảng có thể chồng nhau bằng np.searchsorted.
+    Các biên đã sắp xếp chia trục thành điểm biên và khoảng mở giữa hai biên liền kề; trong mỗi phần, tập khoảng
+    chứa f không đổi nên kết quả được tính sẵn một lần lúc dựng (O(E x R) với E biên, R khoảng). Mỗi lần tra chỉ
+    tốn O(N log E), không dựng ma trận N x R.
+    lo, hi: biên từng khoảng; open_: True = khoảng mở (lo, hi), False = khoảng đóng [lo, hi].
+    """
+
+    def __init__(self, lo, hi, open_=None):
+        lo = np.asarray(lo, dtype=float)
+        hi = np.asarray(hi, dtype=float)
+        open_ = np.zeros(len(lo), dtype=bool) if open_ is None else np.asarray(open_, dtype=bool)
+        self.edges = np.unique(np.concatenate([lo, hi]))
+
+        def first_match(x):
+            if len(lo) == 0 or len(x) == 0:
+                return np.full(len(x), -1, dtype=np.intp)
+            x = x[:, None]
+            match = np.where(open_, (lo < x) & (x < hi), (lo <= x) & (x <= hi))
+            return np.where(match.any(axis=1), match.argmax(axis=1), -1)
+
+        # Kết quả tại từng biên, và tại khoảng mở trước / giữa / sau các biên (ngoài cùng: không khoảng nào chứa)
+        self.at_edge = first_match(self.edges)
+        self.between = np.concatenate([[-1], first_match((self.edges[:-1] + self.edges[1:]) / 2), [-1]]).astype(np.intp)
+
+    def first(self, values):
+        """Chỉ số khoảng đầu tiên chứa từng giá trị (-1 nếu không khoảng nào chứa)."""
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        if len(self.edges) == 0:
+            return np.full(len(values), -1, dtype=np.intp)
+        pos = np.searchsorted(self.edges, values, side='left')
+        edge_pos = np.minimum(pos, len(self.edges) - 1)
+        on_edge = self.edges[edge_pos] == values
+        return np.where(on_edge, self.at_edge[edge_pos], self.between[pos])
+
+class BandRules:
+    """
+    Quy hoạch và các danh sách cấm / dùng chung / giữ chỗ của một băng (VHF hoặc UHF), biên dịch một lần
+    thành IntervalIndex trên khoảng [lo, hi] (đã cộng biên bảo vệ) và điểm (khoảng mở ±SHARED_FREQ_TOL_MHZ).
+    Các luật giữ đúng thứ tự ưu tiên của check_forbidden_status: luật khớp đầu tiên quyết định lý do.
+    """
+
+    def __init__(self, band):
+        suffix = "VHF" if band == "VHF" else "UHF"
+        self.allocations = config.FREQUENCY_ALLOCATION_VHF if band == 'VHF' else config.FREQUENCY_ALLOCATION_UHF
+        self.alloc_start = np.array([row[0] for row in self.allocations], dtype=float)
+        self.alloc_end = np.array([row[1] for row in self.allocations], dtype=float)
+        self.alloc_index = IntervalIndex(self.alloc_start, self.alloc_end)
+
+        lo, hi, is_point, reasons = [], [], [], []
+
+        def add(start, end, point, reason):
+            lo.append(start); hi.append(end); is_point.append(point); reasons.append(reason)
+
+        forbidden_candidates = []
+        for name in (f'FORBIDDEN_LIST_{suffix}', 'FORBIDDEN_BANDS'):
+            items = getattr(config, name, [])
+            if isinstance(items, list): forbidden_candidates.extend(items)
+        for item in forbidden_candidates:
+            if len(item) >= 2:
+                reason = item[2] if len(item) > 2 else "Dải tần sô cấm"
+                add(item[0] - FORBIDDEN_GUARD_MHZ, item[1] + FORBIDDEN_GUARD_MHZ, False, f"Biên bảo vệ ±25kHz của {reason}")
+
+        common_candidates = []
+        for name in (f'COMMON_LIST_{suffix}', 'SHARED_FREQUENCIES'):
+            items = getattr(config, name, [])
+            if isinstance(items, list): common_candidates.extend(items)
+        for item in common_candidates:
+            if isinstance(item, (int, float)):
+                add(item, item, True, "TẦN SỐ DÙNG CHUNG")
+            elif len(item) >= 2:
+                if isinstance(item[0], (int, float)) and isinstance(item[1], str):
+                    add(item[0], item[0], True, f"DÙNG CHUNG: {item[1]}")
+                elif len(item) >= 3:
+                    add(item[0], item[1], False, f"DÙNG CHUNG: {item[2]}")
+
+        reserved_list = getattr(config, f'RESERVED_LIST_{suffix}', [])
+        if isinstance(reserved_list, list):
+            for item in reserved_list:
+                if len(item) >= 3:
+                    add(item[0], item[1], False, f"GIỮ CHỖ: {item[2]}")
+
+        lo = np.array(lo, dtype=float)
+        hi = np.array(hi, dtype=float)
+        is_point = np.array(is_point, dtype=bool)
+        # Điểm dùng chung: |f - điểm| < SHARED_FREQ_TOL_MHZ, tức khoảng mở quanh điểm
+        self.rule_index = IntervalIndex(np.where(is_point, lo - SHARED_FREQ_TOL_MHZ, lo),
+                                        np.where(is_point, lo + SHARED_FREQ_TOL_MHZ, hi), is_point)
+        self.reasons = np.array(reasons + [""], dtype=object)
+
+    def classify(self, freqs):
+        """
+        Phân loại hàng loạt tần số: trả về (mảng bool bị chặn, mảng lý do). Lý do rỗng nếu không bị chặn.
+        """
+        first = self.rule_index.first(freqs)
+        blocked = first >= 0
+        return blocked, self.reasons[np.where(blocked, first, len(self.reasons) - 1)]
+
+    def allocation_rows(self, freqs):
+        """Chỉ số dòng quy hoạch đầu tiên chứa từng tần số (-1 nếu nằm ngoài quy hoạch)."""
+        return self.alloc_index.first(freqs)
+
+# ====================================================================
+# CHỈ MỤC TẦN SỐ GIỮ CHỖ / LƯU ĐỘNG TOÀN QUỐC
+# ====================================================================
+RESERVED_TOL_KEYS = FREQ_KEYS_PER_KHZ   # Vướng giữ chỗ khi |f - f_giữ_chỗ| < 1kHz
+
+class ReservedFreqIndex:
+    """
+    Tần số giữ chỗ lượng tử hóa thành khóa kênh nguyên, gom theo ô 1kHz để tra O(1) thay cho quét danh sách,
+    kèm mảng khóa đã sắp xếp để kiểm tra cả mảng ứng viên bằng searchsorted.
+    Điều kiện vướng: |khóa - khóa_giữ_chỗ| < RESERVED_TOL_KEYS (tức < 1kHz).
+    """
+
+    def __init__(self, freqs=()):
+        self._buckets = {}
+        keys = []
+        for pos, res_f in enumerate(freqs):
+            if not math.isfinite(res_f): continue
+            key = int(freq_to_key(res_f))
+            self._buckets.setdefault(key // RESERVED_TOL_KEYS, []).append((pos, key, res_f))
+            keys.append(key)
+        self._sorted = np.sort(np.array(keys, dtype=np.int64))
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def find(self, f_val):
+        """Tần số giữ chỗ đầu tiên (theo thứ tự danh sách) vướng với f_val, None nếu không có."""
+        if not self._buckets or not math.isfinite(f_val): return None
+        key = int(freq_to_key(f_val))
+        cell = key // RESERVED_TOL_KEYS
+        hits = [(pos, res_f) for c in (cell - 1, cell, cell + 1) for pos, res_key, res_f in self._buckets.get(c, ())
+                if abs(key - res_key) < RESERVED_TOL_KEYS]
+        return min(hits)[1] if hits else None
+
+    def contains(self, freqs):
+        """Kiểm tra hàng loạt: mảng bool, True nếu tần số vướng ít nhất một tần số giữ chỗ."""
+        keys = freq_to_key(np.atleast_1d(np.asarray(freqs, dtype=float)))
+        if len(self._sorted) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        pos = np.searchsorted(self._sorted, keys)
+        left = self._sorted[np.clip(pos - 1, 0, len(self._sorted) - 1)]
+        right = self._sorted[np.clip(pos, 0, len(self._sorted) - 1)]
+        return (np.abs(keys - left) < RESERVED_TOL_KEYS) | (np.abs(keys - right) < RESERVED_TOL_KEYS)
+
+# ====================================================================
+# KHOẢNG CÁCH TRẮC ĐỊA WGS-84 (VECTOR HÓA)
+# ====================================================================
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+def geodesic_km_batch(lat0, lon0, lats, lons, max_iter=200, tol=1e-12):
+    """
+    Khoảng cách (km) trên ellipsoid WGS-84 từ một điểm (lat0, lon0) tới mảng điểm (lats, lons).
+    Dùng công thức nghịch Vincenty vector hóa, sai lệch so với geopy.geodesic dưới 1 mm.
+    Điểm có vĩ độ ngoài [-90, 90] hoặc NaN trả về NaN (tương đương geodesic báo lỗi);
+    các cặp gần đối cực không hội tụ được tính lại bằng geopy.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    out = np.full(lats.shape, np.nan)
+    lat0 = float(lat0)
+    lon0 = float(lon0)
+    if not (-90 <= lat0 <= 90) or lats.size == 0:
+        return out
+
+    valid = (np.abs(lats) <= 90) & np.isfinite(lons)
+    phi2 = np.radians(lats[valid])
+    L = np.radians(lons[valid] - lon0)
+
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat0)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(phi2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    def _terms(lam):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+        return sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m
+
+    lam = L.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m = _terms(lam)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_new = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam_new - lam) <= tol
+            lam = lam_new
+            if converged.all():
+                break
+
+        sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m = _terms(lam)
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        dist = np.where(sin_sigma == 0, 0.0, WGS84_B * A * (sigma - delta_sigma) / 1000.0)
+
+    valid_idx = np.nonzero(valid)[0]
+    out[valid_idx] = dist
+
+    # Cặp gần đối cực không hội tụ: tính lại bằng geopy (thuật toán Karney)
+    for k in valid_idx[~converged]:
+        try:
+            out[k] = geodesic((lat0, lon0), (lats[k], lons[k])).km
+        except:
+            out[k] = np.nan
+    return out
+
+# ====================================================================
+# CHỈ MỤC KHÔNG GIAN TRẠM (LƯỚI Ô LAT/LON)
+# ====================================================================
+class StationGrid:
+    """
+    Lưới ô lat/lon (SPATIAL_CELL_DEG) trên các trạm có tọa độ hợp lệ, dựng một lần khi nạp dữ liệu.
+    query() trả về các dòng nằm trong những ô có thể chứa điểm cách vị trí người dùng dưới R km
+    (ước lượng dư, không bao giờ bỏ sót); khoảng cách chính xác chỉ tính cho các dòng này.
+    """
+
+    def __init__(self, lats, lons, has_coords):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        self.n_lat = int(np.ceil(180 / SPATIAL_CELL_DEG)) + 1
+        self.n_lon = int(np.ceil(360 / SPATIAL_CELL_DEG))
+        self.valid = np.asarray(has_coords, dtype=bool) & (np.abs(lats) <= 90) & np.isfinite(lons)
+
+        rows = np.nonzero(self.valid)[0]
+        cell_keys = self._lat_cell(lats[rows]) * self.n_lon + self._lon_cell(lons[rows])
+        order = np.argsort(cell_keys, kind='stable')
+        self._rows = rows[order]
+        self._keys = cell_keys[order]
+
+    def updated(self, keep, lats_new, lons_new, has_coords_new):
+        """
+        Lưới mới sau khi bỏ các dòng keep == False và nối thêm các dòng mới ở cuối, không sắp xếp lại toàn bộ:
+        lọc + đánh lại số dòng cũ, chèn các ô của dòng mới bằng searchsorted. Lưới hiện tại giữ nguyên
+        (các SiteDistances đang dùng nó không bị ảnh hưởng).
+        """
+        keep = np.asarray(keep, dtype=bool)
+        lats_new = np.asarray(lats_new, dtype=float)
+        lons_new = np.asarray(lons_new, dtype=float)
+        new_pos = np.cumsum(keep) - 1
+        n_kept = int(keep.sum())
+
+        sel = keep[self._rows]
+        rows = new_pos[self._rows[sel]]
+        keys = self._keys[sel]
+        valid_new = np.asarray(has_coords_new, dtype=bool) & (np.abs(lats_new) <= 90) & np.isfinite(lons_new)
+        add_rows = np.nonzero(valid_new)[0]
+        add_keys = self._lat_cell(lats_new[add_rows]) * self.n_lon + self._lon_cell(lons_new[add_rows])
+        order = np.argsort(add_keys, kind='stable')
+        ins = np.searchsorted(keys, add_keys[order], side='right')
+
+        grid = StationGrid.__new__(StationGrid)
+        grid.n_lat = self.n_lat
+        grid.n_lon = self.n_lon
+        grid.valid = np.concatenate([self.valid[keep], valid_new])
+        grid._rows = np.insert(rows, ins, n_kept + add_rows[order])
+        grid._keys = np.insert(keys, ins, add_keys[order])
+        return grid
+
+    def _lat_cell(self, lat):
+        return np.clip(np.floor((np.asarray(lat) + 90) / SPATIAL_CELL_DEG), 0, self.n_lat - 1).astype(np.int64)
+
+    def _lon_cell(self, lon):
+        return (np.floor(np.mod(np.asarray(lon) + 180, 360) / SPATIAL_CELL_DEG).astype(np.int64)) % self.n_lon
+
+    def query(self, lat0, lon0, radius_km):
+        """Vị trí (tăng dần) các dòng có thể nằm trong bán kính radius_km quanh (lat0, lon0)."""
+        if not (-90 <= lat0 <= 90) or not np.isfinite(lon0):
+            return np.nonzero(self.valid)[0]
+        # Độ dài 1 độ kinh tuyến >= 110.574 km; theo vĩ tuyến dùng chặn cầu sin(d/R) >= cos(phi).sin(dlon)
+        d_lat = SPATIAL_MARGIN * radius_km / 110.574
+        phi_max = min(abs(lat0) + d_lat, 90.0)
+        sin_lon = SPATIAL_MARGIN * np.sin(min(radius_km / 6356.752, np.pi / 2)) / max(np.cos(np.radians(phi_max)), 1e-12)
+
+        i_lo, i_hi = self._lat_cell(lat0 - d_lat), self._lat_cell(lat0 + d_lat)
+        if sin_lon >= 1:
+            lon_runs = [(0, self.n_lon - 1)]
+        else:
+            d_lon = np.degrees(np.arcsin(sin_lon))
+            j_lo, j_hi = self._lon_cell(lon0 - d_lon), self._lon_cell(lon0 + d_lon)
+            lon_runs = [(j_lo, j_hi)] if j_lo <= j_hi else [(j_lo, self.n_lon - 1), (0, j_hi)]
+
+        parts = []
+        for i in range(int(i_lo), int(i_hi) + 1):
+            for j_lo, j_hi in lon_runs:
+                a = np.searchsorted(self._keys, i * self.n_lon + j_lo, side='left')
+                b = np.searchsorted(self._keys, i * self.n_lon + j_hi, side='right')
+                parts.append(self._rows[a:b])
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.intp)
+
+class SiteDistances:
+    """
+    Khoảng cách (km) từ một vị trí người dùng tới các dòng của self.df, tính dần theo nhu cầu:
+    within(R) tính chính xác cho mọi trạm trong bán kính R (qua StationGrid), ensure(rows) cho các
+    dòng cụ thể (VD trạm trùng kênh cần ghi khoảng cách). Dòng chưa tính mang giá trị +inf
+    (chắc chắn xa hơn bán kính đã xét), dòng không có tọa độ mang NaN.
+    """
+
+    def __init__(self, lat, lon, lats, lons, has_coords, grid):
+        self.lat = lat
+        self.lon = lon
+        self._lats = np.asarray(lats, dtype=float)
+        self._lons = np.asarray(lons, dtype=float)
+        self._grid = grid
+        has_coords = np.asarray(has_coords, dtype=bool)
+        self.dist = np.full(len(self._lats), np.inf)
+        self.dist[~has_coords] = np.nan
+        self._known = ~has_coords
+        self._radius_km = -1.0
+        self._lock = threading.RLock()
+        self.ensure(np.nonzero(has_coords & ~grid.valid)[0])
+
+    def ensure(self, rows):
+        """Tính khoảng cách chính xác cho các dòng rows (bỏ qua dòng đã có)."""
+        with self._lock:
+            rows = np.asarray(rows, dtype=np.intp)
+            rows = rows[~self._known[rows]]
+            if len(rows) > 0:
+                self.dist[rows] = geodesic_km_batch(self.lat, self.lon, self._lats[rows], self._lons[rows])
+                self._known[rows] = True
+        return self.dist
+
+    def within(self, radius_km):
+        """Vector khoảng cách, bảo đảm chính xác với mọi trạm cách vị trí dưới radius_km."""
+        with self._lock:
+            if radius_km > self._radius_km:
+                self.ensure(self._grid.query(self.lat, self.lon, radius_km))
+                self._radius_km = radius_km
+        return self.dist
+
+# ====================================================================
+# LÕI ENGINE TRÊN MẢNG NUMPY (DÙNG CHUNG CHO TIẾN TRÌNH CHÍNH VÀ NHÓM TIẾN TRÌNH)
+# ====================================================================
+def note_b_mode_index(freqs, user_mode_tuple):
+    """Note b: LAN trong 418.5-419.5 / 428.5-429.5 áp chỉ tiêu WAN Duplex (chỉ số 1 của table_of), còn lại 0."""
+    freqs = np.asarray(freqs, dtype=float)
+    cand_mode = np.zeros(len(freqs), dtype=np.intp)
+    if "LAN" in user_mode_tuple[0]:
+        note_b = ((freqs >= 418.5) & (freqs <= 419.5)) | ((freqs >= 428.5) & (freqs <= 429.5))
+        cand_mode[note_b] = 1
+    return cand_mode
+
+class ScanCancelled(Exception):
+    """Lượt quét bị hủy giữa chừng qua ScanProgress.cancel()."""
+
+class ScanProgress:
+    """
+    Tiến độ và cờ hủy của một lượt quét, dùng chung giữa luồng tính toán và giao diện: engine cộng số ứng viên
+    đã đánh giá sau mỗi khối ENGINE_CHUNK_SIZE (hoặc mỗi đoạn của nhóm tiến trình) và dừng bằng ScanCancelled
+    ngay tại khối kế tiếp khi đã gọi cancel().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self.done = 0
+        self.total = 0
+
+    def expect(self, remaining):
+        """Đặt tổng = số đã xong + remaining (gọi trước mỗi giai đoạn quét, VD Tx rồi Rx của song công)."""
+        with self._lock:
+            self.total = self.done + max(int(remaining), 0)
+
+    def advance(self, n):
+        with self._lock:
+            self.done += int(n)
+            self.total = max(self.total, self.done)
+
+    def fraction(self):
+        with self._lock:
+            return self.done / self.total if self.total else 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise ScanCancelled("Đã hủy lượt quét")
+
+class StationArrays:
+    """
+    Các cột engine cần của kho trạm dưới dạng mảng numpy, xếp theo khóa kênh tăng dần (cửa sổ tần số là một
+    lát liên tục): key, row (vị trí dòng trong self.df), cờ giữ chỗ / có tọa độ, biên bảo vệ (kHz), mã loại mạng,
+    cột băng thông thu và mã GP rút gọn (-1 = không ghi vào danh sách). Chuỗi tương ứng với các mã
+    (net_values, lic_names) chỉ cần ở tiến trình chính.
+    """
+    FIELDS = ("key", "row", "holding", "coords", "guard", "net", "rx", "lic")
+
+    def __init__(self, fingerprint, arrays, net_values=(), lic_names=()):
+        self.fingerprint = fingerprint
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+        self.net_values = list(net_values)
+        self.lic_names = list(lic_names)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def window(self, lo, hi):
+        """Lát [lo, hi) (view, không sao chép): các trạm trong dải tần của một truy vấn."""
+        return StationArrays(self.fingerprint, {name: arr[lo:hi] for name, arr in self.arrays().items()},
+                             self.net_values, self.lic_names)
+
+def scan_candidates(st, rev9, band, bw, table_of, cand_keys, cand_mode, dists, want_maps=True, want_conflicts=False,
+                    progress=None):
+    """
+    Đánh giá các khóa kênh ứng viên trên StationArrays st theo từng khối ENGINE_CHUNK_SIZE: với mỗi khối dựng
+    ma trận (ứng viên x trạm lân cận) gồm Δf, nhóm Δf, khoảng cách yêu cầu rồi so với khoảng cách thực tế.
+    dists là list vector khoảng cách (km) theo thứ tự của st, mỗi vị trí người dùng một vector.
+    Trả về list (usable, maps, conflicts) theo dists: usable là mảng bool; maps[i] là dict {mã GP rút gọn:
+    k/c nhỏ nhất} của các trạm trùng kênh với ứng viên khả dụng (khi want_maps, None với ứng viên bị chặn);
+    conflicts là bộ ba mảng (chỉ số ứng viên, vị trí trạm trong st, k/c yêu cầu) của các cặp bị chặn.
+    progress (ScanProgress, tùy chọn) được cộng sau mỗi khối và kiểm tra cờ hủy trước khối kế tiếp.
+    """
+    cand_keys = np.asarray(cand_keys, dtype=np.int64)
+    cand_mode = np.asarray(cand_mode, dtype=np.intp)
+    n_cand = len(cand_keys)
+    usable = [np.zeros(n_cand, dtype=bool) for _ in dists]
+    maps = [[None] * n_cand for _ in dists]
+    pairs = [[] for _ in dists]
+
+    order = np.argsort(cand_keys, kind='stable')
+    for c0 in range(0, n_cand, ENGINE_CHUNK_SIZE):
+        if progress is not None: progress.check()
+        pos = order[c0:c0 + ENGINE_CHUNK_SIZE]
+        ck = cand_keys[pos]
+        lo = np.searchsorted(st.key, ck.min() - FREQ_WINDOW_KEYS + 1, side='left')
+        hi = np.searchsorted(st.key, ck.max() + FREQ_WINDOW_KEYS - 1, side='right')
+
+        abs_diff = np.abs(ck[:, None] - st.key[None, lo:hi])
+        in_window = abs_diff < FREQ_WINDOW_KEYS
+        delta_f = abs_diff / FREQ_KEYS_PER_KHZ
+
+        # Luồng lưu động / giữ chỗ: vi phạm biên bảo vệ
+        blocked_holding = in_window & st.holding[None, lo:hi] & (delta_f <= st.guard[None, lo:hi])
+
+        # Luồng cố định: so khoảng cách thực tế với khoảng cách yêu cầu
+        bucket = delta_f_bucket(delta_f)
+        table_idx = table_of[cand_mode[pos][:, None], st.net[None, lo:hi]]
+        req_dist = rev9.lookup(band, table_idx, bw, bucket, st.rx[None, lo:hi])
+        fixed = ~st.holding[lo:hi] & st.coords[lo:hi]
+        window_fixed = in_window & fixed[None, :]
+        holding_any = blocked_holding.any(axis=1)
+
+        exact = abs_diff == 0
+        exact_cols = {}
+        for s, dist in enumerate(dists):
+            blocked_fixed = window_fixed & (dist[None, lo:hi] < req_dist)
+            chunk_usable = ~(holding_any | blocked_fixed.any(axis=1))
+            usable[s][pos] = chunk_usable
+
+            if want_conflicts:
+                r_idx, c_idx = np.nonzero(blocked_holding | blocked_fixed)
+                pairs[s].append((pos[r_idx], c_idx + lo, req_dist[r_idx, c_idx]))
+            if not want_maps:
+                continue
+
+            # Danh sách GP dùng lại tần số: trạm trùng kênh theo thứ tự dòng gốc (trạm không tọa độ ghi 0 km)
+            map_dist = np.where(np.isnan(dist[lo:hi]), 0.0, dist[lo:hi])
+            for r in np.nonzero(chunk_usable)[0]:
+                cols = exact_cols.get(r)
+                if cols is None:
+                    cols = np.nonzero(exact[r])[0]
+                    cols = exact_cols[r] = cols[np.argsort(st.row[cols + lo], kind='stable')]
+                lic_dist_map = {}
+                for j in cols:
+                    code = int(st.lic[j + lo])
+                    if code < 0: continue
+                    d_km = map_dist[j]
+                    if code not in lic_dist_map or d_km < lic_dist_map[code]:
+                        lic_dist_map[code] = d_km
+                maps[s][pos[r]] = lic_dist_map
+        if progress is not None: progress.advance(len(pos))
+
+    conflicts = []
+    for site_pairs in pairs:
+        if site_pairs:
+            conflicts.append(tuple(np.concatenate(parts) for parts in zip(*site_pairs)))
+        else:
+            conflicts.append((np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([], dtype=float)))
+    return list(zip(usable, maps, conflicts))
+
+class ChannelVerdicts:
+    """
+    Kết quả đánh giá theo kênh vật lý trong một truy vấn (khóa kênh -> (khả dụng, map GP) của từng vị trí).
+    Song công xét cả Tx và Rx = Tx + duplex_spacing, nhiều Rx lại chính là Tx của ứng viên khác: mỗi lần evaluate
+    chỉ đánh giá (vector hóa, một lượt _eval_freqs_sites) các kênh chưa có kết quả, nên mỗi kênh chỉ tính một lần.
+    """
+
+    def __init__(self, tool, user_inputs, user_mode_tuple, band, bw, progress=None):
+        self.tool = tool
+        self.user_inputs = user_inputs
+        self.user_mode_tuple = user_mode_tuple
+        self.band = band
+        self.bw = bw
+        self.progress = progress
+        self._known = {}   # khóa kênh -> list (khả dụng, map GP) theo thứ tự user_inputs
+
+    def evaluate(self, freqs):
+        missing = OrderedDict()
+        for f, key in zip(freqs, freq_to_key(np.asarray(freqs, dtype=float)).tolist()):
+            if key not in self._known and key not in missing:
+                missing[key] = f
+        if self.progress is not None: self.progress.expect(len(missing))
+        if not missing:
+            return
+        evals = self.tool._eval_freqs_sites(self.user_inputs, list(missing.values()), self.user_mode_tuple,
+                                            self.band, self.bw, self.progress)
+        for n, key in enumerate(missing):
+            self._known[key] = [(bool(usable[n]), maps[n]) for usable, maps in evals]
+
+    def lookup(self, freqs, site=0):
+        """(usable, maps) của freqs cho vị trí thứ site, cùng dạng kết quả _eval_freqs (đánh giá kênh còn thiếu)."""
+        self.evaluate(freqs)
+        verdicts = [self._known[key][site] for key in freq_to_key(np.asarray(freqs, dtype=float)).tolist()]
+        return np.array([ok for ok, _ in verdicts], dtype=bool), [lic_map for _, lic_map in verdicts]
+
+    def pairs(self, freqs, site=0):
+        """{tần số: (khả dụng, map GP)} của freqs, dạng rx_eval của _available_columns."""
+        usable, maps = self.lookup(freqs, site)
+        return {f: (ok, lic_map) for f, ok, lic_map in zip(freqs, usable, maps)}
+
+def _release_shared_memory(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except (FileNotFoundError, BufferError):
+        pass
+
+class SharedStationArrays:
+    """
+    StationArrays công bố một lần vào multiprocessing.shared_memory (một khối cho mọi cột) để tiến trình con
+    gắn vào theo tên thay vì nhận DataFrame qua pickle. Khối được giải phóng khi đối tượng bị thu hồi
+    (VD kho trạm đổi dataset_fingerprint và công bố lại).
+    """
+
+    def __init__(self, st):
+        arrays = {name: np.ascontiguousarray(arr) for name, arr in st.arrays().items()}
+        layout, offset = [], 0
+        for name, arr in arrays.items():
+            layout.append((name, arr.dtype.str, len(arr), offset))
+            offset += arr.nbytes
+        self._shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, dtype, n, off in layout:
+            np.ndarray(n, dtype=dtype, buffer=self._shm.buf, offset=off)[:] = arrays[name]
+        self.fingerprint = st.fingerprint
+        self.spec = (self._shm.name, st.fingerprint, tuple(layout))
+        self._finalizer = weakref.finalize(self, _release_shared_memory, self._shm)
+
+# Ở tiến trình con: khối StationArrays đã gắn (tên khối -> (SharedMemory, StationArrays)), giữ 2 khối gần nhất
+_ATTACHED_STATIONS = OrderedDict()
+
+def attach_station_arrays(spec):
+    """Gắn (một lần cho mỗi tiến trình con) vào khối StationArrays do SharedStationArrays công bố."""
+    name, fingerprint, layout = spec
+    entry = _ATTACHED_STATIONS.get(name)
+    if entry is None:
+        shm = shared_memory.SharedMemory(name=name)
+        arrays = {field: np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=off) for field, dtype, n, off in layout}
+        entry = _ATTACHED_STATIONS[name] = (shm, StationArrays(fingerprint, arrays))
+        while len(_ATTACHED_STATIONS) > 2:
+            _, (old_shm, old_st) = _ATTACHED_STATIONS.popitem(last=False)
+            del old_st
+            try: old_shm.close()
+            except BufferError: pass
+    _ATTACHED_STATIONS.move_to_end(name)
+    return entry[1]
+
+def _scan_shard(station_spec, window, dist_spec, rev9, band, bw, table_of, cand_keys, cand_mode, want_maps, want_conflicts):
+    """Việc của tiến trình con: một đoạn ứng viên trên lát window của kho trạm và các vector khoảng cách dùng chung."""
+    st = attach_station_arrays(station_spec).window(*window)
+    dist_name, n_sites = dist_spec
+    shm = shared_memory.SharedMemory(name=dist_name)
+    block = None
+    try:
+        block = np.ndarray((n_sites, len(st.key)), dtype=np.float64, buffer=shm.buf)
+        return scan_candidates(st, rev9, band, bw, table_of, cand_keys, cand_mode, list(block), want_maps, want_conflicts)
+    finally:
+        del block
+        try: shm.close()
+        except BufferError: pass
+
+_SCAN_POOL = None
+_SCAN_POOL_LOCK = threading.Lock()
+
+def get_scan_pool():
+    """Nhóm tiến trình dùng chung cho việc chia dải ứng viên (tạo lần đầu cần đến; kiểu spawn, an toàn khi có nhiều luồng)."""
+    global _SCAN_POOL
+    with _SCAN_POOL_LOCK:
+        if _SCAN_POOL is None:
+            _SCAN_POOL = ProcessPoolExecutor(max_workers=SCAN_WORKERS, mp_context=get_context("spawn"))
+        return _SCAN_POOL
+
+def shutdown_scan_pool():
+    global _SCAN_POOL
+    with _SCAN_POOL_LOCK:
+        pool, _SCAN_POOL = _SCAN_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
 # ====================================================================
 # KHAI BÁO CLASS
 # ====================================================================
 class ToolAnDinhTanSo:
     def __init__(self, uploaded_files):
         importlib.reload(config)
+        self.ruleset_version = ruleset_fingerprint()
+        self.content_hash = ""
+        self.rev9 = Rev9Tables()
+        self.band_rules = {band: BandRules(band) for band in REV9_BANDS}
         self.reserved_frequencies = [] 
-        
-        def validate_raw_df(df_raw):
-            required_groups = [
-                ["Tần số phát", "Frequency", "Freq", "Tx Freq", "Tần số"],
-                ["Vị trí anten: Vĩ độ", "Vĩ độ", "Lat", "Latitude"],
-                ["Vị trí anten: Kinh độ", "Kinh độ", "Lon", "Long", "Longitude"],
-                ["Tỉnh thành", "Province", "Tỉnh"]
-            ]
-            
-            for keywords in required_groups:
-                col_found = False
-                for col in df_raw.columns:
-                    col_str = str(col).lower().strip()
-                    if any(kw.lower() in col_str for kw in keywords):
-                        col_found = True
-                        break
-                        
-                if not col_found:
-                    raise ValueError("File Excel thiếu các cột bắt buộc: Tần số phát (Frequency), Vĩ độ (Latitude), Kinh độ (Longitude), Tỉnh thành (Province). Vui lòng kiểm tra lại file đầu vào")
-
-        def read_single_file(file_source):
-            file_name = ""
-            if hasattr(file_source, 'name'):
-                file_name = file_source.name
-            elif isinstance(file_source, str):
-                file_name = file_source
-                
-            df_temp = pd.DataFrame()
-            
-            if file_name.lower().endswith('.csv'):
-                try:
-                    df_temp = pd.read_csv(file_source, encoding='utf-8-sig')
-                except:
-                    if hasattr(file_source, 'seek'): file_source.seek(0)
-                    df_temp = pd.read_csv(file_source, encoding='latin-1')
-            elif file_name.lower().endswith('.xlsx'):
-                df_temp = pd.read_excel(file_source, engine='openpyxl')
-            
-            if not df_temp.empty:
-                df_temp.columns = df_temp.columns.str.strip()
-                validate_raw_df(df_temp)
-                
-            return df_temp
+        self.reserved_index = ReservedFreqIndex()
+        self._key_sorted = np.array([], dtype=np.int64)
+        self._freq_order = np.array([], dtype=np.intp)
+        self.station_grid = StationGrid([], [], [])
+        self.dataset_fingerprint = ""
+        self._reserved_counts = None
+        # Truy vấn giữ quyền đọc; apply_delta dựng kho mới ngoài khóa rồi công bố dưới quyền ghi
+        self._state_lock = ReadWriteLock()
+        self._delta_lock = threading.Lock()
 
         self.df = pd.DataFrame()
         
         try:
+            # Cùng nội dung file + cùng bộ quy tắc: nạp lại kho trạm đã làm sạch từ đĩa, không đọc lại Excel
+            self.content_hash = hash_uploaded_files(uploaded_files)
+            if self.load_dataset_cache():
+                return
+
             if isinstance(uploaded_files, list):
                 dfs = []
                 for f in uploaded_files:
                     if hasattr(f, 'seek'): f.seek(0)
-                    df_part = read_single_file(f)
+                    df_part = read_station_file(f)
                     if not df_part.empty:
                         dfs.append(df_part)
                 if dfs:
                     self.df = pd.concat(dfs, ignore_index=True)
             else:
                 if hasattr(uploaded_files, 'seek'): uploaded_files.seek(0)
-                self.df = read_single_file(uploaded_files)
+                self.df = read_station_file(uploaded_files)
             
             if not self.df.empty:
                 self.map_columns_smart()
                 if hasattr(self, 'validate_required_columns'):
                     self.validate_required_columns()
                 self.clean_data()
+                self.save_dataset_cache()
             else:
                 raise ValueError("File Excel rỗng hoặc không đọc được dữ liệu.")
 
@@ -139,53 +1485,85 @@ class ToolAnDinhTanSo:
             logger.exception("Lỗi khởi tạo Tool")
             raise e 
 
-    def map_columns_smart(self):
-        rename_map = {}
-        cols = self.df.columns
-        
-        internal_names = {
-            "LICENSE_NO": "license", "CUSTOMER": "raw_customer",
-            "FREQUENCY": "raw_freq", "FREQ_RX": "raw_freq_rx",
-            "BANDWIDTH": "raw_bw", "LAT": "raw_lat",
-            "LON": "raw_lon", "ADDRESS": "raw_address",
-            "PROVINCE_OLD": "raw_province_col", "ANTENNA_HEIGHT": "h_anten",
-            "CONDITIONS": "raw_conditions"
+    # =========================================================================
+    # CACHE KHO TRẠM TRÊN ĐĨA
+    # =========================================================================
+    def dataset_cache_path(self):
+        return os.path.join(DATASET_CACHE_DIR, f"{self.content_hash}_{self.ruleset_version}.npz")
+
+    def save_dataset_cache(self):
+        """Ghi kho trạm đã làm sạch (dạng cột) + danh sách giữ chỗ + chỉ mục tần số ra file .npz (ghi tạm rồi đổi tên)."""
+        if not self.content_hash or self.df.empty:
+            return
+        arrays = {
+            "__columns__": np.array(list(self.df.columns), dtype=str),
+            "__reserved__": np.array(self.reserved_frequencies, dtype=float),
+            "__key_sorted__": self._key_sorted,
+            "__freq_order__": self._freq_order,
         }
+        for col in self.df.columns:
+            series = self.df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                arrays[f"cat_codes:{col}"] = series.cat.codes.to_numpy()
+                arrays[f"cat_values:{col}"] = np.array(series.cat.categories.astype(str), dtype=str)
+            else:
+                arrays[f"col:{col}"] = series.to_numpy()
+        path = self.dataset_cache_path()
+        tmp_path = None
+        try:
+            os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=DATASET_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, **arrays)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Không ghi được cache kho trạm {path}: {e}")
+            if tmp_path is not None:
+                try: os.unlink(tmp_path)
+                except OSError: pass
+            return
+        prune_dataset_cache(keep=path)
+
+    def load_dataset_cache(self):
+        """Nạp kho trạm từ cache .npz nếu có; trả về True khi thành công."""
+        path = self.dataset_cache_path()
+        if not self.content_hash or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = {}
+                for col in data["__columns__"].tolist():
+                    if f"cat_codes:{col}" in data.files:
+                        columns[col] = pd.Categorical.from_codes(data[f"cat_codes:{col}"], categories=data[f"cat_values:{col}"].astype(object))
+                    else:
+                        columns[col] = data[f"col:{col}"]
+                df = pd.DataFrame(columns)
+                reserved = data["__reserved__"].tolist()
+                key_sorted = data["__key_sorted__"]
+                freq_order = data["__freq_order__"]
+        except Exception as e:
+            logger.warning(f"Cache kho trạm {path} lỗi, đọc lại file gốc: {e}")
+            return False
+        try:
+            os.utime(path)   # mtime = lần dùng gần nhất, prune_dataset_cache xóa file lâu không dùng trước
+        except OSError:
+            pass
+
+        self.df = df
+        self.reserved_frequencies = reserved
+        self.reserved_index = ReservedFreqIndex(reserved)
+        self._key_sorted = key_sorted
+        self._freq_order = freq_order
+        self.build_spatial_index()
+        self.dataset_fingerprint = self.compute_fingerprint()
+        logger.info(f"Nạp kho trạm từ cache: {len(self.df)} dòng ({os.path.basename(path)})")
+        return True
 
-        for key, keywords in DEFAULT_COL_MAPPING.items():
-            found = False
-            for col in cols:
-                for kw in keywords:
-                    if kw.lower() == str(col).lower().strip():
-                        rename_map[col] = internal_names[key]
-                        found = True
-                        break
-                if found: break
-            
-            if not found:
-                for col in cols:
-                    col_str = str(col).lower()
-                    for kw in keywords:
-                        if kw.lower() in col_str:
-                            rename_map[col] = internal_names[key]
-                            found = True
-                            break
-                    if found: break
-        
-        self.df = self.df.rename(columns=rename_map)
+    def map_columns_smart(self):
+        self.df = self.df.rename(columns=resolve_column_mapping(self.df.columns))
 
     def validate_required_columns(self):
-        required_map = {
-            "raw_freq": "Tần số phát (Frequency)",
-            "raw_lat": "Vĩ độ (Latitude)",
-            "raw_lon": "Kinh độ (Longitude)",
-            "raw_province_col": "Tỉnh thành (Province)" 
-        }
-        
-        missing_cols = []
-        for internal_col, human_name in required_map.items():
-            if internal_col not in self.df.columns:
-                missing_cols.append(human_name)
+        missing_cols = missing_required_columns(self.df.columns)
         
         if missing_cols:
             msg = f"File Excel thiếu các cột bắt buộc: {', '.join(missing_cols)}. Vui lòng kiểm tra lại file đầu vào."
@@ -254,6 +1632,97 @@ class ToolAnDinhTanSo:
             
         return sorted(list(set(freqs)))
 
+    def parse_freq_series(self, values):
+        """
+        Phiên bản cột của parse_freq_string: mỗi ô trả về tuple tần số đã sắp xếp, không trùng.
+        Ô thường được tách token bằng .str.split + explode; ô có khoảng "a - b" dùng lại parse_freq_string.
+        Mỗi giá trị ô/token chỉ xử lý một lần (factorize).
+        """
+        codes, uniques = pd.factorize(values)
+        parsed = [()] * len(uniques)
+        if len(uniques) > 0:
+            clean = pd.Series(uniques, dtype=object).map(str).str.upper()
+            clean = clean.str.replace(',', '.', regex=False).str.replace('MHZ', '', regex=False).str.replace(';', ' ', regex=False)
+            has_range = clean.str.contains(r"\d+\.?\d*\s*-\s*\d+\.?\d*", regex=True).to_numpy(dtype=bool)
+
+            for i in np.nonzero(has_range)[0]:
+                parsed[i] = tuple(self.parse_freq_string(uniques[i]))
+
+            tokens = clean[~has_range].str.split().explode().dropna()
+            tok_codes, tok_uniques = pd.factorize(tokens)
+            tok_values = np.array([_to_float_or_nan(t) for t in tok_uniques], dtype=float)[tok_codes]
+            keep = tok_values > 10
+            cell_freqs = pd.DataFrame({'cell': tokens.index.to_numpy()[keep], 'f': tok_values[keep]})
+            cell_freqs = cell_freqs.drop_duplicates().sort_values(['cell', 'f'], kind='stable')
+            cells = cell_freqs['cell'].to_numpy()
+            if len(cells):
+                starts = np.concatenate(([0], np.flatnonzero(np.diff(cells)) + 1))
+                for cell, group in zip(cells[starts], np.split(cell_freqs['f'].to_numpy(), starts[1:])):
+                    parsed[cell] = tuple(group.tolist())
+        return [parsed[c] if c >= 0 else () for c in codes]
+
+    def convert_dms_series(self, values):
+        """
+        Phiên bản cột của convert_dms_to_decimal, trả về mảng float (NaN thay cho None).
+        Bóc tách độ/phút/giây bằng .str.extractall trên các giá trị duy nhất.
+        """
+        codes, uniques = pd.factorize(values)
+        result = np.full(len(uniques), np.nan)
+        if len(uniques) > 0:
+            s_in = pd.Series(uniques, dtype=object).map(str).str.upper().str.strip()
+            s_clean = s_in.str.replace(r"[NSEWnsew°'\"’;:_]", " ", regex=True)
+            multi_dot = (s_clean.str.count(r'\.') > 1).to_numpy(dtype=bool)
+            s_clean = pd.Series(np.where(multi_dot, s_clean.str.replace('.', ' ', regex=False),
+                                         s_clean.str.replace(',', '.', regex=False)), dtype=object)
+
+            numbers = s_clean.str.extractall(r"(\d+(?:\.\d+)?)")[0]
+            n_numbers = numbers.groupby(level=0).size().reindex(range(len(uniques)), fill_value=0).to_numpy()
+            parts = numbers.unstack()
+            parts = parts.reindex(index=range(len(uniques)), columns=range(max(3, parts.shape[1])))
+
+            def _col(k):
+                return np.array([_to_float_or_nan(t) for t in parts[k].to_numpy()], dtype=float)
+
+            dms = n_numbers >= 2
+            d, m, s = _col(0), _col(1), np.where(n_numbers > 2, _col(2), 0.0)
+            with np.errstate(invalid='ignore'):
+                decimal = d + (m / 60.0) + (s / 3600.0)
+                negative = (s_in.str.contains('S', regex=False) | s_in.str.contains('W', regex=False)).to_numpy(dtype=bool)
+                decimal = np.where(negative, -decimal, decimal)
+                result = np.where(dms & (np.abs(decimal) <= 180), decimal, np.nan)
+
+            # Ô chỉ có một số (hoặc không có): thử đọc trực tiếp như số thập phân
+            for i in np.nonzero(~dms)[0]:
+                val = _to_float_or_nan(s_in.iloc[i].replace(',', '.'))
+                if 0 < abs(val) < 180: result[i] = val
+        out = np.full(len(codes), np.nan)
+        out[codes >= 0] = result[codes[codes >= 0]]
+        return out
+
+    def parse_bandwidth_series(self, values):
+        """Phiên bản cột của parse_bandwidth."""
+        code = values.astype(object).map(str).str.upper()
+        bw = np.select(
+            [code.str.contains('16K', regex=False).to_numpy(dtype=bool),
+             (code.str.contains('11K', regex=False) | code.str.contains('8K5', regex=False)).to_numpy(dtype=bool),
+             code.str.contains('4K0', regex=False).to_numpy(dtype=bool)],
+            [25.0, 12.5, 6.25], default=12.5)
+        return np.where(values.isna().to_numpy(), 12.5, bw)
+
+    def infer_net_type_array(self, freqs):
+        """Phiên bản mảng của infer_net_type_from_freq: gán loại mạng theo bảng quy hoạch, dòng đầu tiên khớp được ưu tiên."""
+        freqs = np.asarray(freqs, dtype=float)
+        net_types = np.full(freqs.shape, "LAN", dtype=object)
+        is_vhf = (freqs >= 130) & (freqs <= 180)
+        is_uhf = ~is_vhf & (freqs >= 380) & (freqs <= 500)
+        for alloc, in_band in ((config.FREQUENCY_ALLOCATION_VHF, is_vhf), (config.FREQUENCY_ALLOCATION_UHF, is_uhf)):
+            for start, end, modes, _ in reversed(alloc):
+                if "WAN_SIMPLEX" in modes: net_type = "WAN_SIMPLEX"
+                elif "WAN_DUPLEX" in modes: net_type = "WAN_DUPLEX"
+                else: net_type = "LAN"
+                net_types[in_band & (freqs >= start) & (freqs <= end)] = net_type
+        return net_types
+
     def infer_net_type_from_freq(self, f_val):
         alloc = []
         if 130 <= f_val <= 180: alloc = config.FREQUENCY_ALLOCATION_VHF
@@ -267,77 +1736,462 @@ class ToolAnDinhTanSo:
         return "LAN" 
 
     def clean_data(self):
-        cleaned_rows = []
         self.reserved_frequencies = [] 
+        self.reserved_index = ReservedFreqIndex()
         
-        has_license_col = 'license' in self.df.columns
-        has_customer_col = 'raw_customer' in self.df.columns
-        has_freq_col = 'raw_freq' in self.df.columns
-        has_lat_col = 'raw_lat' in self.df.columns
-        has_lon_col = 'raw_lon' in self.df.columns
-        
-        if not has_freq_col:
+        if 'raw_freq' not in self.df.columns:
             logger.error("Không tìm thấy cột Tần số trong file Excel!")
             return 
 
-        for idx, row in self.df.iterrows():
-            raw_prov_extracted = ""
-            if 'raw_province_col' in self.df.columns:
-                val = str(row.get('raw_province_col', ''))
-                if val.lower() not in ['nan', '', 'none']: raw_prov_extracted = val
-            
-            if (not raw_prov_extracted) and 'raw_address' in self.df.columns:
-                parts = str(row.get('raw_address', '')).split(',')
-                raw_prov_extracted = parts[-1] if len(parts) > 0 else str(row.get('raw_address', ''))
-            
-            clean_prov = chuan_hoa_text(raw_prov_extracted)
-            
-            is_holding = any(kw in clean_prov for kw in ["LUUDONGTOANQUOC", "LUUDONGMIENBAC", "LUUDONGMIENTRUNG", "LUUDONGMIENNAM"])
-            
-            tx_freqs = self.parse_freq_string(row.get('raw_freq')) if has_freq_col else []
-            rx_freqs = self.parse_freq_string(row.get('raw_freq_rx')) if 'raw_freq_rx' in self.df.columns else []
-            
-            if is_holding:
-                for f in tx_freqs: self.reserved_frequencies.append(f)
-                for f in rx_freqs: self.reserved_frequencies.append(f)
-            
-            lat = self.convert_dms_to_decimal(row.get('raw_lat')) if has_lat_col else None
-            lon = self.convert_dms_to_decimal(row.get('raw_lon')) if has_lon_col else None
-            
-            has_coords = (lat is not None and lon is not None)
-            
-            if not has_coords and not is_holding:
-                continue
+        self.df, self.reserved_frequencies = self.clean_frame(self.df)
+        self.reserved_index = ReservedFreqIndex(self.reserved_frequencies)
+        self.build_freq_index()
+        self.build_spatial_index()
+        self.dataset_fingerprint = self.compute_fingerprint()
+        logger.info(f"Kho trạm: {len(self.df)} dòng, {self.memory_footprint()['total'] / 1e6:.1f} MB")
+
+    def clean_frame(self, raw):
+        """
+        Làm sạch DataFrame thô (đã ánh xạ cột, có cột raw_freq) thành kho trạm dạng cột.
+        Trả về (kho trạm, danh sách tần số giữ chỗ theo thứ tự dòng).
+        """
+        reserved = []
+        n_rows = len(raw)
+        
+        has_license_col = 'license' in raw.columns
+        has_customer_col = 'raw_customer' in raw.columns
+        has_lat_col = 'raw_lat' in raw.columns
+        has_lon_col = 'raw_lon' in raw.columns
+
+        def _as_str(col):
+            return raw[col].astype(object).map(str)
+
+        def _zero_fill(coord):
+            # Tọa độ trống -> 0, lưu float32 (sai số ~1m, đủ cho khoảng cách tính bằng km)
+            return np.where(np.isnan(coord) | (coord == 0), 0.0, coord).astype(np.float32)
+
+        # --- Tỉnh thành: ưu tiên cột Tỉnh, nếu trống lấy phần cuối của Địa chỉ ---
+        raw_prov = pd.Series([""] * n_rows, index=raw.index, dtype=object)
+        if 'raw_province_col' in raw.columns:
+            val = _as_str('raw_province_col')
+            raw_prov = val.where(~val.str.lower().isin(['nan', '', 'none']), "")
+        if 'raw_address' in raw.columns:
+            from_address = _as_str('raw_address').str.split(',').str[-1]
+            raw_prov = raw_prov.where(raw_prov != "", from_address)
+
+        prov_codes, prov_uniques = pd.factorize(raw_prov)
+        prov_clean = chuan_hoa_series(pd.Series(prov_uniques, dtype=object))
+        holding_uniques = prov_clean.str.contains("LUUDONGTOANQUOC|LUUDONGMIENBAC|LUUDONGMIENTRUNG|LUUDONGMIENNAM", regex=True)
+        clean_prov = prov_clean.to_numpy(dtype=object)[prov_codes]
+        is_holding = holding_uniques.to_numpy(dtype=bool)[prov_codes]
+
+        # --- Tần số phát / thu ---
+        tx_freqs = self.parse_freq_series(raw['raw_freq'])
+        rx_freqs = self.parse_freq_series(raw['raw_freq_rx']) if 'raw_freq_rx' in raw.columns else [()] * n_rows
+
+        for i in np.nonzero(is_holding)[0]:
+            reserved.extend(tx_freqs[i])
+            reserved.extend(rx_freqs[i])
+
+        # --- Tọa độ ---
+        lat = self.convert_dms_series(raw['raw_lat']) if has_lat_col else np.full(n_rows, np.nan)
+        lon = self.convert_dms_series(raw['raw_lon']) if has_lon_col else np.full(n_rows, np.nan)
+        has_coords = ~np.isnan(lat) & ~np.isnan(lon)
+
+        keep = has_coords | is_holding
+
+        bw = self.parse_bandwidth_series(raw['raw_bw']) if 'raw_bw' in raw.columns else np.full(n_rows, 12.5)
+        raw_emission = _as_str('raw_bw').str.upper() if 'raw_bw' in raw.columns else pd.Series([""] * n_rows, index=raw.index)
+
+        license_str = _as_str('license').str.strip().str.upper() if has_license_col else pd.Series([""] * n_rows, index=raw.index)
+        customer_str = _as_str('raw_customer').str.strip() if has_customer_col else pd.Series([""] * n_rows, index=raw.index)
+        customer_str = customer_str.where(~customer_str.str.lower().isin(['nan', 'none']), "")
+
+        # Mỗi dòng giấy phép -> danh sách tần số (Tx + Rx, bỏ trùng), sau đó explode thành từng dòng tần số
+        all_freqs = [list(set(tx + rx)) for tx, rx in zip(tx_freqs, rx_freqs)]
+
+        flags = np.where(is_holding, FLAG_HOLDING, 0) | np.where(has_coords, FLAG_HAS_COORDS, 0)
+
+        cleaned = pd.DataFrame({
+            "freq": all_freqs,
+            "bw_code": rx_bw_index(bw).astype(np.int8),
+            "raw_emission": raw_emission.to_numpy(dtype=object),
+            "lat": _zero_fill(lat),
+            "lon": _zero_fill(lon),
+            "flags": flags.astype(np.uint8),
+            "province": clean_prov,
+            "license": license_str.to_numpy(dtype=object),
+            "customer": customer_str.to_numpy(dtype=object),
+        })
+        cleaned = cleaned[keep].explode('freq')
+        cleaned = cleaned[cleaned['freq'].notna()].reset_index(drop=True)
+
+        if cleaned.empty:
+            return pd.DataFrame(), reserved
+        cleaned['freq'] = cleaned['freq'].astype(float)
+        cleaned.insert(cleaned.columns.get_loc('freq') + 1, 'freq_key', freq_to_key(cleaned['freq']))
+        cleaned.insert(cleaned.columns.get_loc('province') + 1, 'net_type', self.infer_net_type_array(cleaned['freq'].to_numpy()))
+        for col in STORE_CATEGORY_COLUMNS:
+            cleaned[col] = cleaned[col].astype('category')
+        return cleaned, reserved
 
-            bw = self.parse_bandwidth(row.get('raw_bw')) if 'raw_bw' in self.df.columns else 12.5
-            
-            license_str = str(row.get('license', '')).strip().upper() if has_license_col else ""
-            customer_str = str(row.get('raw_customer', '')).strip() if has_customer_col else ""
-            if customer_str.lower() in ['nan', 'none']: customer_str = ""
+    # =========================================================================
+    # CẬP NHẬT TĂNG DẦN THEO SỐ GIẤY PHÉP (DELTA)
+    # =========================================================================
+    def apply_delta(self, delta_source):
+        """
+        Áp file cập nhật (cùng định dạng file xuất, thêm cột "Thao tác": THÊM / SỬA / XÓA) vào kho trạm hiện có,
+        khóa theo số giấy phép:
+        - XÓA: bỏ mọi dòng của giấy phép; THÊM / SỬA: thay toàn bộ dòng của giấy phép bằng các dòng trong file
+          (THÊM giấy phép đã có coi như SỬA, SỬA giấy phép chưa có coi như THÊM). Không có cột Thao tác = SỬA.
+        - Dòng mới được nối vào cuối kho; chỉ các dòng của file cập nhật phải làm sạch (đọc, tách tần số, DMS...).
+        - Chỉ mục tần số / không gian được trộn (lọc + chèn searchsorted), tần số giữ chỗ cập nhật theo số đếm,
+          không dựng lại từ đầu. Kho cũ không bị sửa tại chỗ, các đối tượng mới được gán vào cuối cùng.
+        Trả về thống kê {"added", "modified", "removed", "rows"}.
+        Các lần gọi apply_delta chạy lần lượt; toàn bộ trạng thái mới được gán dưới quyền ghi của _state_lock,
+        nên truy vấn đang chạy ở luồng khác (giữ quyền đọc) chỉ thấy kho cũ hoặc kho mới trọn vẹn.
+        """
+        with self._delta_lock:
+            return self._apply_delta(delta_source)
+
+    def _apply_delta(self, delta_source):
+        if isinstance(delta_source, pd.DataFrame):
+            raw = delta_source.copy()
+            delta_hash = hashlib.sha256(pd.util.hash_pandas_object(raw.astype(str), index=False).to_numpy().tobytes()).hexdigest()
+        else:
+            delta_hash = hash_uploaded_files(delta_source)
+            raw = read_station_file(delta_source)
+        raw = raw.rename(columns=resolve_column_mapping(raw.columns))
+        if raw.empty:
+            return {"added": 0, "modified": 0, "removed": 0, "rows": len(self.df)}
+        if 'license' not in raw.columns:
+            raise ValueError("File cập nhật thiếu cột Số giấy phép (License), không xác định được giấy phép cần cập nhật.")
+
+        licenses = raw['license'].astype(object).map(str).str.strip().str.upper()
+        if 'delta_action' in raw.columns:
+            action_text = chuan_hoa_series(raw['delta_action'].astype(object).map(str))
+            actions = action_text.map(DELTA_ACTIONS)
+            bad = actions.isna()
+            if bad.any():
+                raise ValueError(f"Cột Thao tác có giá trị không hợp lệ: {', '.join(sorted(set(raw['delta_action'][bad].astype(str))))[:200]}. "
+                                 "Chỉ chấp nhận THÊM / SỬA / XÓA (ADD / MODIFY / REMOVE).")
+        else:
+            actions = pd.Series("MODIFY", index=raw.index)
+        if (licenses.isin(['', 'NAN', 'NONE'])).any():
+            raise ValueError("File cập nhật có dòng thiếu Số giấy phép.")
+
+        is_upsert = (actions != "REMOVE").to_numpy()
+        upsert_raw = raw[is_upsert]
+        if len(upsert_raw) and 'raw_freq' not in upsert_raw.columns:
+            raise ValueError("File cập nhật thiếu cột Tần số phát (Frequency) cho các dòng THÊM / SỬA.")
+        new_rows, new_reserved = self.clean_frame(upsert_raw) if len(upsert_raw) else (pd.DataFrame(), [])
+
+        # --- Dòng cũ của các giấy phép có trong file cập nhật ---
+        touched = pd.unique(licenses.to_numpy(dtype=object))
+        if self.df.empty:
+            remove_mask = np.zeros(0, dtype=bool)
+            present = set()
+        else:
+            lic_col = self.df['license']
+            codes = lic_col.cat.categories.get_indexer(touched)
+            remove_mask = np.isin(lic_col.cat.codes.to_numpy(), codes[codes >= 0])
+            present = set(lic_col.cat.categories[np.unique(lic_col.cat.codes.to_numpy()[remove_mask])])
+        keep = ~remove_mask
+        upsert_licenses = set(licenses[is_upsert])
+        stats = {
+            "added": len(upsert_licenses - present),
+            "modified": len(upsert_licenses & present),
+            "removed": len(present - upsert_licenses),
+        }
 
-            all_freqs_to_check = []
-            for f in tx_freqs: all_freqs_to_check.append(f)
-            for f in rx_freqs: all_freqs_to_check.append(f)
-            all_freqs_to_check = list(set(all_freqs_to_check))
+        # --- Tần số giữ chỗ: đếm số dòng giữ chỗ theo giá trị tần số ---
+        if getattr(self, '_reserved_counts', None) is None:
+            held = self.df['freq'].to_numpy()[self.station_flag(FLAG_HOLDING)] if not self.df.empty else []
+            self._reserved_counts = Counter(held.tolist() if len(held) else [])
+        reserved_counts = Counter(self._reserved_counts)
+        reserved = self.reserved_frequencies
+        if not self.df.empty:
+            reserved_counts.subtract(self.df['freq'].to_numpy()[remove_mask & self.station_flag(FLAG_HOLDING)].tolist())
+            dead = {f for f, c in reserved_counts.items() if c <= 0}
+            if dead:
+                reserved = [f for f in reserved if f not in dead]
+                for f in dead:
+                    del reserved_counts[f]
+        if not new_rows.empty:
+            reserved_counts.update(new_rows['freq'].to_numpy()[self.station_flag(FLAG_HOLDING, new_rows)].tolist())
+        reserved = reserved + new_reserved
+
+        # --- Kho trạm mới = dòng cũ giữ lại + dòng mới ở cuối ---
+        if self.df.empty:
+            df = new_rows.reset_index(drop=True)
+        elif new_rows.empty:
+            df = self.df[keep].reset_index(drop=True)
+        else:
+            columns = {}
+            for col in self.df.columns:
+                if col in STORE_CATEGORY_COLUMNS:
+                    columns[col] = union_categoricals([self.df[col].array[keep], new_rows[col].array])
+                else:
+                    columns[col] = np.concatenate([self.df[col].to_numpy()[keep], new_rows[col].to_numpy(dtype=self.df[col].dtype)])
+            df = pd.DataFrame(columns)
+
+        # --- Chỉ mục tần số: lọc + đánh lại số dòng cũ, chèn khóa mới ---
+        new_pos = np.cumsum(keep) - 1
+        sel = keep[self._freq_order]
+        key_sorted = self._key_sorted[sel]
+        freq_order = new_pos[self._freq_order[sel]] if len(new_pos) else self._freq_order[sel]
+        if not new_rows.empty:
+            add_keys = new_rows['freq_key'].to_numpy(dtype=np.int64)
+            order = np.argsort(add_keys, kind='stable')
+            ins = np.searchsorted(key_sorted, add_keys[order], side='right')
+            key_sorted = np.insert(key_sorted, ins, add_keys[order])
+            freq_order = np.insert(freq_order, ins, int(keep.sum()) + order)
+
+        if new_rows.empty:
+            grid = self.station_grid.updated(keep, [], [], [])
+        else:
+            grid = self.station_grid.updated(keep, new_rows['lat'], new_rows['lon'], self.station_flag(FLAG_HAS_COORDS, new_rows))
+
+        reserved_index = ReservedFreqIndex(reserved)
+        freq_order = freq_order.astype(np.intp)
+        content_hash = hashlib.sha256(f"{self.content_hash}+{delta_hash}".encode()).hexdigest()
+        dataset_fingerprint = hashlib.sha1(f"{self.dataset_fingerprint}+{delta_hash}".encode()).hexdigest()
+
+        with self._state_lock.write():
+            self.df = df
+            self.reserved_frequencies = reserved
+            self.reserved_index = reserved_index
+            self._reserved_counts = reserved_counts
+            self._key_sorted = key_sorted
+            self._freq_order = freq_order
+            self.station_grid = grid
+            self.content_hash = content_hash
+            self.dataset_fingerprint = dataset_fingerprint
+
+        stats["rows"] = len(self.df)
+        logger.info(f"Áp dữ liệu cập nhật: +{stats['added']} / ~{stats['modified']} / -{stats['removed']} giấy phép, kho còn {stats['rows']} dòng")
+        return stats
+
+    def compute_fingerprint(self):
+        """
+        Dấu vân tay của kho trạm đã làm sạch, dùng làm khóa cache kết quả: mọi cột của self.df (tần số, tọa độ, cờ,
+        phương thức phát / băng thông, loại mạng, giấy phép, khách hàng, tỉnh) và danh sách tần số giữ chỗ.
+        """
+        h = hashlib.sha1()
+        h.update(str(len(self.df)).encode())
+        for col in self.df.columns:
+            h.update(str(col).encode() + b"\0")
+            h.update(pd.util.hash_pandas_object(self.df[col], index=False).to_numpy().tobytes())
+        h.update(np.asarray(sorted(self.reserved_frequencies), dtype=float).tobytes())
+        return h.hexdigest()
+
+    def station_flag(self, flag, df=None):
+        """Mảng bool: các dòng (của df, mặc định self.df) có bật cờ flag (FLAG_HOLDING / FLAG_HAS_COORDS)."""
+        df = self.df if df is None else df
+        if 'flags' not in df.columns:
+            return np.zeros(len(df), dtype=bool)
+        return (df['flags'].to_numpy(dtype=np.uint8) & flag) != 0
+
+    def memory_footprint(self):
+        """
+        Dung lượng bộ nhớ (byte) của kho trạm: từng cột của self.df (kể cả chuỗi category),
+        các chỉ mục tần số / không gian, và tổng cộng.
+        """
+        columns = {col: int(n) for col, n in self.df.memory_usage(deep=True, index=False).items()}
+        grid = self.station_grid
+        indexes = {
+            "freq_index": int(self._key_sorted.nbytes + self._freq_order.nbytes),
+            "spatial_index": int(grid._rows.nbytes + grid._keys.nbytes + grid.valid.nbytes),
+            "reserved_index": int(self.reserved_index._sorted.nbytes),
+        }
+        return {
+            "rows": len(self.df),
+            "columns": columns,
+            "indexes": indexes,
+            "total": sum(columns.values()) + sum(indexes.values()),
+        }
 
-            for f in all_freqs_to_check:
-                net_type = self.infer_net_type_from_freq(f)
-                
-                cleaned_rows.append({
-                    "freq": f, 
-                    "bw": bw, 
-                    "raw_emission": str(row.get('raw_bw', '')).upper(),
-                    "lat": lat if lat else 0, 
-                    "lon": lon if lon else 0,
-                    "has_coords": has_coords, 
-                    "province": clean_prov, 
-                    "net_type": net_type,
-                    "is_holding": is_holding, 
-                    "license": license_str,
-                    "customer": customer_str
-                })
-                
-        self.df = pd.DataFrame(cleaned_rows)
+    def get_site_distances(self, lat, lon):
+        """
+        Khoảng cách từ vị trí người dùng tới các dòng của self.df (SiteDistances, tính dần theo bán kính).
+        Đối tượng được giữ trong SITE_DISTANCE_CACHE để dùng lại cho mọi tần số ứng viên
+        và cho các lần tính khác tại cùng vị trí (đổi dải tần, băng thông, đoạn quét...).
+        """
+        lat_r = round(float(lat), SITE_CACHE_DECIMALS)
+        lon_r = round(float(lon), SITE_CACHE_DECIMALS)
+        key = (self.dataset_fingerprint, lat_r, lon_r)
+        site = SITE_DISTANCE_CACHE.get(key)
+        if site is None:
+            site = SiteDistances(lat_r, lon_r, self.df['lat'], self.df['lon'], self.station_flag(FLAG_HAS_COORDS), self.station_grid)
+            SITE_DISTANCE_CACHE.put(key, site)
+        return site
+
+    def build_spatial_index(self):
+        """Dựng lưới không gian trên tọa độ trạm (một lần sau clean_data)."""
+        if self.df.empty:
+            self.station_grid = StationGrid([], [], [])
+            return
+        self.station_grid = StationGrid(self.df['lat'], self.df['lon'], self.station_flag(FLAG_HAS_COORDS))
+
+    def scenario_radius_km(self, band, user_mode_tuple, bw):
+        """
+        Bán kính xét nhiễu (km) của kịch bản: khoảng cách yêu cầu lớn nhất trong các bảng Rev9 có thể áp dụng
+        (kể cả bảng WAN Duplex của Note b khi người dùng là LAN). Trạm xa hơn không thể gây vướng.
+        """
+        variants = [user_mode_tuple]
+        if "LAN" in user_mode_tuple[0]:
+            variants.append(("WAN_DUPLEX", "WAN_DUPLEX"))
+        tables = [self.rev9.table_index(m, net) for m in variants for net in NET_TYPES]
+        return self.rev9.max_distance(band, tables, bw)
+
+    def build_freq_index(self):
+        """Dựng chỉ mục khóa kênh đã sắp xếp (một lần sau clean_data) để tra cửa sổ bằng searchsorted."""
+        if self.df.empty or 'freq_key' not in self.df.columns:
+            self._key_sorted = np.array([], dtype=np.int64)
+            self._freq_order = np.array([], dtype=np.intp)
+            return
+        keys = self.df['freq_key'].to_numpy(dtype=np.int64)
+        self._freq_order = np.argsort(keys, kind='stable')
+        self._key_sorted = keys[self._freq_order]
+
+    def station_arrays(self):
+        """StationArrays của kho trạm hiện tại (dựng lại khi dataset_fingerprint đổi, VD sau apply_delta)."""
+        st = getattr(self, '_station_arrays', None)
+        if st is not None and st.fingerprint == self.dataset_fingerprint:
+            return st
+
+        df = self.df.iloc[self._freq_order]
+        emission = df['raw_emission'].astype(str).str.upper()
+        net_values, net = np.unique(df['net_type'].astype(str).to_numpy(), return_inverse=True)
+
+        # Mã GP rút gọn (phần trước '/'), GP rỗng / 'nan' không ghi vào danh sách dùng lại tần số
+        lic_codes, lic_uniques = pd.factorize(df['license'].to_numpy(dtype=object))
+        shorts = []
+        for lic in lic_uniques:
+            raw_lic = str(lic).strip()
+            shorts.append(None if raw_lic.lower() in ['nan', 'none', '', 'nan/gp'] else raw_lic.split('/')[0])
+        short_codes, lic_names = pd.factorize(pd.Series(shorts, dtype=object))
+
+        arrays = {
+            "key": self._key_sorted,
+            "row": self._freq_order,
+            "holding": self.station_flag(FLAG_HOLDING, df),
+            "coords": self.station_flag(FLAG_HAS_COORDS, df),
+            "guard": np.where(emission.str.contains('50K', regex=False).to_numpy(), 43.75, 31.25),
+            "net": net.astype(np.intp),
+            "rx": df['bw_code'].to_numpy(dtype=np.intp),
+            "lic": np.append(short_codes, -1)[lic_codes].astype(np.int32),
+        }
+        st = self._station_arrays = StationArrays(self.dataset_fingerprint, arrays, net_values, lic_names)
+        return st
+
+    def state_snapshot(self):
+        """
+        Bản sao nông của Tool lấy dưới quyền đọc: cùng df, chỉ mục tần số (_key_sorted / _freq_order), station_grid,
+        reserved_index, dataset_fingerprint hiện hành. apply_delta chỉ thay tham chiếu, không sửa các đối tượng này
+        tại chỗ, nên bản sao dùng được ngoài khóa. StationArrays được dựng trước để các bản sao dùng chung.
+        """
+        with self._state_lock.read():
+            self.station_arrays()
+            return copy.copy(self)
+
+    def shared_station_arrays(self):
+        """StationArrays đã công bố vào shared memory cho nhóm tiến trình (công bố lại khi kho trạm đổi)."""
+        st = self.station_arrays()
+        shared = getattr(self, '_shared_station_arrays', None)
+        if shared is None or shared.fingerprint != st.fingerprint:
+            shared = self._shared_station_arrays = SharedStationArrays(st)
+        return shared
+
+    def table_of_modes(self, st, user_mode_tuple):
+        """Chỉ số bảng Rev9 theo (chế độ người dùng / WAN Duplex của Note b, mã loại mạng của trạm)."""
+        mode_variants = [user_mode_tuple, ("WAN_DUPLEX", "WAN_DUPLEX")]
+        return np.array([[self.rev9.table_index(m, net) for net in st.net_values] for m in mode_variants],
+                        dtype=np.intp).reshape(len(mode_variants), len(st.net_values))
+
+    def _scan(self, window, band, bw, table_of, cand_keys, cand_mode, dists, want_maps=True, want_conflicts=False,
+              progress=None):
+        """
+        scan_candidates trên lát window = (lo, hi) của station_arrays(). Khi bật SCAN_WORKERS và số ứng viên
+        đủ lớn, dải ứng viên (đã sắp theo khóa kênh) được chia thành các đoạn liên tiếp cho nhóm tiến trình;
+        kết quả từng đoạn ghép lại theo đúng vị trí ứng viên nên giống hệt khi tính tuần tự.
+        """
+        st = self.station_arrays().window(*window)
+        if SCAN_WORKERS > 1 and len(cand_keys) >= SCAN_MIN_CANDIDATES:
+            try:
+                return self._scan_parallel(window, band, bw, table_of, cand_keys, cand_mode, dists, want_maps,
+                                           want_conflicts, progress)
+            except ScanCancelled:
+                raise
+            except Exception as e:
+                logger.warning(f"Không chia được dải ứng viên cho nhóm tiến trình, tính tuần tự: {e}")
+                shutdown_scan_pool()
+        return scan_candidates(st, self.rev9, band, bw, table_of, cand_keys, cand_mode, dists, want_maps, want_conflicts,
+                               progress)
+
+    def _scan_parallel(self, window, band, bw, table_of, cand_keys, cand_mode, dists, want_maps, want_conflicts,
+                       progress=None):
+        shared = self.shared_station_arrays()
+        cand_keys = np.asarray(cand_keys, dtype=np.int64)
+        cand_mode = np.asarray(cand_mode, dtype=np.intp)
+        n_cand = len(cand_keys)
+        order = np.argsort(cand_keys, kind='stable')
+        n_shards = max(1, min(SCAN_WORKERS * SCAN_SHARDS_PER_WORKER, math.ceil(n_cand / ENGINE_CHUNK_SIZE)))
+        shards = [idx for idx in np.array_split(order, n_shards) if len(idx)]
+
+        # Vector khoảng cách của truy vấn (lát window) công bố một lần cho mọi đoạn
+        n_rows = window[1] - window[0]
+        block = shared_memory.SharedMemory(create=True, size=max(len(dists) * n_rows * 8, 1))
+        try:
+            if n_rows:
+                np.ndarray((len(dists), n_rows), dtype=np.float64, buffer=block.buf)[:] = np.vstack(dists)
+            pool = get_scan_pool()
+            futures = [pool.submit(_scan_shard, shared.spec, window, (block.name, len(dists)), self.rev9, band, bw,
+                                   table_of, cand_keys[idx], cand_mode[idx], want_maps, want_conflicts) for idx in shards]
+            # Chờ từng đoạn để cộng tiến độ; khi bị hủy thì bỏ các đoạn chưa chạy (đoạn đang chạy tự kết thúc)
+            shard_size = dict(zip(futures, map(len, shards)))
+            pending = set(futures)
+            while pending:
+                if progress is not None and progress.cancelled:
+                    for future in pending: future.cancel()
+                    progress.check()
+                done, pending = wait(pending, timeout=SCAN_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                if progress is not None:
+                    progress.advance(sum(shard_size[future] for future in done))
+            outcomes = [future.result() for future in futures]
+        finally:
+            _release_shared_memory(block)
+
+        merged = []
+        for s in range(len(dists)):
+            usable = np.zeros(n_cand, dtype=bool)
+            maps = [None] * n_cand
+            parts = []
+            for idx, outcome in zip(shards, outcomes):
+                shard_usable, shard_maps, (cand_idx, st_pos, req) = outcome[s]
+                usable[idx] = shard_usable
+                if want_maps:
+                    for i, lic_map in zip(idx, shard_maps):
+                        maps[i] = lic_map
+                parts.append((idx[cand_idx], st_pos, req))
+            merged.append((usable, maps, tuple(np.concatenate(p) for p in zip(*parts))))
+        return merged
+
+    def _key_range_slice(self, k_low, k_high):
+        """Khoảng [lo, hi) trên chỉ mục đã sắp xếp chứa các khóa kênh trong [k_low, k_high]."""
+        lo = np.searchsorted(self._key_sorted, k_low, side='left')
+        hi = np.searchsorted(self._key_sorted, k_high, side='right')
+        return lo, hi
+
+    def find_rows_near_freq(self, f_val, half_width=FREQ_WINDOW_MHZ):
+        """
+        Vị trí các dòng của self.df có |freq - f_val| < half_width (so trên khóa kênh), giữ nguyên thứ tự gốc.
+        Chi phí O(log N + k) thay vì quét toàn bộ cột tần số.
+        """
+        key = int(freq_to_key(f_val))
+        width = int(freq_to_key(half_width))
+        lo, hi = self._key_range_slice(key - width + 1, key + width - 1)
+        return np.sort(self._freq_order[lo:hi])
 
     def xac_dinh_kich_ban_user(self, user_input):
         mode = user_input.get('usage_mode', 'LAN')
@@ -357,52 +2211,53 @@ class ToolAnDinhTanSo:
             else: return ("LAN", "LAN_BIG_CITY_LOW")
         else: return ("LAN", "LAN_PROVINCE")
 
+    def query_cache_key(self, kind, user_input, extra=()):
+        """
+        Khóa cache kết quả: dữ liệu (fingerprint), bộ quy tắc, lat/lon làm tròn QUERY_CACHE_DECIMALS, chế độ,
+        băng, băng thông, đoạn quét, song công, và lớp tỉnh / độ cao anten - chỉ giữ phần đầu vào thực sự
+        ảnh hưởng kết quả (kịch bản Rev9 và nhóm tỉnh LAN), nên tỉnh khác tên nhưng cùng lớp dùng chung kết quả.
+        """
+        return (
+            kind, self.dataset_fingerprint, self.ruleset_version,
+            round(float(user_input['lat']), QUERY_CACHE_DECIMALS), round(float(user_input['lon']), QUERY_CACHE_DECIMALS),
+        ) + self.scenario_key(user_input) + tuple(extra)
+
+    def scenario_key(self, user_input):
+        """Phần đầu vào không phụ thuộc vị trí: các truy vấn cùng scenario_key có cùng lưới ứng viên và bảng Rev9."""
+        user_mode_tuple = self.xac_dinh_kich_ban_user(user_input)
+        prov_clean = chuan_hoa_text(str(user_input.get('province_code', '')))
+        province_class = (prov_clean in LAN_GROUP_1_PROVINCES, prov_clean in LAN_GROUP_2_PROVINCES)
+        is_duplex = bool(user_input.get('is_duplex', False))
+        return (
+            user_input.get('usage_mode'), user_input.get('band'), float(user_input.get('bw', 0)),
+            float(user_input.get('scan_start', 0) or 0), float(user_input.get('scan_end', 0) or 0),
+            user_mode_tuple, province_class,
+            is_duplex, float(user_input.get('duplex_spacing', 0) or 0) if is_duplex else 0.0,
+        )
+
+    def _cached_query(self, kind, user_input, extra, compute):
+        key = self.query_cache_key(kind, user_input, extra)
+        result = QUERY_RESULT_CACHE.get(key)
+        if result is None:
+            result = compute()
+            QUERY_RESULT_CACHE.put(key, result)
+        return copy_query_result(result)
+
     def get_required_distance(self, band, user_mode_tuple, db_net_type, tx_bw, delta_f, rx_bw):
-        user_main_mode, user_scenario_key = user_mode_tuple
-        matrix = None
-        table_key = None
-        
-        is_intra_lan = ("LAN" in user_main_mode and "LAN" in db_net_type)
-        is_intra_wan = ("WAN" in user_main_mode and "WAN" in db_net_type)
-        
-        if is_intra_lan or is_intra_wan:
-            matrix = config.MATRIX_VHF if band == 'VHF' else config.MATRIX_UHF
-            table_key = user_scenario_key
-            if is_intra_wan:
-                table_key = user_main_mode 
-        else:
-            matrix = config.MATRIX_CROSS
-            if "LAN" in user_main_mode and "WAN_SIMPLEX" in db_net_type: table_key = "LAN_VS_WAN_SIMPLEX"
-            elif "LAN" in user_main_mode and "WAN_DUPLEX" in db_net_type: table_key = "LAN_VS_WAN_DUPLEX"
-            elif "WAN_SIMPLEX" in user_main_mode and "LAN" in db_net_type: table_key = "WAN_SIMPLEX_VS_LAN"
-            elif "WAN_DUPLEX" in user_main_mode and "LAN" in db_net_type: table_key = "WAN_DUPLEX_VS_LAN"
-            else: return 0.0
-
-        if not matrix: return 0.0
-        table_tx = matrix.get(table_key, {}).get(tx_bw)
-        if not table_tx: table_tx = matrix.get(table_key, {}).get(12.5, {})
-
-        val = abs(delta_f)
-        if val < 3: key_d = 0          
-        elif val < 9: key_d = 6.25     
-        elif val < 15: key_d = 12.5    
-        elif val < 21: key_d = 18.75
-        elif val < 30: key_d = 25.0
-        else: return 0.0 
-
-        row_delta = table_tx.get(key_d, None)
-        if row_delta is None: return 0.0
-
-        if rx_bw <= 9: key_rx = 6.25
-        elif rx_bw <= 18: key_rx = 12.5
-        else: key_rx = 25.0
-        
-        return row_delta.get(key_rx, 0.0)
+        table_idx = self.rev9.table_index(user_mode_tuple, db_net_type)
+        return float(self.rev9.lookup(band, table_idx, tx_bw, delta_f_bucket(delta_f), rx_bw_index(rx_bw)))
 
     # =========================================================================
     # HÀM 1: KIỂM TRA TẦN SỐ CỤ THỂ 
     # =========================================================================
     def kiem_tra_tan_so_cu_the(self, user_input, f_check):
+        with self._state_lock.read():
+            if self.df.empty or 'freq' not in self.df.columns:
+                return self._kiem_tra_tan_so_cu_the(user_input, f_check)
+            return self._cached_query("kiem_tra", user_input, (float(f_check),),
+                                      lambda: self._kiem_tra_tan_so_cu_the(user_input, f_check))
+
+    def _kiem_tra_tan_so_cu_the(self, user_input, f_check):
         if self.df.empty: 
             return {"status": "ERROR", "msg": "Chưa có dữ liệu Excel hoặc dữ liệu rỗng (Không tìm thấy cột Tần số/Tọa độ)."}
         if 'freq' not in self.df.columns:
@@ -414,52 +2269,41 @@ class ToolAnDinhTanSo:
         user_mode_tuple = self.xac_dinh_kich_ban_user(user_input)
         band = user_input['band']
         bw = user_input['bw']
+        site_dist = self.get_site_distances(user_input['lat'], user_input['lon']).within(
+            self.scenario_radius_km(band, user_mode_tuple, bw))
 
         def _check_one_freq(f_val):
             f_val_rounded = round(f_val, 5)
             
-            allocations = config.FREQUENCY_ALLOCATION_VHF if band == 'VHF' else config.FREQUENCY_ALLOCATION_UHF
-            is_allocated_mode = False
-            found_band = False
-            allowed_for_freq = []
-            
-            for start_f, end_f, modes_alloc, _ in allocations:
-                if start_f <= f_val_rounded <= end_f:
-                    found_band = True
-                    allowed_for_freq = modes_alloc
-                    if user_input['usage_mode'] in modes_alloc:
-                        is_allocated_mode = True
-                    break
+            rules = self.get_band_rules(band)
+            alloc_row = rules.allocation_rows(f_val_rounded)[0]
                     
-            if not found_band:
+            if alloc_row < 0:
                  return "FAIL", f"Tần số {f_val_rounded:.5f} nằm ngoài dải phân bổ VHF/UHF hỗ trợ.", []
-            if not is_allocated_mode:
+            allowed_for_freq = rules.allocations[alloc_row][2]
+            if user_input['usage_mode'] not in allowed_for_freq:
                 return "FAIL", f"Tần số được quy hoạch cho {allowed_for_freq}, KHÔNG cấp cho {user_input['usage_mode']}.", []
 
+            # Dải cấm (kể cả biên ±25kHz), kênh dùng chung, giữ chỗ theo config
             is_forbidden, reason = self.check_forbidden_status(f_val_rounded, band)
             if is_forbidden:
                  return "FAIL", f"Tần số không khả dụng: {reason}", []
 
-            is_forbidden = any((r_s - 0.025) <= f_val_rounded <= (r_e + 0.025) for r_s, r_e in getattr(config, 'FORBIDDEN_BANDS', []))
-            if is_forbidden:
-                return "FAIL", "Tần số nằm trong dải tần CẤM (bao gồm biên bảo vệ ±25kHz).", []
-
-            is_shared = any(abs(f_val_rounded - f_shared) < 0.0001 for f_shared in getattr(config, 'SHARED_FREQUENCIES', []))
-            if is_shared:
-                return "FAIL", "Tần số thuộc kênh DÙNG CHUNG.", []
-
-            for res_f in getattr(self, 'reserved_frequencies', []):
-                if abs(f_val_rounded - res_f) < 0.001:
-                    return "FAIL", f"Vướng tần số giữ chỗ/Lưu động toàn quốc (Tần số: {res_f}).", []
+            res_f = self.reserved_index.find(f_val_rounded)
+            if res_f is not None:
+                return "FAIL", f"Vướng tần số giữ chỗ/Lưu động toàn quốc (Tần số: {res_f}).", []
 
             conflicts = []
-            df_subset = self.df[np.abs(self.df['freq'] - f_val_rounded) < 0.035]
+            f_key = int(freq_to_key(f_val_rounded))
+            rows_pos = self.find_rows_near_freq(f_val_rounded)
+            df_subset = self.df.iloc[rows_pos]
             
-            for _, row in df_subset.iterrows():
-                delta_f = abs(f_val_rounded - row['freq']) * 1000 
+            subset_dist = site_dist[rows_pos]
+            for (_, row), dist_km in zip(df_subset.iterrows(), subset_dist):
+                delta_f = abs(f_key - row['freq_key']) / FREQ_KEYS_PER_KHZ 
                 
                 # LUỒNG 1: GIẤY PHÉP LƯU ĐỘNG / GIỮ CHỖ
-                if row.get('is_holding', False):
+                if row['flags'] & FLAG_HOLDING:
                     emission = str(row.get('raw_emission', '')).upper()
                     if '50K' in emission:
                         guard_band = 43.75
@@ -481,15 +2325,13 @@ class ToolAnDinhTanSo:
                     continue 
 
                 # LUỒNG 2: GIẤY PHÉP CỐ ĐỊNH
-                if not row.get('has_coords', False): 
+                if not row['flags'] & FLAG_HAS_COORDS: 
                     continue 
                     
-                try:
-                    dist_km = geodesic((user_input['lat'], user_input['lon']), (row['lat'], row['lon'])).km
-                except: 
+                if np.isnan(dist_km):
                     continue
                 
-                rx_bw = row['bw']
+                rx_bw = REV9_RX_BW[row['bw_code']]
                 db_net_type = row['net_type'] 
                 
                 actual_user_mode = user_mode_tuple
@@ -541,54 +2383,24 @@ class ToolAnDinhTanSo:
             st, msg, conf = _check_one_freq(f_check)
             return {"status": st, "msg": msg, "conflicts": conf}
 
-    def check_forbidden_status(self, freq, band):
-        suffix = "VHF" if band == "VHF" else "UHF"
-        forbidden_candidates = []
-        
-        new_list = getattr(config, f'FORBIDDEN_LIST_{suffix}', [])
-        if isinstance(new_list, list):
-            forbidden_candidates.extend(new_list)
-        
-        old_list = getattr(config, 'FORBIDDEN_BANDS', [])
-        if isinstance(old_list, list):
-            forbidden_candidates.extend(old_list)
-
-        for item in forbidden_candidates:
-            if len(item) >= 2:
-                start = item[0]
-                end = item[1]
-                if (start - 0.025) <= freq <= (end + 0.025):
-                    reason = item[2] if len(item) > 2 else "Dải tần sô cấm"
-                    return True, f"Biên bảo vệ ±25kHz của {reason}"
+    def get_band_rules(self, band):
+        return self.band_rules["VHF" if band == "VHF" else "UHF"]
 
-        common_candidates = []
-        new_common = getattr(config, f'COMMON_LIST_{suffix}', [])
-        if isinstance(new_common, list): common_candidates.extend(new_common)
-            
-        old_common = getattr(config, 'SHARED_FREQUENCIES', [])
-        if isinstance(old_common, list): common_candidates.extend(old_common)
-
-        for item in common_candidates:
-            if isinstance(item, (int, float)):
-                if abs(freq - item) < 0.001: return True, "TẦN SỐ DÙNG CHUNG"
-            elif len(item) >= 2: 
-                if isinstance(item[0], (int, float)) and isinstance(item[1], str):
-                    if abs(freq - item[0]) < 0.001: return True, f"DÙNG CHUNG: {item[1]}"
-                elif len(item) >= 3:
-                     if item[0] <= freq <= item[1]: return True, f"DÙNG CHUNG: {item[2]}"
-
-        reserved_list = getattr(config, f'RESERVED_LIST_{suffix}', [])
-        if isinstance(reserved_list, list):
-            for item in reserved_list:
-                 if len(item) >= 3:
-                     if item[0] <= freq <= item[1]: return True, f"GIỮ CHỖ: {item[2]}"
-                
-        return False, ""
+    def check_forbidden_status(self, freq, band):
+        blocked, reasons = self.get_band_rules(band).classify(freq)
+        return bool(blocked[0]), reasons[0]
 
     # =========================================================================
     # HÀM 2: TÌM CÁC TẦN SỐ KHÔNG KHẢ DỤNG 
     # =========================================================================
-    def tim_cac_tan_so_khong_kha_dung(self, user_input):
+    def tim_cac_tan_so_khong_kha_dung(self, user_input, progress=None):
+        with self._state_lock.read():
+            if self.df.empty: return []
+            if 'freq' not in self.df.columns: return []
+            return self._cached_query("khong_kha_dung", user_input, (),
+                                      lambda: self._tim_cac_tan_so_khong_kha_dung(user_input, progress))
+
+    def _tim_cac_tan_so_khong_kha_dung(self, user_input, progress=None):
         if self.df.empty: return []
         if 'freq' not in self.df.columns: return []
 
@@ -606,85 +2418,83 @@ class ToolAnDinhTanSo:
         user_province_clean = chuan_hoa_text(raw_input_prov)
         
         candidates = self.generate_candidates(band, bw, mode, user_province_clean, scan_start, scan_end)
-        bad_results = []
-        
-        def _get_bad_for_freq(f_val):
-            local_bads = []
-            f_val_rounded = round(f_val, 5)
-            df_subset = self.df[np.abs(self.df['freq'] - f_val_rounded) < 0.035]
-            
-            for _, row in df_subset.iterrows():
-                delta_f = abs(f_val_rounded - row['freq']) * 1000 
-                
-                # 1. LUỒNG LƯU ĐỘNG / GIỮ CHỖ
-                if row.get('is_holding', False):
-                    emission = str(row.get('raw_emission', '')).upper()
-                    if '50K' in emission:
-                        guard_band = 43.75
-                    elif '16K' in emission:
-                        guard_band = 31.25
-                    else:
-                        guard_band = 31.25
-                        
-                    if delta_f <= guard_band:
-                        local_bads.append({
-                            "Tần số (MHz)": f"{f_val_rounded:.5f}",
-                            "Số GP bị nhiễu": row['license'],
-                            "Tên Khách Hàng": row.get('customer', ''), 
-                            "Tần số trạm bị nhiễu (MHz)": f"{row['freq']:.5f}",
-                            "Loại nhiễu": f"Vi phạm biên bảo vệ (±{guard_band} kHz)",
-                            "Khoảng cách thực tế (km)": 0.0,
-                            "Khoảng cách yêu cầu (km)": 0.0,
-                            "Địa chỉ trạm bị nhiễu": row.get('province', '') + " (Lưu động/Giữ chỗ)"
-                        })
-                    continue 
-
-                # 2. LUỒNG CỐ ĐỊNH
-                if not row.get('has_coords', False): 
-                    continue 
-                try:
-                    dist_km = geodesic((user_input['lat'], user_input['lon']), (row['lat'], row['lon'])).km
-                except: 
-                    continue
-                
-                rx_bw = row['bw']
-                db_net_type = row['net_type'] 
-                
-                actual_user_mode = user_mode_tuple
-                if "LAN" in user_mode_tuple[0]:
-                    if (418.5 <= f_val_rounded <= 419.5) or (428.5 <= f_val_rounded <= 429.5):
-                        actual_user_mode = ("WAN_DUPLEX", "WAN_DUPLEX")
-                
-                req_dist = self.get_required_distance(band, actual_user_mode, db_net_type, bw, delta_f, rx_bw)
-                
-                if dist_km < req_dist:
-                    if delta_f < 3: int_type = "Đồng kênh"
-                    elif delta_f < 9: int_type = "Kênh kề 6.25kHz"
-                    elif delta_f < 15: int_type = "Kênh kề 12.5kHz"
-                    elif delta_f < 21: int_type = "Kênh kề 18.75kHz"
-                    elif delta_f < 30: int_type = "Kênh kề 25kHz"
-                    else: int_type = f"Lệch {delta_f:.2f} kHz"
-                    
-                    local_bads.append({
-                        "Tần số (MHz)": f"{f_val_rounded:.5f}",
-                        "Số GP bị nhiễu": row['license'],
-                        "Tên Khách Hàng": row.get('customer', ''), 
-                        "Tần số trạm bị nhiễu (MHz)": f"{row['freq']:.5f}",
-                        "Loại nhiễu": int_type,
-                        "Khoảng cách thực tế (km)": round(dist_km, 2),
-                        "Khoảng cách yêu cầu (km)": req_dist,
-                        "Địa chỉ trạm bị nhiễu": row.get('province', '')
-                    })
-            return local_bads
+        if not candidates: return []
 
+        # Các tần số cần xét theo thứ tự: từng ứng viên (song công: Tx rồi Rx)
+        check_freqs = []
         for f_check in candidates:
             if is_duplex:
                 f_tx = round(f_check, 5)
-                f_rx = round(f_tx + duplex_spacing, 5)
-                bad_results.extend(_get_bad_for_freq(f_tx))
-                bad_results.extend(_get_bad_for_freq(f_rx))
+                check_freqs.extend([f_tx, round(f_tx + duplex_spacing, 5)])
             else:
-                bad_results.extend(_get_bad_for_freq(f_check))
+                check_freqs.append(round(f_check, 5))
+        freqs = np.array(check_freqs, dtype=float)
+        cand_keys = freq_to_key(freqs)
+
+        # Mỗi kênh vật lý chỉ quét một lần (Rx của ứng viên này thường là Tx của ứng viên khác). Lần gặp lại của
+        # cùng kênh đều bị bước lọc trùng (tần số, GP) cuối hàm loại bỏ, nên giữ kênh theo thứ tự gặp đầu tiên
+        first_pos = np.sort(np.unique(cand_keys, return_index=True)[1])
+        freqs, cand_keys = freqs[first_pos], cand_keys[first_pos]
+
+        window = self._key_range_slice(cand_keys.min() - FREQ_WINDOW_KEYS + 1, cand_keys.max() + FREQ_WINDOW_KEYS - 1)
+        st = self.station_arrays().window(*window)
+        site_dist = self.get_site_distances(user_input['lat'], user_input['lon']).within(
+            self.scenario_radius_km(band, user_mode_tuple, bw))[st.row]
+
+        if progress is not None: progress.expect(len(cand_keys))
+        _, _, (cand_idx, st_pos, req_dist) = self._scan(
+            window, band, bw, self.table_of_modes(st, user_mode_tuple), cand_keys,
+            note_b_mode_index(freqs, user_mode_tuple), [site_dist], want_maps=False, want_conflicts=True,
+            progress=progress)[0]
+
+        # Trong mỗi tần số xét, trạm bị nhiễu theo thứ tự dòng gốc của self.df
+        rows = st.row[st_pos]
+        order = np.lexsort((rows, cand_idx))
+        cand_idx, st_pos, req_dist, rows = cand_idx[order], st_pos[order], req_dist[order], rows[order]
+
+        df_bad = self.df.iloc[rows]
+        licenses = df_bad['license'].to_numpy(dtype=object)
+        customers = df_bad['customer'].to_numpy(dtype=object) if 'customer' in df_bad.columns else [''] * len(rows)
+        provinces = df_bad['province'].to_numpy(dtype=object) if 'province' in df_bad.columns else [''] * len(rows)
+        station_freqs = df_bad['freq'].to_numpy(dtype=float)
+        delta_fs = np.abs(cand_keys[cand_idx] - st.key[st_pos]) / FREQ_KEYS_PER_KHZ
+
+        bad_results = []
+        for i in range(len(rows)):
+            j = st_pos[i]
+            entry = {
+                "Tần số (MHz)": f"{freqs[cand_idx[i]]:.5f}",
+                "Số GP bị nhiễu": licenses[i],
+                "Tên Khách Hàng": customers[i],
+                "Tần số trạm bị nhiễu (MHz)": f"{station_freqs[i]:.5f}",
+            }
+            # 1. LUỒNG LƯU ĐỘNG / GIỮ CHỖ: vi phạm biên bảo vệ
+            if st.holding[j]:
+                entry.update({
+                    "Loại nhiễu": f"Vi phạm biên bảo vệ (±{float(st.guard[j])} kHz)",
+                    "Khoảng cách thực tế (km)": 0.0,
+                    "Khoảng cách yêu cầu (km)": 0.0,
+                    "Địa chỉ trạm bị nhiễu": provinces[i] + " (Lưu động/Giữ chỗ)"
+                })
+                bad_results.append(entry)
+                continue
+
+            # 2. LUỒNG CỐ ĐỊNH: khoảng cách thực tế nhỏ hơn khoảng cách yêu cầu
+            delta_f = float(delta_fs[i])
+            if delta_f < 3: int_type = "Đồng kênh"
+            elif delta_f < 9: int_type = "Kênh kề 6.25kHz"
+            elif delta_f < 15: int_type = "Kênh kề 12.5kHz"
+            elif delta_f < 21: int_type = "Kênh kề 18.75kHz"
+            elif delta_f < 30: int_type = "Kênh kề 25kHz"
+            else: int_type = f"Lệch {delta_f:.2f} kHz"
+
+            entry.update({
+                "Loại nhiễu": int_type,
+                "Khoảng cách thực tế (km)": round(site_dist[j], 2),
+                "Khoảng cách yêu cầu (km)": float(req_dist[i]),
+                "Địa chỉ trạm bị nhiễu": provinces[i]
+            })
+            bad_results.append(entry)
 
         unique_bads = []
         seen = set()
@@ -706,12 +2516,13 @@ class ToolAnDinhTanSo:
     # HÀM TẠO DANH SÁCH TẦN SỐ (CHỈ CĂN CHỈNH LƯỚI CHO TRUNKING 410-415)
     # =========================================================================
     def generate_candidates(self, band, bw, usage_mode, user_province_clean, scan_start=0, scan_end=0):
-        candidates = []
-        allocations = config.FREQUENCY_ALLOCATION_VHF if band == 'VHF' else config.FREQUENCY_ALLOCATION_UHF
+        grids = []
+        rules = self.get_band_rules(band)
+        allocations = rules.allocations
         step_mhz = bw / 1000.0 
         
-        allowed_group_1 = ['HOCHIMINH', 'DANANG', 'TPHOCHIMINH', 'HCM', 'DN']
-        allowed_group_2 = ['HOCHIMINH', 'TPHOCHIMINH', 'HCM']
+        allowed_group_1 = LAN_GROUP_1_PROVINCES
+        allowed_group_2 = LAN_GROUP_2_PROVINCES
 
         for start_f, end_f, modes, _ in allocations:
             if (end_f < scan_start) or (start_f > scan_end and scan_end != 0):
@@ -751,47 +2562,104 @@ class ToolAnDinhTanSo:
                     else:
                         loop_end = end_f
                 
-                curr = loop_start
-                while curr <= loop_end + 0.00001:
-                    curr_rounded = round(curr, 5) 
-                    
-                    is_forbidden, reason = self.check_forbidden_status(curr_rounded, band)
-                    
-                    is_reserved_excel = False
-                    for res_f in self.reserved_frequencies:
-                         if abs(curr_rounded - res_f) < 0.001:
-                             is_reserved_excel = True
-                             break
-                    
-                    skip_by_note_b = False
-                    if usage_mode == 'LAN':
-                        in_group_1 = (418.5 <= curr_rounded <= 419.5) or (428.5 <= curr_rounded <= 429.5)
-                        if in_group_1 and (user_province_clean not in allowed_group_1):
-                            skip_by_note_b = True
-                        in_group_2 = (440.5 <= curr_rounded <= 441.0) or (445.5 <= curr_rounded <= 446.0)
-                        if in_group_2 and (user_province_clean not in allowed_group_2):
-                            skip_by_note_b = True
-
-                    if not is_forbidden and not skip_by_note_b and not is_reserved_excel:
-                        candidates.append(curr_rounded)
-                    curr += current_step_mhz
-        
-        candidates = sorted(list(set(candidates)))
-        if len(candidates) > MAX_CANDIDATES:
-            candidates = candidates[:MAX_CANDIDATES]
+                # Lưới kênh tính bằng số nguyên (đơn vị 10Hz) thay cho cộng dồn số thực
+                key_start = round(loop_start * FREQ_KEYS_PER_MHZ)
+                key_end = round(loop_end * FREQ_KEYS_PER_MHZ) + 1   # dung sai +0.00001 MHz như bản cũ
+                key_step = round(current_step_mhz * FREQ_KEYS_PER_MHZ)
+                grids.append(np.arange(key_start, key_end + 1, key_step, dtype=np.int64))
+
+        if not grids:
+            return []
+        keys = np.concatenate(grids)
+        freqs = keys / FREQ_KEYS_PER_MHZ
+
+        keep = np.ones(len(keys), dtype=bool)
+        if usage_mode == 'LAN':
+            in_group_1 = ((418.5 <= freqs) & (freqs <= 419.5)) | ((428.5 <= freqs) & (freqs <= 429.5))
+            if user_province_clean not in allowed_group_1:
+                keep &= ~in_group_1
+            in_group_2 = ((440.5 <= freqs) & (freqs <= 441.0)) | ((445.5 <= freqs) & (freqs <= 446.0))
+            if user_province_clean not in allowed_group_2:
+                keep &= ~in_group_2
+
+        # Loại dải cấm / dùng chung / giữ chỗ (config và giữ chỗ từ Excel) cho cả lưới
+        is_forbidden, _ = rules.classify(freqs)
+        keep &= ~is_forbidden
+        keep &= ~self.reserved_index.contains(freqs)
+
+        keys = np.unique(keys[keep])[:MAX_CANDIDATES]
+        candidates = (keys / FREQ_KEYS_PER_MHZ).tolist()
         return candidates
 
+    # =========================================================================
+    # ENGINE VECTOR HÓA: ĐÁNH GIÁ HÀNG LOẠT TẦN SỐ ỨNG VIÊN
+    # =========================================================================
+    def _eval_freqs(self, user_input, freqs, user_mode_tuple, band, bw, progress=None):
+        """
+        Đánh giá cùng lúc một mảng tần số ứng viên thay cho vòng lặp iterrows.
+        Với mỗi khối ứng viên, dựng ma trận (ứng viên x trạm lân cận) gồm Δf, nhóm Δf,
+        khoảng cách yêu cầu và khoảng cách thực tế rồi rút gọn theo hàng.
+        Trả về (usable, maps): usable là mảng bool, maps[i] là dict {GP rút gọn: k/c nhỏ nhất}
+        cho các tần số khả dụng (None với tần số bị chặn).
+        """
+        return self._eval_freqs_sites([user_input], freqs, user_mode_tuple, band, bw, progress)[0]
+
+    def _eval_freqs_sites(self, user_inputs, freqs, user_mode_tuple, band, bw, progress=None):
+        """
+        Như _eval_freqs cho nhiều vị trí cùng kịch bản: ma trận Δf, nhóm Δf, khoảng cách yêu cầu và luồng
+        giữ chỗ dựng một lần cho mỗi khối ứng viên; chỉ phép so với khoảng cách thực tế làm riêng từng vị trí.
+        Trả về list (usable, maps) theo thứ tự user_inputs.
+        """
+        freqs = np.array([round(float(f), 5) for f in freqs], dtype=float)
+        if len(freqs) == 0:
+            return [(np.zeros(0, dtype=bool), []) for _ in user_inputs]
+
+        # --- 1. Lát các trạm trong phạm vi tần số của toàn bộ ứng viên (chỉ mục đã sắp xếp) ---
+        cand_keys = freq_to_key(freqs)
+        window = self._key_range_slice(cand_keys.min() - FREQ_WINDOW_KEYS + 1, cand_keys.max() + FREQ_WINDOW_KEYS - 1)
+        st = self.station_arrays().window(*window)
+
+        # --- 2. Chỉ số bảng Rev9 theo (chế độ người dùng, loại mạng của trạm) ---
+        table_of = self.table_of_modes(st, user_mode_tuple)
+
+        # Khoảng cách thực tế (đã cache theo vị trí): chính xác cho trạm trong bán kính xét nhiễu của kịch bản
+        # và cho trạm trùng kênh với ứng viên (cần ghi vào danh sách GP dùng lại tần số)
+        radius_km = self.rev9.max_distance(band, table_of, bw) if table_of.size else 0.0
+        exact_rows = st.row[np.isin(st.key, cand_keys)]
+        st_dists = []
+        for user_input in user_inputs:
+            site = self.get_site_distances(user_input['lat'], user_input['lon'])
+            site.within(radius_km)
+            st_dists.append(site.ensure(exact_rows)[st.row])
+
+        # --- 3. Đánh giá (tuần tự hoặc chia đoạn cho nhóm tiến trình), đổi mã GP về chuỗi ---
+        outcomes = self._scan(window, band, bw, table_of, cand_keys, note_b_mode_index(freqs, user_mode_tuple), st_dists,
+                              progress=progress)
+        names = st.lic_names
+        return [
+            (usable, [None if m is None else {names[code]: d_km for code, d_km in m.items()} for m in maps])
+            for usable, maps, _ in outcomes
+        ]
+
     # =========================================================================
     # HÀM 3: TÍNH TOÁN QUÉT TẦN SỐ
     # =========================================================================
-    def tinh_toan(self, user_input):
-        if self.df.empty: return []
-        if 'freq' not in self.df.columns: return []
+    def tinh_toan(self, user_input, progress=None):
+        """
+        Trả về AvailableFrequencies (dạng cột, chuỗi hiển thị dựng khi đọc từng dòng).
+        progress: ScanProgress tùy chọn (tiến độ theo số ứng viên đã đánh giá, hủy giữa chừng bằng ScanCancelled).
+        """
+        with self._state_lock.read():
+            if self.df.empty: return AvailableFrequencies.empty()
+            if 'freq' not in self.df.columns: return AvailableFrequencies.empty()
+            return self._cached_query("tinh_toan", user_input, (), lambda: self._tinh_toan(user_input, progress))
+
+    def _tinh_toan(self, user_input, progress=None):
+        if self.df.empty: return AvailableFrequencies.empty()
+        if 'freq' not in self.df.columns: return AvailableFrequencies.empty()
 
         is_duplex = user_input.get('is_duplex', False)
         duplex_spacing = user_input.get('duplex_spacing', 0)
-
-        results = []
         
         user_mode_tuple = self.xac_dinh_kich_ban_user(user_input)
         band = user_input['band']
@@ -804,150 +2672,256 @@ class ToolAnDinhTanSo:
         user_province_clean = chuan_hoa_text(raw_input_prov)
         
         candidates = self.generate_candidates(band, bw, mode, user_province_clean, scan_start, scan_end)
-        if not candidates: return []
+        if not candidates: return AvailableFrequencies.empty(is_duplex)
+
+        # Đánh giá vector hóa toàn bộ Tx, sau đó chỉ đánh giá Rx của các Tx khả dụng; Rx trùng một kênh Tx
+        # đã đánh giá (thường gặp khi duplex_spacing là bội của bước lưới) dùng lại kết quả theo kênh
+        cand_rounded = [round(f, 5) for f in candidates]
+        verdicts = ChannelVerdicts(self, [user_input], user_mode_tuple, band, bw, progress)
+        tx_usable_arr, tx_maps = verdicts.lookup(cand_rounded)
+        rx_eval = {}
+        if is_duplex:
+            rx_eval = verdicts.pairs([round(f + duplex_spacing, 5) for f, ok in zip(cand_rounded, tx_usable_arr) if ok])
 
-        priority_bands = getattr(config, 'MARITIME_PRIORITY_BANDS', [])
+        return self._format_available(cand_rounded, tx_usable_arr, tx_maps, rx_eval, is_duplex, duplex_spacing)
 
-        def _eval_freq(f_val):
-            f_val_rounded = round(f_val, 5)
-            df_subset = self.df[np.abs(self.df['freq'] - f_val_rounded) < 0.035]
-            
-            for _, row in df_subset.iterrows():
-                delta_f = abs(f_val_rounded - row['freq']) * 1000 
-                
-                # 1. LUỒNG LƯU ĐỘNG / GIỮ CHỖ
-                if row.get('is_holding', False):
-                    emission = str(row.get('raw_emission', '')).upper()
-                    if '50K' in emission:
-                        guard_band = 43.75
-                    elif '16K' in emission:
-                        guard_band = 31.25
-                    else:
-                        guard_band = 31.25
-                        
-                    if delta_f <= guard_band:
-                        return False, {} 
-                    continue 
+    def _format_available(self, cand_rounded, tx_usable_arr, tx_maps, rx_eval, is_duplex, duplex_spacing):
+        """Kết quả tinh_toan (AvailableFrequencies đã xếp hạng) từ kết quả đánh giá Tx / Rx."""
+        return rank_available(self._available_columns(cand_rounded, tx_usable_arr, tx_maps, rx_eval, is_duplex, duplex_spacing))
 
-                # 2. LUỒNG CỐ ĐỊNH
-                if not row.get('has_coords', False): 
-                    continue 
-                    
-                try:
-                    dist_km = geodesic((user_input['lat'], user_input['lon']), (row['lat'], row['lon'])).km
-                except: 
-                    continue
-                
-                rx_bw = row['bw']
-                db_net_type = row['net_type'] 
-                
-                actual_user_mode = user_mode_tuple
-                if "LAN" in user_mode_tuple[0]:
-                    if (418.5 <= f_val_rounded <= 419.5) or (428.5 <= f_val_rounded <= 429.5):
-                        actual_user_mode = ("WAN_DUPLEX", "WAN_DUPLEX")
-                
-                req_dist = self.get_required_distance(band, actual_user_mode, db_net_type, bw, delta_f, rx_bw)
-                if dist_km < req_dist:
-                    return False, {} 
-            
-            df_exact = self.df[np.abs(self.df['freq'] - f_val_rounded) < 0.00001]
-            lic_dist_map = {} 
-
-            for _, row_e in df_exact.iterrows():
-                raw_lic = str(row_e['license']).strip()
-                if raw_lic.lower() in ['nan', 'none', '', 'nan/gp']: continue
-                
-                short_lic = raw_lic.split('/')[0]
-                d_km = 0
-                if row_e['has_coords']:
-                    try:
-                        d_km = geodesic((user_input['lat'], user_input['lon']), (row_e['lat'], row_e['lon'])).km
-                    except: pass
-                
-                if short_lic not in lic_dist_map:
-                    lic_dist_map[short_lic] = d_km
-                else:
-                    if d_km < lic_dist_map[short_lic]:
-                        lic_dist_map[short_lic] = d_km
-                        
-            return True, lic_dist_map
-
-        for f_check in candidates:
-            f_check_rounded = round(f_check, 5)
-            
+    def _available_columns(self, cand_rounded, tx_usable_arr, tx_maps, rx_eval, is_duplex, duplex_spacing):
+        """AvailableFrequencies (theo thứ tự lưới, chưa xếp hạng) của các ứng viên khả dụng; không dựng chuỗi nào."""
+        tx_freqs, rx_freqs, counts, names, dists = [], [], [], [], []
+        for f_tx, tx_usable, tx_map in zip(cand_rounded, tx_usable_arr, tx_maps):
+            if not tx_usable: continue
+            lic_map = tx_map
             if is_duplex:
-                f_tx = f_check_rounded
                 f_rx = round(f_tx + duplex_spacing, 5)
-                
-                tx_usable, tx_map = _eval_freq(f_tx)
-                if not tx_usable: continue
-                
-                rx_usable, rx_map = _eval_freq(f_rx)
+                rx_usable, rx_map = rx_eval[f_rx]
                 if not rx_usable: continue
-                
+
                 # Trộn map (Chọn k/c nhỏ nhất nếu trùng GP)
-                merged_map = {**tx_map}
+                lic_map = {**tx_map}
                 for lic, dist in rx_map.items():
-                    if lic not in merged_map or dist < merged_map[lic]:
-                        merged_map[lic] = dist
-                        
-                sorted_items = sorted(merged_map.items(), key=lambda x: x[1])
-                list_formatted = []
-                for lic, dist in sorted_items:
-                    list_formatted.append(f"{lic}({int(dist)})")
+                    if lic not in lic_map or dist < lic_map[lic]:
+                        lic_map[lic] = dist
+                rx_freqs.append(f_rx)
+            tx_freqs.append(f_tx)
+            counts.append(len(lic_map))
+            names.extend(lic_map.keys())
+            dists.extend(lic_map.values())
+
+        tx_freqs = np.array(tx_freqs, dtype=float)
+        rx_freqs = np.array(rx_freqs, dtype=float)
+        is_priority = np.zeros(len(tx_freqs), dtype=bool)
+        for p_start, p_end in getattr(config, 'MARITIME_PRIORITY_BANDS', []):
+            is_priority |= (p_start <= tx_freqs) & (tx_freqs <= p_end)
+            if is_duplex:
+                is_priority |= (p_start <= rx_freqs) & (rx_freqs <= p_end)
+
+        # GP trong mỗi dòng xếp theo khoảng cách tăng dần (ổn định: bằng nhau giữ thứ tự gặp)
+        counts = np.array(counts, dtype=np.int64)
+        dists = np.array(dists, dtype=float)
+        order = np.lexsort((dists, np.repeat(np.arange(len(counts)), counts)))
+        return AvailableFrequencies(freq_to_key(tx_freqs), freq_to_key(rx_freqs) if is_duplex else None, is_priority,
+                                    np.concatenate([[0], np.cumsum(counts)]), np.array(names, dtype=object)[order],
+                                    dists[order])
+
+    def tinh_toan_stream(self, user_input, chunk_size=STREAM_CHUNK_CANDIDATES, progress=None):
+        """
+        Như tinh_toan nhưng trả dần: lưới ứng viên được đánh giá theo từng đoạn chunk_size (song công: Tx của đoạn
+        rồi Rx của các Tx khả dụng), mỗi đoạn yield một AvailableFrequencies gồm các tần số khả dụng mới xác nhận
+        theo thứ tự lưới (chưa xếp hạng). rank_available(các phần đã nhận) cho đúng kết quả của tinh_toan; khi chạy
+        hết, kết quả đó được ghi vào cache nên lần gọi tinh_toan sau với cùng đầu vào không phải tính lại.
+        Lượt quét chạy trên state_snapshot() lấy lúc gọi, không giữ khóa giữa các lần yield: người đọc chậm hoặc
+        bỏ dở không chặn apply_delta, và kho mới công bố giữa chừng không lẫn vào kết quả đang trả.
+        """
+        yield from self.state_snapshot()._tinh_toan_stream(user_input, chunk_size, progress)
+
+    def _tinh_toan_stream(self, user_input, chunk_size, progress):
+        if self.df.empty or 'freq' not in self.df.columns:
+            return
+        key = self.query_cache_key("tinh_toan", user_input)
+        cached = QUERY_RESULT_CACHE.get(key)
+        if cached is not None:
+            yield cached
+            return
 
-                unique_count = len(list_formatted)
-                license_str = ", ".join(list_formatted)
-                
-                is_priority = False
-                for p_start, p_end in priority_bands:
-                    if (p_start <= f_tx <= p_end) or (p_start <= f_rx <= p_end):
-                        is_priority = True
-                        break
+        is_duplex = user_input.get('is_duplex', False)
+        duplex_spacing = user_input.get('duplex_spacing', 0)
+        user_mode_tuple = self.xac_dinh_kich_ban_user(user_input)
+        band = user_input['band']
+        bw = user_input['bw']
+        user_province_clean = chuan_hoa_text(str(user_input.get('province_code', '')))
+        candidates = self.generate_candidates(band, bw, user_input['usage_mode'], user_province_clean,
+                                              user_input.get('scan_start', 0), user_input.get('scan_end', 0))
+        cand_rounded = [round(f, 5) for f in candidates]
+        if progress is not None: progress.expect(len(cand_rounded))
+
+        # Tiến độ tính theo ứng viên của lưới (kiểm tra cờ hủy mỗi đoạn); kết quả theo kênh dùng chung cả lượt quét
+        verdicts = ChannelVerdicts(self, [user_input], user_mode_tuple, band, bw)
+        chunk_size = max(int(chunk_size), 1)
+        parts = []
+        for c0 in range(0, len(cand_rounded), chunk_size):
+            if progress is not None: progress.check()
+            chunk = cand_rounded[c0:c0 + chunk_size]
+            tx_usable_arr, tx_maps = verdicts.lookup(chunk)
+            rx_eval = {}
+            if is_duplex:
+                rx_eval = verdicts.pairs([round(f + duplex_spacing, 5) for f, ok in zip(chunk, tx_usable_arr) if ok])
+            if progress is not None: progress.advance(len(chunk))
+            part = self._available_columns(chunk, tx_usable_arr, tx_maps, rx_eval, is_duplex, duplex_spacing)
+            parts.append(part)
+            if len(part):
+                yield part
 
-                results.append({
-                    "frequency": f"{f_tx:.5f} / {f_rx:.5f}", 
-                    "reuse_factor": int(unique_count),
-                    "license_list": license_str,
-                    "is_priority": is_priority 
-                })
-                
-            else:
-                usable, l_map = _eval_freq(f_check_rounded)
-                if usable:
-                    sorted_items = sorted(l_map.items(), key=lambda x: x[1])
-                    list_formatted = []
-                    for lic, dist in sorted_items:
-                        list_formatted.append(f"{lic}({int(dist)})")
-
-                    unique_count = len(list_formatted)
-                    license_str = ", ".join(list_formatted)
-                    
-                    is_priority = False
-                    for p_start, p_end in priority_bands:
-                        if p_start <= f_check_rounded <= p_end:
-                            is_priority = True
-                            break
-
-                    results.append({
-                        # Đã cập nhật thành String ép định dạng để tránh Streamlit làm tròn
-                        "frequency": f"{f_check_rounded:.5f}", 
-                        "reuse_factor": int(unique_count),
-                        "license_list": license_str,
-                        "is_priority": is_priority 
-                    })
-        
-        # Sort và format kết quả
-        results.sort(key=lambda x: (x['is_priority'], -x['reuse_factor']))
-        
-        for i, item in enumerate(results):
-            new_item = {
-                "STT": i + 1,
-                "frequency": item["frequency"],
-                "reuse_factor": item["reuse_factor"],
-                "license_list": item["license_list"],
-                "is_priority": item["is_priority"]
-            }
-            results[i] = new_item
-            
-        return results
\ No newline at end of file
+        QUERY_RESULT_CACHE.put(key, rank_available(parts))
+
+    # =========================================================================
+    # HÀM 4: TÍNH TOÁN HÀNG LOẠT NHIỀU VỊ TRÍ
+    # =========================================================================
+    def tinh_toan_hang_loat(self, user_inputs):
+        """
+        Tính tần số khả dụng cho nhiều hồ sơ (VD bảng 50-300 hồ sơ chờ cấp phép) trong một lần gọi.
+        user_inputs: list dict hoặc DataFrame, mỗi dòng có các khóa như user_input của tinh_toan
+        (ô trống / NaN coi như không khai báo).
+        Các dòng cùng scenario_key dùng chung lưới ứng viên và ma trận Δf / khoảng cách yêu cầu
+        (_eval_freqs_sites); dòng đã có trong cache kết quả không phải tính lại.
+        Trả về list (cùng thứ tự) các dict {"results": danh sách như tinh_toan, "error": None hoặc thông báo lỗi}.
+        """
+        with self._state_lock.read():
+            return self._tinh_toan_hang_loat(user_inputs)
+
+    def _tinh_toan_hang_loat(self, user_inputs):
+        if isinstance(user_inputs, pd.DataFrame):
+            user_inputs = user_inputs.to_dict('records')
+        inputs = [{k: v for k, v in dict(ui).items() if not (isinstance(v, float) and math.isnan(v))} for ui in user_inputs]
+        out = [{"results": [], "error": None} for _ in inputs]
+        if self.df.empty or 'freq' not in self.df.columns:
+            return out
+
+        # --- 1. Tra cache kết quả, gom các dòng còn lại theo kịch bản ---
+        groups = OrderedDict()
+        for i, user_input in enumerate(inputs):
+            try:
+                missing = [k for k in ('lat', 'lon', 'band', 'bw', 'usage_mode') if k not in user_input]
+                if missing:
+                    raise ValueError(f"thiếu {', '.join(missing)}")
+                key = self.query_cache_key("tinh_toan", user_input)
+                cached = QUERY_RESULT_CACHE.get(key)
+                if cached is not None:
+                    out[i]["results"] = copy_query_result(cached)
+                    continue
+                groups.setdefault(self.scenario_key(user_input), []).append((i, key))
+            except Exception as e:
+                out[i]["error"] = f"Dòng {i + 1}: dữ liệu đầu vào không hợp lệ ({e})"
+
+        # --- 2. Mỗi kịch bản: một lưới ứng viên, một lượt quét ma trận cho mọi vị trí ---
+        for rows in groups.values():
+            first = inputs[rows[0][0]]
+            try:
+                is_duplex = first.get('is_duplex', False)
+                duplex_spacing = first.get('duplex_spacing', 0)
+                user_mode_tuple = self.xac_dinh_kich_ban_user(first)
+                band = first['band']
+                bw = first['bw']
+                user_province_clean = chuan_hoa_text(str(first.get('province_code', '')))
+                candidates = self.generate_candidates(band, bw, first['usage_mode'], user_province_clean,
+                                                      first.get('scan_start', 0), first.get('scan_end', 0))
+                site_inputs = [inputs[i] for i, _ in rows]
+                cand_rounded = [round(f, 5) for f in candidates]
+                verdicts = ChannelVerdicts(self, site_inputs, user_mode_tuple, band, bw)
+                verdicts.evaluate(cand_rounded)
+                tx_evals = [verdicts.lookup(cand_rounded, s) for s in range(len(rows))]
+                rx_evals = [{} for _ in rows]
+                if is_duplex and cand_rounded:
+                    rx_list = sorted({round(f + duplex_spacing, 5) for usable, _ in tx_evals
+                                      for f, ok in zip(cand_rounded, usable) if ok})
+                    verdicts.evaluate(rx_list)
+                    rx_evals = [verdicts.pairs(rx_list, s) for s in range(len(rows))]
+
+                for s, (i, key) in enumerate(rows):
+                    if cand_rounded:
+                        tx_usable_arr, tx_maps = tx_evals[s]
+                        results = self._format_available(cand_rounded, tx_usable_arr, tx_maps, rx_evals[s], is_duplex, duplex_spacing)
+                    else:
+                        results = AvailableFrequencies.empty(is_duplex)
+                    QUERY_RESULT_CACHE.put(key, results)
+                    out[i]["results"] = copy_query_result(results)
+            except Exception as e:
+                logger.exception("Lỗi tính toán hàng loạt")
+                for i, _ in rows:
+                    out[i]["error"] = f"Dòng {i + 1}: lỗi tính toán ({e})"
+        return out
+
+# ====================================================================
+# BỘ DỮ LIỆU GỐC DÙNG CHUNG (MASTER) - TỰ NẠP LẠI KHI FILE THAY ĐỔI
+# ====================================================================
+class MasterDataset:
+    """
+    Một Tool dựng từ file dữ liệu gốc trên máy chủ, dùng chung (chỉ đọc) cho mọi phiên.
+    - get() trả về instance hiện hành; tối đa mỗi check_interval giây kiểm tra mtime/size của file một lần.
+    - File thay đổi thì dựng instance mới trong luồng nền rồi thay tham chiếu (atomic), các phép tính
+      đang chạy vẫn giữ instance cũ nên không bị chặn; dựng lỗi thì giữ nguyên instance cũ.
+    """
+
+    def __init__(self, path, check_interval=30.0, loader=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.loader = loader or ToolAnDinhTanSo
+        self.loaded_at = None
+        self.last_error = None
+        self._tool = None
+        self._stamp = None
+        self._failed_stamp = None
+        self._last_check = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def load(self):
+        """Dựng instance đồng bộ (lần đầu khởi động); file chưa có thì get() nạp khi file xuất hiện."""
+        stamp = self._file_stamp()
+        if stamp is not None:
+            self._reload(stamp)
+        return self._tool
+
+    def get(self):
+        self._maybe_reload()
+        return self._tool
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._reloading or now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp or stamp == self._failed_stamp:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(stamp,), daemon=True, name="pmr-master-reload").start()
+
+    def _reload(self, stamp):
+        try:
+            tool = self.loader(self.path)
+            with self._lock:
+                self._tool = tool
+                self._stamp = stamp
+                self.loaded_at = time.time()
+                self.last_error = None
+            logger.info(f"Đã nạp dữ liệu gốc {self.path}: {len(tool.df)} trạm")
+        except Exception as e:
+            with self._lock:
+                self._failed_stamp = stamp
+                self.last_error = str(e)
+            logger.error(f"Lỗi nạp dữ liệu gốc {self.path}: {e}")
+        finally:
+            with self._lock:
+                self._reloading = False
@@ -0,0 +1,129 @@
+import io
+import csv
+import pandas as pd
+from openpyxl.styles import Font
+
+# =============================================================================
+# XUẤT KẾT QUẢ (DÙNG CHUNG CHO GIAO DIỆN STREAMLIT VÀ CHẠY HÀNG LOẠT)
+# =============================================================================
+# Nhãn bảng "I. THÔNG SỐ ĐẦU VÀO" trong file kết quả
+INPUT_SNAPSHOT_LABELS = ["Phiên bản App", "Kinh độ", "Vĩ độ", "Tỉnh / TP", "Độ cao Anten (m)", "Dải tần", "Phạm vi quét", "Băng thông", "Loại mạng", "Số lượng xin"]
+
+# Tên cột khi xuất kết quả tinh_toan
+AVAILABLE_EXPORT_COLUMNS = {
+    "STT": "STT",
+    "frequency": "Tần số Khả dụng (MHz)",
+    "reuse_factor": "Hệ số Tái sử dụng",
+    "license_list": "Các GP sử dụng tần số này (kèm khoảng cách)"
+}
+
+# Tên cột danh sách giấy phép gây nhiễu của kiem_tra_tan_so_cu_the
+CONFLICT_EXPORT_COLUMNS = {
+    "license": "Số Giấy Phép",
+    "customer": "Tên Khách Hàng",
+    "freq_conflict": "Tần số GP (MHz)",
+    "address": "Địa chỉ trạm",
+    "type": "Loại nhiễu"
+}
+
+def neutralize_excel_value(val):
+    if pd.isna(val): return val
+    s = str(val)
+    if s and s[0] in ('=', '+', '-', '@'): return "'" + s
+    return s
+def neutralize_df_for_excel(df):
+    """Xử lý rác Excel, tương thích cả Pandas cũ (applymap) và mới (map)"""
+    try:
+        # Kiểm tra nếu Pandas là bản mới (có hàm map)
+        if hasattr(df, 'map'):
+            try:
+                return df.map(neutralize_excel_value)
+            except Exception:
+                return df.astype(str).map(neutralize_excel_value)
+        # Nếu là Pandas bản cũ
+        else:
+            try:
+                return df.applymap(neutralize_excel_value)
+            except Exception:
+                return df.astype(str).applymap(neutralize_excel_value)
+    except Exception:
+        return df # Fallback an toàn nếu có lỗi bất ngờ
+def to_excel(df_input, df_result):
+    output = io.BytesIO()
+    if df_input is not None: df_input_safe = neutralize_df_for_excel(df_input.copy())
+    else: df_input_safe = None
+    if 'is_priority' in df_result.columns: df_result_clean = df_result.drop(columns=['is_priority'])
+    else: df_result_clean = df_result
+    df_result_safe = neutralize_df_for_excel(df_result_clean.copy())
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        sheet_name = 'KET_QUA_TINH_TOAN'
+        start_row_result = 1
+        if df_input_safe is not None:
+            df_input_safe.to_excel(writer, index=False, sheet_name=sheet_name, startrow=1)
+            start_row_result = len(df_input_safe) + 5
+        df_result_safe.to_excel(writer, sheet_name=sheet_name, startrow=start_row_result, index=False)
+        worksheet = writer.sheets[sheet_name]
+        if df_input_safe is not None:
+            worksheet.cell(row=1, column=1, value="I. THÔNG SỐ ĐẦU VÀO").font = Font(bold=True, size=11)
+            worksheet.cell(row=start_row_result, column=1, value="II. KẾT QUẢ TÍNH TOÁN").font = Font(bold=True, size=11)
+        else:
+            worksheet.cell(row=start_row_result, column=1, value="DANH SÁCH KẾT QUẢ")
+    return output.getvalue()
+
+def to_csv(df_input, df_result):
+    """Cùng bố cục với to_excel (tiêu đề, bảng thông số, 2 dòng trống, bảng kết quả) dưới dạng CSV UTF-8."""
+    if df_input is not None: df_input_safe = neutralize_df_for_excel(df_input.copy())
+    else: df_input_safe = None
+    if 'is_priority' in df_result.columns: df_result_clean = df_result.drop(columns=['is_priority'])
+    else: df_result_clean = df_result
+    df_result_safe = neutralize_df_for_excel(df_result_clean.copy())
+
+    rows = []
+    if df_input_safe is not None:
+        rows.append(["I. THÔNG SỐ ĐẦU VÀO"])
+        rows.append(list(df_input_safe.columns))
+        rows.extend(df_input_safe.astype(object).where(df_input_safe.notna(), "").values.tolist())
+        rows.extend([[], []])
+        rows.append(["II. KẾT QUẢ TÍNH TOÁN"])
+    else:
+        rows.append(["DANH SÁCH KẾT QUẢ"])
+    rows.append(list(df_result_safe.columns))
+    rows.extend(df_result_safe.astype(object).where(df_result_safe.notna(), "").values.tolist())
+
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerows(rows)
+    return output.getvalue().encode('utf-8-sig')
+
+# =============================================================================
+# BẢNG KẾT QUẢ ĐỂ HIỂN THỊ / XUẤT FILE
+# =============================================================================
+def available_export_frame(results, limit=None):
+    """Kết quả tinh_toan (AvailableFrequencies hoặc list dict) -> bảng xuất file (giữ is_priority, to_excel tự bỏ)."""
+    if hasattr(results, 'to_frame'):
+        df_export = results.to_frame(limit)
+    else:
+        df_export = pd.DataFrame(results[:limit]).copy()
+    df_export.rename(columns=AVAILABLE_EXPORT_COLUMNS, inplace=True)
+    return df_export
+
+def unavailable_export_frame(bad_list):
+    """Kết quả tim_cac_tan_so_khong_kha_dung -> bảng, gộp khoảng cách thực tế / chỉ tiêu thành một cột."""
+    df_bad = pd.DataFrame(bad_list)
+
+    if "Khoảng cách thực tế (km)" in df_bad.columns and "Khoảng cách yêu cầu (km)" in df_bad.columns:
+         df_bad["Khoảng cách thực tế/Chỉ tiêu"] = df_bad.apply(lambda x: f"{x['Khoảng cách thực tế (km)']:.2f}/{x['Khoảng cách yêu cầu (km)']:.2f}", axis=1)
+         df_bad.drop(columns=["Khoảng cách thực tế (km)", "Khoảng cách yêu cầu (km)"], inplace=True)
+    elif "dist_km" in df_bad.columns and "req_dist_km" in df_bad.columns:
+         df_bad["Khoảng cách thực tế/Chỉ tiêu"] = df_bad.apply(lambda x: f"{x['dist_km']:.2f}/{x['req_dist_km']:.2f}", axis=1)
+         df_bad.drop(columns=["dist_km", "req_dist_km"], inplace=True)
+    return df_bad
+
+def conflict_export_frame(conflicts):
+    """Danh sách giấy phép gây nhiễu của kiem_tra_tan_so_cu_the -> bảng hiển thị."""
+    df_conflict = pd.DataFrame(conflicts)
+    if not df_conflict.empty:
+        df_conflict["Khoảng cách thực tế/Chỉ tiêu"] = df_conflict.apply(lambda x: f"{x['dist_km']:.2f}/{x['req_dist_km']:.2f}", axis=1)
+        df_conflict.drop(columns=["dist_km", "req_dist_km"], inplace=True)
+
+        df_conflict.rename(columns=CONFLICT_EXPORT_COLUMNS, inplace=True)
+    return df_conflict